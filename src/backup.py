@@ -1,104 +1,528 @@
-"""Makes backups of Delphi files and databases."""
+"""
+===============
+=== Purpose ===
+===============
+
+Makes backups of Delphi files and databases.
+
+A backup is a plan of stages, run in order:
+
+  - prepare: check there is room for a new backup
+  - archive: tar and gzip each directory into its own archive (*.tgz)
+  - dump: mysqldump all databases at once into a single archive (*.sql.gz)
+  - bundle: tar the archives above into `backup_<tag>.tar` and write its
+    manifest
+  - verify: check the final archive against its manifest, and record that it
+    passed
+  - ship: copy the final archive to other places, e.g. offsite
+  - prune: delete old verified backups under the retention policy
+
+If a stage fails before the final archive is verified, the files this run
+wrote are deleted, so partial archives don't pile up.
+
+Compression happens as the archive and dump stages stream their output to
+disk, not as a separate pass, so those stages report how their time was split
+between reading and compressing. Each stage reports its own timing, and the
+timings are saved in the manifest.
+
+What is backed up, and how, is set by `DEFAULT_CONFIG`, which can be
+overridden by a JSON file given with `--config`. Any top-level key of the
+file replaces the corresponding default. Use `--dry-run` to print the plan
+without running it, `--stages` to run only some of the stages, and
+`--benchmark` to time the plan against a scratch directory that is deleted
+afterwards.
+"""
 
 # standard library
+import abc
+import argparse
+import copy
 import datetime
+import json
 import os
-import subprocess
+import shutil
+import tempfile
 import time
 
 # first party
+from delphi.operations.backup_manifest import build_archive, DumpRowCounter, get_manifest_path, mark_verified, read_manifest, stream_command_to_file, verify_archive, write_manifest, VerificationException
+from delphi.operations.backup_priority import IONICE_BEST_EFFORT, lower_priority
+from delphi.operations.backup_retention import BackupRotator, RetentionPolicy, TAG_FORMAT
+from delphi.operations.backup_transfer import LocalDestination, RateLimiter, S3Destination, Transfer
 import delphi.operations.secrets as secrets
 
 
-#General setup
-dest = '/home/automation/backups'
-tag = datetime.datetime.today().strftime('%Y%m%d_%H%M%S')
-print('Destination: %s | Tag: %s'%(dest, tag))
-
-#Directories
-dirs = [
-  {
-    'label': 'auto',
-    'path': '/home/automation',
-    'name': 'driver',
-    'exclude': 'flu_data',
-  }, {
-    'label': 'data',
-    'path': '/home/automation/driver',
-    'name': 'flu_data',
+DEFAULT_CONFIG = {
+  # where backups are written
+  'dest': '/home/automation/backups',
+
+  # each directory is backed up to its own archive
+  'directories': [
+    {
+      'label': 'auto',
+      'path': '/home/automation',
+      'name': 'driver',
+      'exclude': ['flu_data'],
+    }, {
+      'label': 'data',
+      'path': '/home/automation/driver',
+      'name': 'flu_data',
+      'exclude': [],
+    },
+    # previously backed-up paths
+    # {'label': 'html', 'path': '/var/www', 'name': 'html'},
+    # {'label': 'keys', 'path': <dirname of secrets.apache.keys_dir>, 'name': <basename>},
+  ],
+
+  # all databases are dumped together, except for the ignored tables
+  'databases': ['automation', 'epicast2', 'epidata', 'utils'],
+  # TODO Revert when big tables are gone
+  'ignore_tables': [
+    'epidata.covidcast_legacy',
+    'epidata.covidcast_backup',
+    'epidata.covidcast',
+  ],
+  # --quick streams rows instead of buffering whole tables, --single-transaction
+  # avoids locking InnoDB tables, and --net-buffer-length sets the size of each
+  # extended INSERT batch
+  'dump_options': ['--quick', '--single-transaction', '--net-buffer-length=1048576'],
+
+  # gzip level for directory archives and the database dump
+  'compress_level': 6,
+
+  # grandfather-father-son retention, and the free space required relative to
+  # the largest recent backup
+  'retention': {'daily': 7, 'weekly': 4, 'monthly': 6},
+  'space_headroom': 2.0,
+
+  # trade a longer backup for steady latency of the API and database on this
+  # host; niceness and I/O class are inherited by tar and mysqldump, and limits
+  # are in bytes/second (null for no cap)
+  'throttle': {
+    'nice': 19,
+    'ionice_class': IONICE_BEST_EFFORT,
+    'ionice_level': 7,
+    # uncompressed bytes read from the directories being archived
+    'read_limit': 50 * 2**20,
+    # bytes read from mysqldump, which throttles the server sending it
+    'dump_limit': None,
   },
-]
 
-# previously backed-up paths
-# keys_path, keys_name = os.path.split(secrets.apache.keys_dir)
-# {
-#   'label': 'html',
-#   'path': '/var/www',
-#   'name': 'html',
-# },
-# {
-#   'label': 'keys',
-#   'path': keys_path,
-#   'name': keys_name,
-# },
-
-#Databases
-dbs = [
-  'automation',
-  'epicast2',
-  'epidata',
-  'utils',
+  # number of archive members hashed in parallel by the verify stage
+  'verify_workers': 4,
+
+  # copies of the final archive, e.g.
+  # {'type': 'local', 'path': '/mnt/usb2t/backups'}
+  # {'type': 's3', 'prefix': 'backups/', 'limit': 20971520}
+  # s3 destinations default to the endpoint, bucket, and keys in secrets.offsite
+  'destinations': [],
+}
+
+
+class InvalidArgsException(Exception):
+  """An Exception indicating that command-line args are invalid."""
+
+
+def load_config(path=None):
+  """Return the default config, overridden by the given JSON file if any."""
+  config = copy.deepcopy(DEFAULT_CONFIG)
+  if path is not None:
+    with open(path) as file:
+      config.update(json.load(file))
+  return config
+
+
+def get_destination(spec):
+  """Return a transfer destination for an entry of `destinations`."""
+  if spec['type'] == 'local':
+    return LocalDestination(spec['path'])
+  if spec['type'] == 's3':
+    return S3Destination.new_instance(
+        spec.get('endpoint', secrets.offsite.endpoint),
+        spec.get('bucket', secrets.offsite.bucket),
+        *spec.get('keys', secrets.offsite.keys),
+        prefix=spec.get('prefix', ''))
+  raise ValueError('unknown destination type: %s' % spec['type'])
+
+
+def get_size(record):
+  """Return a short, human-readable summary of a manifest record."""
+  return '%.1fM in %.1fs' % (record['bytes'] / 2**20, record['seconds'])
+
+
+class BackupState:
+  """Everything that one run of a backup produces, shared between stages."""
+
+  def __init__(self, config, tag):
+    self.config = config
+    self.tag = tag
+    self.dest = config['dest']
+    # manifest records of the archives to bundle
+    self.records = []
+    # manifest record of the final archive
+    self.archive = None
+    # timing of each stage that has run
+    self.timings = []
+    # files written by this run, deleted if it fails before verification
+    self.created = []
+    # whether the final archive passed verification in this run
+    self.verified = False
+
+  def path(self, name):
+    """Return the full path of a file in the destination directory."""
+    return os.path.join(self.dest, name)
+
+  def create(self, name):
+    """Return the full path of a file this run is about to write."""
+    path = self.path(name)
+    self.created.append(path)
+    return path
+
+  def remove_created(self):
+    """Delete the files written by this run which still exist."""
+    for path in self.created:
+      if os.path.exists(path):
+        print(' removing %s' % os.path.basename(path))
+        os.remove(path)
+
+  @property
+  def final_archive(self):
+    return self.path('backup_%s.tar' % self.tag)
+
+
+class Stage(abc.ABC):
+  """
+  A step of a backup. Subclasses describe what they would do in `plan` and do
+  it in `run`.
+  """
+
+  name = None
+
+  @abc.abstractmethod
+  def plan(self, state):
+    """Return a list of lines describing what `run` would do."""
+
+  @abc.abstractmethod
+  def run(self, state):
+    """Run the stage and return the number of bytes produced, or None."""
+
+
+class PrepareStage(Stage):
+  """Checks that there is room for a new backup."""
+
+  name = 'prepare'
+
+  def plan(self, state):
+    return [
+      'require %.1fx the largest recent backup in free space' % state.config['space_headroom'],
+    ]
+
+  def run(self, state):
+    rotator = BackupRotator.new_instance(state.dest)
+    free, needed = rotator.check_free_space(state.config['space_headroom'])
+    print(' Free space: %d MB (need %d MB)' % (free // 2**20, needed // 2**20))
+
+
+class ArchiveStage(Stage):
+  """Archives and compresses each configured directory."""
+
+  name = 'archive'
+
+  def _command(self, directory):
+    excludes = directory.get('exclude') or []
+    if isinstance(excludes, str):
+      excludes = [excludes]
+    args = ['--exclude %s' % exclude for exclude in excludes]
+    return 'tar -c -C %s %s' % (directory['path'], ' '.join(args + [directory['name']]))
+
+  def _file(self, state, directory):
+    return 'backup_%s_%s.tgz' % (state.tag, directory['label'])
+
+  def plan(self, state):
+    return [
+      '%s | gzip > %s' % (self._command(d), self._file(state, d))
+      for d in state.config['directories']
+    ]
+
+  def run(self, state):
+    total = 0
+    for directory in state.config['directories']:
+      print(' Directory: %s/%s' % (directory['path'], directory['name']))
+      # the archive is compressed here rather than by tar, so the read cap
+      # applies to uncompressed bytes
+      record = stream_command_to_file(
+          self._command(directory),
+          state.create(self._file(state, directory)),
+          compress=True,
+          limiter=RateLimiter(state.config['throttle']['read_limit']),
+          compresslevel=state.config['compress_level'])
+      print(' %s (%.1fs reading)' % (get_size(record), record['read_seconds']))
+      state.records.append(record)
+      total += record['bytes']
+    return total
+
+
+class DumpStage(Stage):
+  """Dumps and compresses the configured databases."""
+
+  name = 'dump'
+
+  def _command(self, state, password):
+    config = state.config
+    return 'mysqldump %s --user=%s --password=%s --databases %s %s' % (
+        ' '.join(config['dump_options']),
+        secrets.db.backup[0],
+        password,
+        ' '.join(config['databases']),
+        ' '.join('--ignore-table=%s' % t for t in config['ignore_tables']))
+
+  def _file(self, state):
+    return 'backup_%s_database.sql.gz' % state.tag
+
+  def plan(self, state):
+    return ['%s | gzip > %s' % (self._command(state, '***'), self._file(state))]
+
+  def run(self, state):
+    print(' Databases: %s' % ' '.join(state.config['databases']))
+    # the dump is compressed and its rows are counted as it streams in
+    record = stream_command_to_file(
+        self._command(state, secrets.db.backup[1]),
+        state.create(self._file(state)),
+        compress=True,
+        row_counter=DumpRowCounter(),
+        limiter=RateLimiter(state.config['throttle']['dump_limit']),
+        compresslevel=state.config['compress_level'])
+    print(' %s (%.1fs reading)' % (get_size(record), record['read_seconds']))
+    state.records.append(record)
+    return record['bytes']
+
+
+class BundleStage(Stage):
+  """Bundles the archives into the final archive and writes its manifest."""
+
+  name = 'bundle'
+
+  def plan(self, state):
+    return [
+      'tar archives into %s' % os.path.basename(state.final_archive),
+      'write %s' % os.path.basename(get_manifest_path(state.final_archive)),
+    ]
+
+  def run(self, state):
+    if not state.records:
+      raise Exception('there are no archives to bundle')
+    print(' Building final archive')
+    names = [record['name'] for record in state.records]
+    state.archive = build_archive(
+        state.create(os.path.basename(state.final_archive)), state.dest, names)
+    print(' %s' % get_size(state.archive))
+    manifest_path = get_manifest_path(state.final_archive)
+    write_manifest(
+        state.create(os.path.basename(manifest_path)), state.tag, state.archive, state.records)
+    # delete the intermediate archives
+    for name in names:
+      os.remove(state.path(name))
+    return state.archive['bytes']
+
+
+class VerifyStage(Stage):
+  """Checks the final archive against its manifest."""
+
+  name = 'verify'
+
+  def plan(self, state):
+    return ['check %s against its manifest with %d workers' % (
+        os.path.basename(state.final_archive), state.config['verify_workers'])]
+
+  def run(self, state):
+    manifest_path = get_manifest_path(state.final_archive)
+    manifest = read_manifest(manifest_path)
+    problems = verify_archive(
+        state.final_archive, manifest, state.config['verify_workers'])
+    for problem in problems:
+      print(' %s' % problem)
+    if problems:
+      raise VerificationException('%s failed verification' % state.final_archive)
+    # only verified backups count towards retention
+    mark_verified(manifest_path)
+    state.verified = True
+
+
+class ShipStage(Stage):
+  """Copies the final archive to each configured destination."""
+
+  name = 'ship'
+
+  def plan(self, state):
+    return [
+      'send %s to %s at %s' % (
+          os.path.basename(state.final_archive),
+          spec.get('path') or 's3:%s' % spec.get('prefix', ''),
+          '%d bytes/s' % spec['limit'] if spec.get('limit') else 'full speed')
+      for spec in state.config['destinations']
+    ]
+
+  def run(self, state):
+    for spec in state.config['destinations']:
+      destination = get_destination(spec)
+      print(' Sending to %s' % destination)
+      Transfer(destination, RateLimiter(spec.get('limit'))).send(state.final_archive)
+
+
+class PruneStage(Stage):
+  """
+  Deletes old backups under the retention policy. This runs last, so the
+  backup just made is already verified and counts towards the policy.
+  """
+
+  name = 'prune'
+
+  def plan(self, state):
+    return ['prune verified backups in %s, keeping %s' % (
+        state.dest, state.config['retention'])]
+
+  def run(self, state):
+    rotator = BackupRotator.new_instance(state.dest)
+    rotator.prune(RetentionPolicy(**state.config['retention']))
+
+
+# the stages of a full backup, in order
+STAGES = [
+  PrepareStage(),
+  ArchiveStage(),
+  DumpStage(),
+  BundleStage(),
+  VerifyStage(),
+  ShipStage(),
+  PruneStage(),
 ]
 
-#Utils
-def get_size(file):
-  return str(subprocess.check_output('du -h %s/%s'%(dest, file), shell=True), 'utf-8').split('\t')[0]
-
-#Each directory is backed up to it's own archive (*.tgz)
-#All databases are backed up at once to a single archive (*.sql.gz)
-#This list of archives is used to create a final archive containing all the others
-archives = []
-
-#Backup directories
-for dir in dirs:
-  print(' Directory: %s/%s'%(dir['path'], dir['name']))
-  if 'exclude' not in dir or dir['exclude'] is None:
-    exclude = ''
-  else:
-    exclude = '--exclude %s'%(dir['exclude'])
-  file = 'backup_%s_%s.tgz'%(tag, dir['label'])
-  subprocess.check_call('tar -czf %s/%s -C %s %s %s'%(dest, file, dir['path'], exclude, dir['name']), shell=True)
-  print(' %s'%(get_size(file)))
-  archives.append(file)
-
-#Backup databases
-list = ' '.join(dbs)
-print(' Databases: %s'%(list))
-file = 'backup_%s_database.sql'%(tag)
-u, p = secrets.db.backup
-# TODO Revert when big tables are gone
-#subprocess.check_call('mysqldump --user=%s --password=%s --databases %s > %s/%s'%(u, p, list, dest, file), shell=True)
-subprocess.check_call('mysqldump --user=%s --password=%s --databases %s --ignore-table=epidata.covidcast_legacy --ignore-table=epidata.covidcast_backup --ignore-table=epidata.covidcast > %s/%s'%(u, p, list, dest, file), shell=True)
-subprocess.check_call('gzip %s/%s'%(dest, file), shell=True)
-file += '.gz'
-print(' %s'%(get_size(file)))
-archives.append(file)
-
-#Create the final archive
-print(' Building final archive')
-file = 'backup_%s.tar'%(tag)
-final_archive = '%s/%s'%(dest, file)
-subprocess.check_call('tar -cf %s -C %s %s'%(final_archive, dest, ' '.join(archives)), shell=True)
-print(' %s'%(get_size(file)))
-
-#Delete the intermediate archives
-for file in archives:
-  os.remove('%s/%s'%(dest, file))
-
-# TODO: Send the backup to an external drive
-# subprocess.check_call('cp -v %s /mnt/usb2t/backups/'%(final_archive), shell=True)
-
-# TODO: Send the backup offsite
-
-#Success
-print('Backup completed successfully!')
+
+class Backup:
+  """Runs a plan of backup stages, timing each one."""
+
+  @staticmethod
+  def new_instance(config, stage_names=None):
+    """Return an instance running the named stages, or all stages if None."""
+    stages = [s for s in STAGES if stage_names is None or s.name in stage_names]
+    return Backup(config, stages)
+
+  def __init__(self, config, stages):
+    self.config = config
+    self.stages = stages
+
+  def plan(self, tag):
+    """Return a list of lines describing what `run` would do."""
+    state = BackupState(self.config, tag)
+    lines = []
+    for stage in self.stages:
+      lines.append('%s:' % stage.name)
+      lines.extend('  %s' % line for line in stage.plan(state))
+    return lines
+
+  def run(self, tag):
+    """
+    Run each stage and return the list of stage timings, which are also saved
+    in the manifest when there is one.
+    """
+    throttle = self.config['throttle']
+    lower_priority(throttle['nice'], throttle['ionice_class'], throttle['ionice_level'])
+    print('Destination: %s | Tag: %s' % (self.config['dest'], tag))
+    state = BackupState(self.config, tag)
+    try:
+      for stage in self.stages:
+        print('[%s]' % stage.name)
+        start = time.time()
+        size = stage.run(state)
+        state.timings.append({
+          'stage': stage.name,
+          'seconds': time.time() - start,
+          'bytes': size,
+        })
+    except BaseException:
+      # a partial or broken archive must not be mistaken for a backup
+      if not state.verified:
+        state.remove_created()
+      raise
+    manifest_path = get_manifest_path(state.final_archive)
+    if os.path.exists(manifest_path):
+      manifest = read_manifest(manifest_path)
+      manifest['stages'] = manifest.get('stages', []) + state.timings
+      with open(manifest_path, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    return state.timings
+
+
+def format_timings(timings):
+  """Return a table of stage timings."""
+  total = sum(t['seconds'] for t in timings) or 1
+  lines = ['%-10s %10s %6s %12s' % ('stage', 'seconds', '%', 'MB')]
+  for t in timings:
+    size = '%.1f' % (t['bytes'] / 2**20) if t['bytes'] is not None else '-'
+    lines.append('%-10s %10.1f %6.1f %12s' % (
+        t['stage'], t['seconds'], 100 * t['seconds'] / total, size))
+  return '\n'.join(lines)
+
+
+def get_argument_parser():
+  """Define command line arguments and usage."""
+  names = [stage.name for stage in STAGES]
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--config', help='JSON file overriding the default config')
+  parser.add_argument(
+      '--stages',
+      help='comma-separated stages to run, from: %s (default: all)' % ','.join(names))
+  parser.add_argument(
+      '--tag',
+      help='timestamp tag of the backup (default: now), e.g. to verify or '
+           'ship a backup made earlier')
+  parser.add_argument(
+      '--dry-run', action='store_true', help='print the plan without running it')
+  parser.add_argument(
+      '--benchmark',
+      action='store_true',
+      help='run the plan, except for shipping, against a scratch directory '
+           'and report stage timings')
+  return parser
+
+
+def validate_args(args):
+  """Validate and return command line arguments."""
+  names = [stage.name for stage in STAGES]
+  if args.dry_run and args.benchmark:
+    raise InvalidArgsException('`dry_run` and `benchmark` are exclusive')
+  stages = None
+  if args.stages is not None:
+    stages = args.stages.split(',')
+    unknown = set(stages) - set(names)
+    if unknown:
+      raise InvalidArgsException('unknown stages: %s' % ', '.join(sorted(unknown)))
+  if args.benchmark:
+    stages = [name for name in (stages or names) if name != 'ship']
+  tag = args.tag or datetime.datetime.today().strftime(TAG_FORMAT)
+  try:
+    datetime.datetime.strptime(tag, TAG_FORMAT)
+  except ValueError:
+    raise InvalidArgsException('`tag` must look like %s' % TAG_FORMAT)
+  return (load_config(args.config), stages, tag, args.dry_run, args.benchmark)
+
+
+def main(config, stages, tag, dry_run, benchmark):
+  """Run this script from the command line."""
+  if benchmark:
+    config['dest'] = tempfile.mkdtemp(prefix='backup_benchmark_', dir=config['dest'])
+  backup = Backup.new_instance(config, stages)
+  if dry_run:
+    print('\n'.join(backup.plan(tag)))
+    return
+  try:
+    timings = backup.run(tag)
+  finally:
+    if benchmark:
+      shutil.rmtree(config['dest'])
+  print(format_timings(timings))
+  print('Backup completed successfully!')
+
+
+if __name__ == '__main__':
+  main(*validate_args(get_argument_parser().parse_args()))
@@ -0,0 +1,392 @@
+"""
+===============
+=== Purpose ===
+===============
+
+Records and checks the integrity of the archives made by `backup.py`.
+
+While a backup is being written, every member archive is streamed through
+`HashingWriter`, which computes its SHA-256 and byte count without a second
+read pass. Database dumps are additionally passed through `DumpRowCounter` to
+count the rows dumped for each table. These records, along with timing, are
+saved as a JSON manifest next to the final archive.
+
+The `verify` subcommand checks an archive against its manifest, hashing the
+members in parallel. The `restore` subcommand loads the database dump into a
+scratch MariaDB container (e.g. the `delphi_database` image from dev/docker)
+and compares the restored row counts with the manifest.
+"""
+
+# standard library
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import hashlib
+import json
+import os
+import re
+import subprocess
+import tarfile
+import time
+
+
+# size of the blocks read from pipes and archive members
+CHUNK_SIZE = 1 << 20
+
+# gzip compression level, matching the default of the `gzip` command
+COMPRESS_LEVEL = 6
+
+# the statements in a mysqldump which change the current database or table
+USE_PATTERN = re.compile(rb'^USE `([^`]+)`;')
+INSERT_PATTERN = re.compile(rb'^INSERT INTO `([^`]+)` VALUES ')
+
+
+class InvalidArgsException(Exception):
+  """An Exception indicating that command-line args are invalid."""
+
+
+class VerificationException(Exception):
+  """An Exception indicating that an archive doesn't match its manifest."""
+
+
+def get_manifest_path(archive_path):
+  """Return the path of the manifest which describes the given archive."""
+  return re.sub(r'\.tar$', '', archive_path) + '.manifest.json'
+
+
+class HashingWriter:
+  """
+  A write-only file wrapper which hashes and counts everything written through
+  it.
+  """
+
+  def __init__(self, file):
+    self.file = file
+    self.sha256 = hashlib.sha256()
+    self.bytes = 0
+
+  def write(self, data):
+    self.sha256.update(data)
+    self.bytes += len(data)
+    return self.file.write(data)
+
+  def flush(self):
+    self.file.flush()
+
+  def tell(self):
+    return self.bytes
+
+
+class DumpRowCounter:
+  """
+  Counts the rows inserted into each table by the lines of a mysqldump.
+
+  Rows are counted as the tuples of each extended INSERT statement, so a
+  string value containing the literal text `),(` is counted as an extra row.
+  """
+
+  def __init__(self):
+    self.database = None
+    self.rows = {}
+
+  def feed(self, line):
+    """Count the rows in one line of dump output."""
+    match = INSERT_PATTERN.match(line)
+    if match:
+      table = '%s.%s' % (self.database, match.group(1).decode('utf-8'))
+      count = line.count(b'),(') + 1
+      self.rows[table] = self.rows.get(table, 0) + count
+      return
+    match = USE_PATTERN.match(line)
+    if match:
+      self.database = match.group(1).decode('utf-8')
+
+
+def stream_to_file(source, path, compress=False, row_counter=None, limiter=None,
+                   compresslevel=COMPRESS_LEVEL):
+  """
+  Copy a binary stream to a file and return its manifest record.
+
+  The SHA-256 and byte count describe the file as written, i.e. after gzip
+  compression when `compress` is true. If a `DumpRowCounter` is given, the
+  stream is read by line and the uncompressed content is fed to the counter.
+  If a limiter (e.g. `backup_transfer.RateLimiter`) is given, the stream is
+  read no faster than it allows, which in turn throttles the producer.
+
+  The record splits the elapsed time into `read_seconds`, spent waiting on
+  the source and the limiter, and the remainder, spent compressing, hashing,
+  and writing.
+  """
+  start = time.time()
+  read_seconds = 0
+  with open(path, 'wb') as file:
+    writer = HashingWriter(file)
+    if compress:
+      sink = gzip.GzipFile(fileobj=writer, mode='wb', compresslevel=compresslevel)
+    else:
+      sink = writer
+    if row_counter is None:
+      blocks = iter(lambda: source.read(CHUNK_SIZE), b'')
+    else:
+      blocks = iter(source)
+    while True:
+      read_start = time.time()
+      block = next(blocks, b'')
+      if block and limiter is not None:
+        limiter.consume(len(block))
+      read_seconds += time.time() - read_start
+      if not block:
+        break
+      if row_counter is not None:
+        row_counter.feed(block)
+      sink.write(block)
+    if compress:
+      sink.close()
+  return {
+    'name': os.path.basename(path),
+    'sha256': writer.sha256.hexdigest(),
+    'bytes': writer.bytes,
+    'rows': None if row_counter is None else row_counter.rows,
+    'seconds': time.time() - start,
+    'read_seconds': read_seconds,
+  }
+
+
+def stream_command_to_file(command, path, compress=False, row_counter=None,
+                           limiter=None, compresslevel=COMPRESS_LEVEL):
+  """
+  Run a shell command, stream its output to a file, and return the file's
+  manifest record.
+  """
+  process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
+  try:
+    record = stream_to_file(
+        process.stdout, path, compress, row_counter, limiter, compresslevel)
+  finally:
+    process.stdout.close()
+    returncode = process.wait()
+  if returncode != 0:
+    raise subprocess.CalledProcessError(returncode, command)
+  return record
+
+
+def build_archive(path, directory, members):
+  """
+  Bundle the given files from `directory` into an uncompressed tar archive
+  and return its manifest record.
+  """
+  start = time.time()
+  with open(path, 'wb') as file:
+    writer = HashingWriter(file)
+    with tarfile.open(fileobj=writer, mode='w') as tar:
+      for name in members:
+        tar.add(os.path.join(directory, name), arcname=name)
+  return {
+    'name': os.path.basename(path),
+    'sha256': writer.sha256.hexdigest(),
+    'bytes': writer.bytes,
+    'seconds': time.time() - start,
+  }
+
+
+def write_manifest(path, tag, archive, members):
+  """Save a manifest for an archive and the records of its members."""
+  manifest = dict(archive, tag=tag, members=members)
+  with open(path, 'w') as file:
+    json.dump(manifest, file, indent=2)
+  return manifest
+
+
+def read_manifest(path):
+  """Load a manifest saved by `write_manifest`."""
+  with open(path) as file:
+    return json.load(file)
+
+
+def mark_verified(path):
+  """
+  Record in a manifest when its archive passed verification, which makes the
+  backup count towards retention in `backup_retention.py`.
+  """
+  manifest = read_manifest(path)
+  manifest['verified'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+  with open(path, 'w') as file:
+    json.dump(manifest, file, indent=2)
+  return manifest
+
+
+def hash_range(path, offset, size):
+  """Return the SHA-256 of `size` bytes of a file starting at `offset`."""
+  sha256 = hashlib.sha256()
+  with open(path, 'rb') as file:
+    file.seek(offset)
+    while size > 0:
+      chunk = file.read(min(size, CHUNK_SIZE))
+      if not chunk:
+        break
+      sha256.update(chunk)
+      size -= len(chunk)
+  return sha256.hexdigest()
+
+
+def verify_archive(archive_path, manifest, workers=4):
+  """
+  Return a list of problems found by checking an archive against its
+  manifest. An empty list means the archive is intact.
+
+  Members are stored uncompressed and contiguously in the final archive, so
+  each one is hashed directly from its byte range in the file, in parallel.
+  """
+  problems = []
+  size = os.path.getsize(archive_path)
+  if size != manifest['bytes']:
+    problems.append('archive is %d bytes, expected %d' % (size, manifest['bytes']))
+  try:
+    with tarfile.open(archive_path, mode='r:') as tar:
+      found = {m.name: m for m in tar.getmembers() if m.isfile()}
+  except tarfile.TarError as e:
+    return problems + ['archive is unreadable: %s' % e]
+
+  expected = {m['name']: m for m in manifest['members']}
+  for name in sorted(set(expected) - set(found)):
+    problems.append('%s: missing from archive' % name)
+  for name in sorted(set(found) - set(expected)):
+    problems.append('%s: not in manifest' % name)
+
+  names = sorted(set(expected) & set(found))
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    digests = executor.map(
+        lambda name: hash_range(
+            archive_path, found[name].offset_data, found[name].size),
+        names)
+    for name, digest in zip(names, digests):
+      if found[name].size != expected[name]['bytes']:
+        problems.append('%s: size is %d, expected %d' % (
+            name, found[name].size, expected[name]['bytes']))
+      elif digest != expected[name]['sha256']:
+        problems.append('%s: checksum mismatch' % name)
+  return problems
+
+
+class ScratchRestore:
+  """Restores a database dump into a throwaway MariaDB container."""
+
+  # how long to wait for the database server to accept connections
+  STARTUP_TIMEOUT = 120
+
+  @staticmethod
+  def new_instance(image='delphi_database'):
+    """Return a production-ready instance."""
+    return ScratchRestore(image, subprocess, time)
+
+  def __init__(self, image, subprocess, time):
+    self.image = image
+    self.subprocess = subprocess
+    self.time = time
+
+  def _mysql(self, container_id, sql):
+    """Run a query in the container and return its tab-separated output."""
+    output = self.subprocess.check_output([
+      'docker', 'exec', container_id,
+      'mysql', '-uroot', '-ppass', '--batch', '--skip-column-names', '-e', sql,
+    ])
+    return str(output, 'utf-8')
+
+  def _start(self):
+    """Start the container and wait until the server accepts connections."""
+    container_id = str(self.subprocess.check_output([
+      'docker', 'run', '--detach', '--rm', self.image,
+    ]), 'utf-8').strip()
+    deadline = self.time.time() + ScratchRestore.STARTUP_TIMEOUT
+    while self.time.time() < deadline:
+      try:
+        self._mysql(container_id, 'SELECT 1')
+        return container_id
+      except self.subprocess.CalledProcessError:
+        self.time.sleep(1)
+    self.subprocess.call(['docker', 'stop', container_id])
+    raise Exception('timeout waiting for %s to start' % self.image)
+
+  def restore(self, archive_path, manifest):
+    """
+    Load every gzipped SQL dump in the archive into a scratch container and
+    return a list of tables whose restored row counts differ from the
+    manifest.
+    """
+    container_id = self._start()
+    try:
+      problems = []
+      with tarfile.open(archive_path, mode='r:') as tar:
+        for record in manifest['members']:
+          if not record['name'].endswith('.sql.gz'):
+            continue
+          print(' restoring %s' % record['name'])
+          process = self.subprocess.Popen(
+              ['docker', 'exec', '-i', container_id, 'mysql', '-uroot', '-ppass'],
+              stdin=self.subprocess.PIPE)
+          with gzip.GzipFile(fileobj=tar.extractfile(record['name'])) as dump:
+            for chunk in iter(lambda: dump.read(CHUNK_SIZE), b''):
+              process.stdin.write(chunk)
+          process.stdin.close()
+          if process.wait() != 0:
+            raise Exception('failed to restore %s' % record['name'])
+          for table, rows in sorted((record['rows'] or {}).items()):
+            count = int(self._mysql(container_id, 'SELECT count(*) FROM %s' % table))
+            if count != rows:
+              problems.append('%s: restored %d rows, expected %d' % (table, count, rows))
+      return problems
+    finally:
+      self.subprocess.call(['docker', 'stop', container_id])
+
+
+def get_argument_parser():
+  """Define command line arguments and usage."""
+  parser = argparse.ArgumentParser()
+  subparsers = parser.add_subparsers(dest='command')
+  verify = subparsers.add_parser(
+      'verify', help='check an archive against its manifest')
+  verify.add_argument(
+      '--workers',
+      type=int,
+      default=4,
+      help='number of members to hash in parallel (default %(default)s)')
+  restore = subparsers.add_parser(
+      'restore', help='test restoring the database dump into a scratch server')
+  restore.add_argument(
+      '--image',
+      default='delphi_database',
+      help='MariaDB image to restore into (default %(default)s)')
+  for subparser in (verify, restore):
+    subparser.add_argument('archive', help='path to the backup_<tag>.tar file')
+    subparser.add_argument(
+        '--manifest', help='path to the manifest (default: next to the archive)')
+  return parser
+
+
+def validate_args(args):
+  """Validate and return command line arguments."""
+  if args.command is None:
+    raise InvalidArgsException('a command is required')
+  if getattr(args, 'workers', 1) < 1:
+    raise InvalidArgsException('`workers` must be at least 1')
+  manifest = args.manifest or get_manifest_path(args.archive)
+  return (args.command, args.archive, manifest, getattr(args, 'workers', None),
+          getattr(args, 'image', None))
+
+
+def main(command, archive, manifest_path, workers, image):
+  """Run this script from the command line."""
+  manifest = read_manifest(manifest_path)
+  if command == 'verify':
+    problems = verify_archive(archive, manifest, workers)
+  else:
+    problems = ScratchRestore.new_instance(image).restore(archive, manifest)
+  for problem in problems:
+    print(' %s' % problem)
+  if problems:
+    raise VerificationException('%s failed %s' % (archive, command))
+  print('%s passed %s' % (archive, command))
+
+
+if __name__ == '__main__':
+  main(*validate_args(get_argument_parser().parse_args()))
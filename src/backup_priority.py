@@ -0,0 +1,52 @@
+"""
+===============
+=== Purpose ===
+===============
+
+Lowers the CPU and I/O priority of `backup.py` so that a backup yields to the
+Epidata API and database running on the same host.
+
+Priorities are set on the current process and inherited by every child it
+starts (`tar`, `mysqldump`, etc.). Note that `mysqldump` only reads what the
+database server sends it; the server's own work is lightened by dump options
+like `--quick` and by throttling how fast the dump is read (see
+`backup_manifest.stream_to_file`).
+"""
+
+# standard library
+import os
+import subprocess
+
+
+# I/O scheduling classes understood by `ionice`
+IONICE_REALTIME = 1
+IONICE_BEST_EFFORT = 2
+IONICE_IDLE = 3
+
+
+def lower_priority(nice=None, ionice_class=None, ionice_level=None,
+                   os_impl=os, subprocess_impl=subprocess):
+  """
+  Set the CPU niceness and I/O scheduling class of the current process.
+
+  Parameters
+  ----------
+  nice : int, optional
+      The niceness to run at, from 0 (normal) to 19 (lowest). Niceness can
+      only be raised, so a value below the current one is ignored.
+  ionice_class : int, optional
+      One of IONICE_REALTIME, IONICE_BEST_EFFORT, or IONICE_IDLE.
+  ionice_level : int, optional
+      The priority within the class, from 0 (highest) to 7 (lowest). Only used
+      with the realtime and best-effort classes.
+  """
+
+  if nice is not None:
+    current = os_impl.nice(0)
+    if nice > current:
+      os_impl.nice(nice - current)
+  if ionice_class is not None:
+    command = ['ionice', '-c', str(ionice_class)]
+    if ionice_level is not None and ionice_class != IONICE_IDLE:
+      command += ['-n', str(ionice_level)]
+    subprocess_impl.check_call(command + ['-p', str(os_impl.getpid())])
@@ -0,0 +1,239 @@
+"""
+===============
+=== Purpose ===
+===============
+
+Prunes old backups made by `backup.py` and checks that there is enough free
+space for the next one.
+
+Backups are retained under a grandfather-father-son policy: the newest backup
+of each of the last N days, M ISO weeks, and K months is kept and everything
+else is deleted. The age of a backup is taken from the timestamp tag in its
+file name (e.g. `backup_20210301_020000.tar`), not from file metadata.
+
+Only backups whose manifest records that they passed verification count
+towards the policy, so a broken archive never takes the place of a good one.
+Unverified backups are left alone; verify one with
+`backup.py --stages verify --tag <tag>` to bring it under the policy.
+
+Free space is projected from the sizes of previous backups so that a run which
+is bound to fill the disk can be stopped before any work is done.
+"""
+
+# standard library
+import argparse
+import datetime
+import json
+import os
+import re
+import shutil
+
+
+# default location of finished backups
+BACKUP_DIR = '/home/automation/backups'
+
+# format of the timestamp tag in backup file names
+TAG_FORMAT = '%Y%m%d_%H%M%S'
+
+# file names of finished backups; the group is the timestamp tag
+BACKUP_PATTERN = re.compile(r'^backup_(\d{8}_\d{6})\.tar$')
+
+
+class InvalidArgsException(Exception):
+  """An Exception indicating that command-line args are invalid."""
+
+
+class InsufficientSpaceException(Exception):
+  """An Exception indicating that there isn't enough space for a backup."""
+
+
+def parse_tag(tag):
+  """Return the datetime encoded in a backup timestamp tag."""
+  return datetime.datetime.strptime(tag, TAG_FORMAT)
+
+
+class BackupDirectory:
+  """An interface for the directory which holds finished backups."""
+
+  def __init__(self, path):
+    self.path = path
+
+  def list(self):
+    """Return the names of all files in the directory."""
+    return os.listdir(self.path)
+
+  def read_json(self, name):
+    """Return the contents of the named JSON file, or None if it's missing."""
+    try:
+      with open(os.path.join(self.path, name)) as file:
+        return json.load(file)
+    except (FileNotFoundError, ValueError):
+      return None
+
+  def size(self, name):
+    """Return the size of the named file in bytes."""
+    return os.path.getsize(os.path.join(self.path, name))
+
+  def remove(self, name):
+    """Delete the named file."""
+    os.remove(os.path.join(self.path, name))
+
+  def free_bytes(self):
+    """Return the number of bytes available on the directory's partition."""
+    return shutil.disk_usage(self.path).free
+
+
+class RetentionPolicy:
+  """A grandfather-father-son retention policy."""
+
+  def __init__(self, daily, weekly, monthly):
+    """
+    Create a policy keeping the newest backup of each of the last `daily`
+    days, `weekly` weeks, and `monthly` months.
+    """
+    self.daily = daily
+    self.weekly = weekly
+    self.monthly = monthly
+
+  def select(self, timestamps):
+    """
+    Return the subset of the given datetimes which should be kept.
+
+    The newest backup is always kept, regardless of the policy.
+    """
+    newest_first = sorted(timestamps, reverse=True)
+    keep = set(newest_first[:1])
+    buckets = [
+      (self.daily, lambda t: t.date()),
+      (self.weekly, lambda t: t.isocalendar()[:2]),
+      (self.monthly, lambda t: (t.year, t.month)),
+    ]
+    for count, bucket in buckets:
+      seen = set()
+      for timestamp in newest_first:
+        key = bucket(timestamp)
+        if key in seen:
+          continue
+        if len(seen) >= count:
+          break
+        seen.add(key)
+        keep.add(timestamp)
+    return keep
+
+
+class BackupRotator:
+  """Prunes finished backups and projects the space needed for the next."""
+
+  @staticmethod
+  def new_instance(path=BACKUP_DIR):
+    """Return a production-ready instance."""
+    return BackupRotator(BackupDirectory(path))
+
+  def __init__(self, directory):
+    """Creates a new BackupRotator for the given BackupDirectory."""
+    self.directory = directory
+
+  def list_backups(self):
+    """Return a list of (datetime, file name) tuples, oldest first."""
+    backups = []
+    for name in self.directory.list():
+      match = BACKUP_PATTERN.match(name)
+      if match:
+        backups.append((parse_tag(match.group(1)), name))
+    return sorted(backups)
+
+  def is_verified(self, name):
+    """Return whether the named backup's manifest says it passed verification."""
+    manifest = self.directory.read_json(name[:-len('tar')] + 'manifest.json')
+    return isinstance(manifest, dict) and bool(manifest.get('verified'))
+
+  def prune(self, policy, dry_run=False):
+    """
+    Delete every verified backup not selected by the given RetentionPolicy,
+    along with its sidecar files (e.g. `backup_<tag>.manifest.json`), and
+    return the list of deleted file names. Unverified backups are neither
+    counted nor deleted.
+    """
+    backups = []
+    for timestamp, name in self.list_backups():
+      if self.is_verified(name):
+        backups.append((timestamp, name))
+      else:
+        print(' skipping unverified %s' % name)
+    keep = policy.select([timestamp for timestamp, name in backups])
+    names = self.directory.list()
+    removed = []
+    for timestamp, name in backups:
+      if timestamp in keep:
+        continue
+      prefix = name[:-len('tar')]
+      for file in sorted(n for n in names if n.startswith(prefix)):
+        print(' %s %s' % ('would prune' if dry_run else 'pruning', file))
+        if not dry_run:
+          self.directory.remove(file)
+        removed.append(file)
+    return removed
+
+  def estimate_next_size(self, history=5):
+    """
+    Return the expected size in bytes of the next backup, which is the largest
+    of the last `history` backups, or 0 if there are none.
+    """
+    recent = self.list_backups()[-history:]
+    return max([self.directory.size(name) for timestamp, name in recent] or [0])
+
+  def check_free_space(self, headroom=2.0, min_free_bytes=0):
+    """
+    Raise an Exception if free space is less than `headroom` times the
+    projected backup size plus `min_free_bytes`.
+
+    The default headroom of 2 accounts for the intermediate archives which
+    exist on disk alongside the final archive until it is complete.
+    """
+    needed = int(self.estimate_next_size() * headroom) + min_free_bytes
+    free = self.directory.free_bytes()
+    if free < needed:
+      raise InsufficientSpaceException(
+          'need %d bytes for the next backup, but only %d are free' %
+          (needed, free))
+    return free, needed
+
+
+def get_argument_parser():
+  """Define command line arguments and usage."""
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--dest',
+      default=BACKUP_DIR,
+      help='the directory containing backups (default %(default)s)')
+  parser.add_argument(
+      '--daily', type=int, default=7, help='number of daily backups to keep')
+  parser.add_argument(
+      '--weekly', type=int, default=4, help='number of weekly backups to keep')
+  parser.add_argument(
+      '--monthly',
+      type=int,
+      default=6,
+      help='number of monthly backups to keep')
+  parser.add_argument(
+      '--dry-run',
+      action='store_true',
+      help='list the backups that would be pruned without deleting them')
+  return parser
+
+
+def validate_args(args):
+  """Validate and return command line arguments."""
+  if min(args.daily, args.weekly, args.monthly) < 0:
+    raise InvalidArgsException('retention counts must be non-negative')
+  policy = RetentionPolicy(args.daily, args.weekly, args.monthly)
+  return (args.dest, policy, args.dry_run)
+
+
+def main(dest, policy, dry_run):
+  """Run this script from the command line."""
+  BackupRotator.new_instance(dest).prune(policy, dry_run)
+
+
+if __name__ == '__main__':
+  main(*validate_args(get_argument_parser().parse_args()))
@@ -0,0 +1,395 @@
+"""
+===============
+=== Purpose ===
+===============
+
+Copies finished backups made by `backup.py` to other places, like an external
+drive or an offsite S3-compatible object store (e.g. AWS S3, or MinIO for
+local testing).
+
+An archive is sent in fixed-size parts, several at a time, under a shared
+bandwidth cap so that the transfer doesn't starve other traffic on the host.
+Progress is saved after every part in a sidecar file
+(`backup_<tag>.transfer.json`), so an interrupted transfer resumes where it
+left off when run again. Each part is checked by MD5 as it lands, and the whole
+object is checked against the SHA-256 from the backup manifest once complete.
+"""
+
+# standard library
+import argparse
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+
+# first party
+from delphi.operations.backup_manifest import get_manifest_path, hash_range, read_manifest
+
+
+# default size of each part; S3 requires at least 5 MiB for all but the last
+PART_SIZE = 64 << 20
+
+# size of each write to a local destination, so the bandwidth cap applies to
+# slices of a part rather than whole parts
+CHUNK_SIZE = 1 << 20
+
+
+class InvalidArgsException(Exception):
+  """An Exception indicating that command-line args are invalid."""
+
+
+class TransferException(Exception):
+  """An Exception indicating that a copy doesn't match its source."""
+
+
+def get_state_path(archive_path):
+  """Return the path of the file which tracks progress of a transfer."""
+  return re.sub(r'\.tar$', '', archive_path) + '.transfer.json'
+
+
+class RateLimiter:
+  """A thread-safe token bucket which caps throughput in bytes per second."""
+
+  def __init__(self, bytes_per_second, time_impl=time):
+    """
+    Create a limiter allowing `bytes_per_second` on average, or no limit if
+    that is None or 0. Bursts of up to one second's allowance are permitted.
+    """
+    self.rate = bytes_per_second
+    self.time = time_impl
+    self.lock = threading.Lock()
+    self.allowance = bytes_per_second or 0
+    self.last = time_impl.time()
+
+  def consume(self, size):
+    """Block until `size` bytes may be sent."""
+    if not self.rate:
+      return
+    with self.lock:
+      now = self.time.time()
+      self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate)
+      self.last = now
+      self.allowance -= size
+      delay = -self.allowance / self.rate
+    if delay > 0:
+      self.time.sleep(delay)
+
+
+class ThrottledReader(io.BytesIO):
+  """
+  A part as a file whose reads block on a limiter, so that a part is sent at
+  the capped rate as it's read, rather than all at once after waiting for the
+  whole of it. Bytes read again, e.g. when a request is retried, count again.
+  """
+
+  def __init__(self, data, limiter):
+    super().__init__(data)
+    self.limiter = limiter
+
+  def read(self, size=-1):
+    data = super().read(size)
+    self.limiter.consume(len(data))
+    return data
+
+
+class LocalDestination:
+  """A directory, such as the mount point of an external drive."""
+
+  def __init__(self, path):
+    self.path = path
+
+  def __str__(self):
+    return self.path
+
+  def begin(self, name, size, sha256, handle=None):
+    """
+    Start or resume a transfer and return a handle to it, which is the path
+    of a partial file that is renamed once complete.
+    """
+    if handle is not None and os.path.exists(handle):
+      return handle
+    # stale partial files can't be resumed since their progress is unknown
+    for stale in os.listdir(self.path):
+      if stale.startswith(name + '.') and stale.endswith('.part'):
+        os.remove(os.path.join(self.path, stale))
+    partial = os.path.join(self.path, '%s.%d.part' % (name, time.time() * 1000))
+    with open(partial, 'wb') as file:
+      file.truncate(size)
+    return partial
+
+  def completed_parts(self, handle, name, saved):
+    """
+    Return {part number: MD5 hex} of the parts already written, which are
+    the ones recorded in the saved state.
+    """
+    return saved
+
+  def put_part(self, handle, name, number, offset, body, md5):
+    """
+    Write one part, read from the file `body` in chunks, and return its MD5 as
+    read back from disk.
+    """
+    fd = os.open(handle, os.O_RDWR)
+    try:
+      size = 0
+      for chunk in iter(lambda: body.read(CHUNK_SIZE), b''):
+        os.pwrite(fd, chunk, offset + size)
+        size += len(chunk)
+      os.fsync(fd)
+      return hashlib.md5(os.pread(fd, size, offset)).hexdigest()
+    finally:
+      os.close(fd)
+
+  def complete(self, handle, name, parts):
+    """Move the partial file into place."""
+    os.rename(handle, os.path.join(self.path, name))
+
+  def check(self, name, size, sha256, parts):
+    """Return a list of problems found by reading back the finished copy."""
+    path = os.path.join(self.path, name)
+    actual = os.path.getsize(path)
+    if actual != size:
+      return ['%s is %d bytes, expected %d' % (path, actual, size)]
+    if hash_range(path, 0, size) != sha256:
+      return ['%s: checksum mismatch' % path]
+    return []
+
+
+class S3Destination:
+  """A bucket in an S3-compatible object store."""
+
+  @staticmethod
+  def new_instance(endpoint_url, bucket, access_key, secret_key, prefix=''):
+    """Return a production-ready instance."""
+    # boto3 is only needed by hosts which send backups offsite
+    import boto3
+    client = boto3.client(
+        's3',
+        endpoint_url=endpoint_url,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key)
+    return S3Destination(client, bucket, prefix)
+
+  def __init__(self, client, bucket, prefix=''):
+    self.client = client
+    self.bucket = bucket
+    self.prefix = prefix
+
+  def __str__(self):
+    return 's3://%s/%s' % (self.bucket, self.prefix)
+
+  def begin(self, name, size, sha256, handle=None):
+    """Start or resume a multipart upload and return its upload ID."""
+    if handle is not None:
+      uploads = self.client.list_multipart_uploads(
+          Bucket=self.bucket, Prefix=self.prefix + name).get('Uploads', [])
+      if handle in [upload['UploadId'] for upload in uploads]:
+        return handle
+    response = self.client.create_multipart_upload(
+        Bucket=self.bucket, Key=self.prefix + name, Metadata={'sha256': sha256})
+    return response['UploadId']
+
+  def completed_parts(self, handle, name, saved):
+    """Return {part number: MD5 hex} of the parts the server already has."""
+    parts = {}
+    paginator = self.client.get_paginator('list_parts')
+    for page in paginator.paginate(
+        Bucket=self.bucket, Key=self.prefix + name, UploadId=handle):
+      for part in page.get('Parts', []):
+        parts[part['PartNumber']] = part['ETag'].strip('"')
+    return parts
+
+  def put_part(self, handle, name, number, offset, body, md5):
+    """
+    Upload one part, streamed from the file `body`, and return its ETag, which
+    for a single part is the MD5 of the bytes the server received.
+    """
+    response = self.client.upload_part(
+        Bucket=self.bucket,
+        Key=self.prefix + name,
+        UploadId=handle,
+        PartNumber=number,
+        Body=body,
+        ContentMD5=base64.b64encode(bytes.fromhex(md5)).decode('ascii'))
+    return response['ETag'].strip('"')
+
+  def complete(self, handle, name, parts):
+    """Assemble the uploaded parts into the final object."""
+    self.client.complete_multipart_upload(
+        Bucket=self.bucket,
+        Key=self.prefix + name,
+        UploadId=handle,
+        MultipartUpload={'Parts': [
+          {'PartNumber': number, 'ETag': '"%s"' % parts[number]}
+          for number in sorted(parts)
+        ]})
+
+  def check(self, name, size, sha256, parts):
+    """
+    Return a list of problems found by comparing the finished object with the
+    source. The ETag of a multipart object is the MD5 of the concatenated part
+    MD5s, suffixed with the number of parts.
+    """
+    head = self.client.head_object(Bucket=self.bucket, Key=self.prefix + name)
+    digests = b''.join(bytes.fromhex(parts[n]) for n in sorted(parts))
+    etag = '%s-%d' % (hashlib.md5(digests).hexdigest(), len(parts))
+    problems = []
+    if head['ContentLength'] != size:
+      problems.append('%s is %d bytes, expected %d' % (name, head['ContentLength'], size))
+    if head['ETag'].strip('"') != etag:
+      problems.append('%s: ETag is %s, expected %s' % (name, head['ETag'], etag))
+    if head.get('Metadata', {}).get('sha256') != sha256:
+      problems.append('%s: sha256 metadata does not match' % name)
+    return problems
+
+
+class Transfer:
+  """Sends an archive to a destination in parts, resuming where it left off."""
+
+  def __init__(self, destination, limiter=None, part_size=PART_SIZE, workers=4):
+    self.destination = destination
+    self.limiter = limiter or RateLimiter(None)
+    self.part_size = part_size
+    self.workers = workers
+    self.lock = threading.Lock()
+
+  def _load_state(self, path, name):
+    """Return saved progress for the archive, or a fresh state."""
+    if os.path.exists(path):
+      with open(path) as file:
+        state = json.load(file)
+      if state['destination'] == str(self.destination) and state['part_size'] == self.part_size:
+        return state
+    return {
+      'name': name,
+      'destination': str(self.destination),
+      'part_size': self.part_size,
+      'handle': None,
+      'parts': {},
+    }
+
+  def _save_state(self, path, state):
+    """Atomically save progress."""
+    with open(path + '.tmp', 'w') as file:
+      json.dump(state, file)
+    os.replace(path + '.tmp', path)
+
+  def send(self, archive_path, sha256=None):
+    """
+    Copy an archive to the destination and check the result end to end.
+
+    The expected SHA-256 is read from the archive's manifest when not given,
+    falling back to hashing the archive.
+    """
+    name = os.path.basename(archive_path)
+    size = os.path.getsize(archive_path)
+    if sha256 is None:
+      manifest_path = get_manifest_path(archive_path)
+      if os.path.exists(manifest_path):
+        sha256 = read_manifest(manifest_path)['sha256']
+      else:
+        sha256 = hash_range(archive_path, 0, size)
+
+    start = time.time()
+    state_path = get_state_path(archive_path)
+    state = self._load_state(state_path, name)
+    handle = self.destination.begin(name, size, sha256, state['handle'])
+    if handle != state['handle']:
+      # the previous transfer, if any, can't be resumed
+      state['handle'], state['parts'] = handle, {}
+    saved = {int(n): md5 for n, md5 in state['parts'].items()}
+    done = self.destination.completed_parts(handle, name, saved)
+    state['parts'] = {str(n): md5 for n, md5 in done.items()}
+    self._save_state(state_path, state)
+
+    count = max(1, -(-size // self.part_size))
+    pending = [n for n in range(1, count + 1) if n not in done]
+    print(' %s -> %s: %d of %d parts to send' % (name, self.destination, len(pending), count))
+
+    def send_part(number):
+      offset = (number - 1) * self.part_size
+      with open(archive_path, 'rb') as file:
+        file.seek(offset)
+        data = file.read(self.part_size)
+      md5 = hashlib.md5(data).hexdigest()
+      # throttled as the destination reads it, so the cap holds within a part
+      body = ThrottledReader(data, self.limiter)
+      received = self.destination.put_part(handle, name, number, offset, body, md5)
+      if received != md5:
+        raise TransferException('part %d: sent %s, received %s' % (number, md5, received))
+      with self.lock:
+        state['parts'][str(number)] = md5
+        self._save_state(state_path, state)
+
+    with ThreadPoolExecutor(max_workers=self.workers) as executor:
+      # list() re-raises the first failure, if any
+      list(executor.map(send_part, pending))
+
+    parts = {int(n): md5 for n, md5 in state['parts'].items()}
+    self.destination.complete(handle, name, parts)
+    problems = self.destination.check(name, size, sha256, parts)
+    if problems:
+      raise TransferException('; '.join(problems))
+    os.remove(state_path)
+    elapsed = time.time() - start
+    print(' sent %.1fM in %.1fs' % (size / 2**20, elapsed))
+    return elapsed
+
+
+def get_argument_parser():
+  """Define command line arguments and usage."""
+  parser = argparse.ArgumentParser()
+  parser.add_argument('archive', help='path to the backup_<tag>.tar file')
+  parser.add_argument('destination', help='a directory, or s3://bucket/prefix')
+  parser.add_argument(
+      '--endpoint-url', help='S3 endpoint (e.g. http://localhost:9000 for MinIO)')
+  parser.add_argument(
+      '--limit',
+      type=float,
+      default=0,
+      help='bandwidth cap in MB/s; 0 means unlimited (default %(default)s)')
+  parser.add_argument(
+      '--part-size',
+      type=int,
+      default=PART_SIZE >> 20,
+      help='part size in MB (default %(default)s)')
+  parser.add_argument(
+      '--workers',
+      type=int,
+      default=4,
+      help='number of parts to send concurrently (default %(default)s)')
+  return parser
+
+
+def validate_args(args):
+  """Validate and return command line arguments."""
+  if args.limit < 0:
+    raise InvalidArgsException('`limit` must be non-negative')
+  if args.part_size < 5 and args.destination.startswith('s3://'):
+    raise InvalidArgsException('`part_size` must be at least 5 MB for S3')
+  if args.part_size < 1 or args.workers < 1:
+    raise InvalidArgsException('`part_size` and `workers` must be positive')
+  return (args.archive, args.destination, args.endpoint_url,
+          int(args.limit * 2**20), args.part_size << 20, args.workers)
+
+
+def main(archive, destination, endpoint_url, limit, part_size, workers):
+  """Run this script from the command line."""
+  if destination.startswith('s3://'):
+    bucket, _, prefix = destination[len('s3://'):].partition('/')
+    access_key = os.environ.get('AWS_ACCESS_KEY_ID')
+    secret_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
+    destination = S3Destination.new_instance(
+        endpoint_url, bucket, access_key, secret_key, prefix)
+  else:
+    destination = LocalDestination(destination)
+  Transfer(destination, RateLimiter(limit), part_size, workers).send(archive)
+
+
+if __name__ == '__main__':
+  main(*validate_args(get_argument_parser().parse_args()))
@@ -0,0 +1,4 @@
+"""Run a benchmark spec with `python -m delphi.operations.database_metrics spec.yaml`, see benchmark.py."""
+from delphi.operations.database_metrics.benchmark import get_argument_parser, main
+
+main(get_argument_parser().parse_args())
@@ -1,39 +1,77 @@
 """We can collect metrics on the data transformation procedures defined in this file."""
-import requests
-from requests import Response
+import hashlib
+import json
+import shlex
 
 from docker import DockerClient
 
+from delphi.operations.database_metrics import epidata
 
-def send_query(params: dict) -> Response:
+API_URL = "http://delphi_web_epidata:80/epidata/api.php"
+SYNTHETIC_VOLUME = "delphi_metrics_synthetic"
+
+
+def send_query(params: dict, url: str = API_URL, client: epidata.BlockingClient = None, **kwargs) -> dict:
     """
     Send query to Epidata API running on docker MariaDB container.
 
+    The response is streamed and counted rather than kept, see epidata.EpidataClient.
+
     Parameters
     ----------
     params: dict
         Query parameters to send. List of parameters can be found here:
         https://cmu-delphi.github.io/delphi-epidata/api/covidcast.html#constructing-api-queries
+    url: str, optional
+        Epidata API endpoint. Defaults to the delphi_web_epidata container.
+    client: epidata.BlockingClient, optional
+        Client to send the query with, keeping its connections open for the next query. `url` and `kwargs` are
+        ignored if given. Defaults to None, which sends the query with a client of its own.
+    kwargs:
+        Timeouts and other arguments of epidata.EpidataClient.new_instance().
 
     Returns
     -------
-    Requests Response object.
+    Dictionary with the HTTP status, time to first byte, total time, bytes and rows received, and any error,
+    see epidata.EpidataClient.fetch().
+    """
+    if client is not None:
+        return client.fetch(params)
+    return epidata.query(params, url, **kwargs)
+
+
+def _python(module: str, profiler=None) -> str:
+    """Shell command running a Python module, under `profiler` if given, see profiling.Profiler.command()."""
+    return f"python3 -m {module}" if profiler is None else profiler.command(module)
+
+
+def _run(client: DockerClient, image: str, command, worker=None, profiler=None, **kwargs) -> bytes:
+    """
+    Run a command in a new container from `image`, or in `worker` if given, and return its output.
+
+    A new container also gets the volumes and options `profiler` needs; a worker must have been started with them.
     """
-    req = requests.get("http://delphi_web_epidata:80/epidata/api.php",
-                       params=params)
-    return req
+    if worker is not None:
+        return worker.run(command)
+    if profiler is not None:
+        kwargs = dict(kwargs, **profiler.options, volumes=dict(kwargs.get("volumes") or {}, **profiler.volumes))
+    return client.containers.run(image=client.images.get(image), command=command, **kwargs)
 
 
 def load_data(client: DockerClient,
               image: str,
               source: str,
-              file_pattern: str) -> bytes:
+              file_pattern: str,
+              network: str = "delphi-net",
+              resources: dict = None,
+              worker=None,
+              profiler=None) -> bytes:
     """
     Ingest data into epidata database using the Python docker image.
 
     Copies files from common_full/covidcast/receiving/`source`/`file_pattern`, which should be
     copied to the image via the DockerFile, to the common/covidcast/receiving/`source`/ folder
-    for ingestion. Runs ingestion via the python command.
+    for ingestion, after removing any earlier files there. Runs ingestion via the python command.
 
     Parameters
     ----------
@@ -45,23 +83,40 @@ def load_data(client: DockerClient,
         Data source name
     file_pattern: str
         Filename of pattern to match
+    network: str, optional
+        Docker network to run the container on, where the database is reachable as delphi_database_epidata.
+        Defaults to delphi-net.
+    resources: dict, optional
+        Extra keyword arguments of containers.run() limiting the container's resources, e.g. cpuset_cpus.
+    worker: WorkerContainer, optional
+        Long-lived container to run ingestion in instead of a new one, see worker.py. Defaults to None.
+    profiler: Profiler, optional
+        Profiler to run ingestion under, see profiling.py. Defaults to None (not profiled).
 
     Returns
     -------
     Bytestring of Docker log, either STDOUT or STDERR
     """
-    return client.containers.run(
-        image=client.images.get(image),
-        command=f'bash -c "mkdir -p /common/covidcast/receiving/{source} && '
-                f'cp common_full/covidcast/receiving/{source}/{file_pattern} '
-                f'/common/covidcast/receiving/{source}/ && '
-                f'python3 -m delphi.epidata.acquisition.covidcast.csv_to_database '
-                f'--data_dir /common/covidcast/"',
-        network="delphi-net")
+    return _run(
+        client,
+        image,
+        f'bash -c "rm -rf /common/covidcast && mkdir -p /common/covidcast/receiving/{source} && '
+        f'cp common_full/covidcast/receiving/{source}/{file_pattern} '
+        f'/common/covidcast/receiving/{source}/ && '
+        f'{_python("delphi.epidata.acquisition.covidcast.csv_to_database", profiler)} '
+        f'--data_dir /common/covidcast/"',
+        worker,
+        profiler,
+        network=network,
+        **(resources or {}))
 
 
 def update_meta(client: DockerClient,
-                image: str) -> bytes:
+                image: str,
+                network: str = "delphi-net",
+                resources: dict = None,
+                worker=None,
+                profiler=None) -> bytes:
     """
     Update metadata cache in database.
 
@@ -71,6 +126,68 @@ def update_meta(client: DockerClient,
         Docker Client object containing the Python image.
     image: str
         Name of image containing metadata update code.
+    network: str, optional
+        Docker network to run the container on. Defaults to delphi-net.
+    resources: dict, optional
+        Extra keyword arguments of containers.run() limiting the container's resources, e.g. cpuset_cpus.
+    worker: WorkerContainer, optional
+        Long-lived container to run the update in instead of a new one, see worker.py. Defaults to None.
+    profiler: Profiler, optional
+        Profiler to run the update under, see profiling.py. Defaults to None (not profiled).
+
+    Returns
+    -------
+    Bytestring of Docker log, either STDOUT or STDERR
+    """
+    command = _python("delphi.epidata.acquisition.covidcast.covidcast_meta_cache_updater", profiler)
+    return _run(
+        client,
+        image,
+        command if profiler is None else f'bash -c "{command}"',
+        worker,
+        profiler,
+        network=network,
+        **(resources or {}))
+
+
+def dataset_label(dataset) -> str:
+    """
+    Name a dataset for reports and the result store.
+
+    Parameters
+    ----------
+    dataset: tuple or dict
+        A (source, file_pattern) tuple, or a synthetic dataset spec.
+
+    Returns
+    -------
+    `source:file_pattern`, or the spec's `name` if it has one and otherwise `synthetic:` and a hash of the spec.
+    """
+    if isinstance(dataset, dict):
+        spec = json.dumps(dataset, sort_keys=True).encode()
+        return dataset.get("name") or f"synthetic:{hashlib.sha256(spec).hexdigest()[:8]}"
+    return ":".join(dataset)
+
+
+def generate_synthetic(client: DockerClient,
+                       image: str,
+                       spec: dict,
+                       volume: str = SYNTHETIC_VOLUME) -> bytes:
+    """
+    Generate a synthetic dataset into a Docker volume using the Python docker image.
+
+    Anything already in the volume is replaced. This is not part of any measurement.
+
+    Parameters
+    ----------
+    client: DockerClient
+        Docker Client object containing the Python image.
+    image: str
+        Name of image containing the database_metrics code.
+    spec: dict
+        Dataset spec, see synthetic.get_spec().
+    volume: str, optional
+        Name of the Docker volume to write to, which is created if needed.
 
     Returns
     -------
@@ -78,5 +195,57 @@ def update_meta(client: DockerClient,
     """
     return client.containers.run(
         image=client.images.get(image),
-        command="python3 -m delphi.epidata.acquisition.covidcast.covidcast_meta_cache_updater",
-        network="delphi-net")
+        command=["bash", "-c", f"rm -rf /synthetic/covidcast && "
+                               f"python3 -m delphi.operations.database_metrics.synthetic "
+                               f"--spec {shlex.quote(json.dumps(spec))} --out /synthetic/covidcast"],
+        volumes={volume: {"bind": "/synthetic", "mode": "rw"}},
+        remove=True)
+
+
+def load_synthetic(client: DockerClient,
+                   image: str,
+                   volume: str = SYNTHETIC_VOLUME,
+                   network: str = "delphi-net",
+                   resources: dict = None,
+                   worker=None,
+                   profiler=None) -> bytes:
+    """
+    Ingest a synthetic dataset made by generate_synthetic() into epidata database using the Python docker image.
+
+    Like load_data(), copies the files into /common/covidcast/ and runs ingestion, but with `--specific_issue_date`,
+    so every issue, including the first, is dated by its directory rather than the day it is loaded.
+
+    Parameters
+    ----------
+    client: DockerClient
+        Docker Client object containing the Python image.
+    image: str
+        Name of image containing data loading code.
+    volume: str, optional
+        Name of the Docker volume holding the dataset.
+    network: str, optional
+        Docker network to run the container on. Defaults to delphi-net.
+    resources: dict, optional
+        Extra keyword arguments of containers.run() limiting the container's resources, e.g. cpuset_cpus.
+    worker: WorkerContainer, optional
+        Long-lived container to run ingestion in instead of a new one, which must have `volume` mounted at
+        /synthetic. Defaults to None.
+    profiler: Profiler, optional
+        Profiler to run ingestion under, see profiling.py. Defaults to None (not profiled).
+
+    Returns
+    -------
+    Bytestring of Docker log, either STDOUT or STDERR
+    """
+    ingest = _python("delphi.epidata.acquisition.covidcast.csv_to_database", profiler)
+    return _run(
+        client,
+        image,
+        'bash -c "rm -rf /common/covidcast && mkdir -p /common/covidcast && '
+        'cp -r /synthetic/covidcast/. /common/covidcast/ && '
+        f'{ingest} --data_dir /common/covidcast/ --specific_issue_date"',
+        worker,
+        profiler,
+        volumes={volume: {"bind": "/synthetic", "mode": "ro"}},
+        network=network,
+        **(resources or {}))
@@ -0,0 +1,189 @@
+"""
+Run a benchmark described by a spec file and write its results, for scripted and nightly runs.
+
+A spec is a JSON or YAML file such as
+
+```
+datasets:
+  - [usa-facts, "202003*_county*"]
+  - {type: synthetic, name: county-month, geo_types: {county: 3000}}
+queries:
+  - {source: covidcast, data_source: usa-facts, signal: deaths_incidence_num, time_type: day,
+     geo_type: county, time_values: 20200301-20200501, geo_value: "*"}
+cache_mode: [cold, warm, hot]
+repetitions: 5
+concurrency: 2
+output: {json: results.json, csv: results.csv}
+```
+
+`cache_mode` may be a single mode or a list, and `concurrency` above 1 measures datasets in parallel with
+parallel.measure_parallel(). Any other key is passed on as an argument of monitor.measure_database(), or of
+measure_parallel() when running in parallel.
+
+Run from the command line with `python -m delphi.operations.database_metrics spec.yaml`.
+"""
+import argparse
+import csv
+import inspect
+import json
+import sys
+from typing import Any, Callable, Optional
+
+import docker
+import numpy as np
+from docker import DockerClient
+
+from delphi.operations.database_metrics import monitor, parallel
+from delphi.operations.database_metrics.store import flatten_results
+
+# keys of a spec which aren't arguments of measure_database() or measure_parallel()
+SPEC_KEYS = ["datasets", "cache_mode", "concurrency", "output"]
+# arguments which can't be given in a spec file
+RESERVED = ["client", "progress", "probe", "status_probe", "workers", "cache_modes"]
+# arguments of measure_database() which parallel.Worker.measure() sets for each worker
+WORKER_KEYS = ["db_container_name", "network", "api_url", "container_resources", "synthetic_volume"]
+CSV_COLUMNS = ["dataset", "operation", "cache_mode", "query", "trial", "outlier", "runtime", "ttfb", "peak_memory_mb",
+               "peak_working_set_mb", "avg_cpu_cores", "read_bytes", "written_bytes", "size_loaded_mb",
+               "rows_loaded", "final_table_rows", "db_size_mb"]
+
+
+def _parameters(func: Callable) -> set:
+    """Names of the arguments `func` takes by keyword, other than through **kwargs."""
+    return {name for name, p in inspect.signature(func).parameters.items() if p.kind != p.VAR_KEYWORD}
+
+
+def load_spec(path: str) -> dict:
+    """
+    Read and check a spec file.
+
+    Parameters
+    ----------
+    path: str
+        JSON file, or YAML file if it ends in .yaml or .yml. YAML needs PyYAML.
+
+    Returns
+    -------
+    Spec as a dictionary, with datasets given as lists turned into (source, file_pattern) tuples.
+
+    Raises
+    ------
+    ValueError if the spec has no datasets, or keys which aren't arguments of measure_database(), or of
+    measure_parallel() with a `concurrency` above 1, or which measure_parallel() sets for each worker.
+    """
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    if not isinstance(spec, dict) or not spec.get("datasets"):
+        raise ValueError(f"{path} must be a mapping with a non-empty list of datasets")
+    allowed = _parameters(monitor.measure_database)
+    if spec.get("concurrency", 1) > 1:
+        allowed |= _parameters(parallel.measure_parallel)
+        per_worker = sorted(k for k in spec if k in WORKER_KEYS)
+        if per_worker:
+            raise ValueError(f"spec keys {per_worker} are set for each worker when concurrency is above 1")
+    unknown = sorted(k for k in spec if k not in SPEC_KEYS and (k not in allowed or k in RESERVED))
+    if unknown:
+        raise ValueError(f"unknown spec keys {unknown}")
+    spec["datasets"] = [d if isinstance(d, dict) else tuple(d) for d in spec["datasets"]]
+    return spec
+
+
+def run_spec(spec: dict, client: DockerClient, progress: Optional[Callable[[str, str, dict], Any]] = None) -> dict:
+    """
+    Run the benchmark described by a spec.
+
+    Parameters
+    ----------
+    spec: dict
+        Output of load_spec().
+    client: DockerClient
+        DockerClient object to run containers with.
+    progress: Callable, optional
+        Called after each measurement, see monitor.measure_database().
+
+    Returns
+    -------
+    Output of measure_database(), or measure_parallel() if `concurrency` is above 1.
+    """
+    kwargs = {k: v for k, v in spec.items() if k not in SPEC_KEYS}
+    cache_mode = spec.get("cache_mode")
+    if cache_mode is not None:
+        kwargs["cache_modes"] = [cache_mode] if isinstance(cache_mode, str) else list(cache_mode)
+    concurrency = spec.get("concurrency", 1)
+    if concurrency > 1:
+        return parallel.measure_parallel(spec["datasets"], client, workers=concurrency, progress=progress, **kwargs)
+    return monitor.measure_database(spec["datasets"], client, progress=progress, **kwargs)
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} isn't JSON serializable")
+
+
+def write_json(output: dict, path: str) -> None:
+    """Write the output of run_spec() as JSON."""
+    with open(path, "w") as f:
+        json.dump(output, f, indent=2, default=_to_json)
+
+
+def write_csv(output: dict, path: str) -> None:
+    """Write every trial in the output of run_spec() as a row of CSV_COLUMNS, without time series or plans."""
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, CSV_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        for dataset, operation, query, trial, metrics in flatten_results(output):
+            cache_mode = operation.partition("_")[2] if operation.startswith("query") else ""
+            writer.writerow(dict(metrics, dataset=dataset, operation=operation, cache_mode=cache_mode, query=query,
+                                 trial=trial, outlier=int(bool(metrics.get("outlier")))))
+
+
+def print_progress(dataset: str, operation: str, result: dict) -> None:
+    """Print one line per measurement to stderr as it finishes, keeping stdout for results."""
+    if "runtime" not in result:
+        errors = ", ".join(sorted({str(t["error"]) for t in result["failed_trials"]}))
+        print(f"{dataset} {operation}: every run failed ({errors})", file=sys.stderr, flush=True)
+        return
+    line = f"{dataset} {operation}: {result['runtime']:.3f}s"
+    if "response" in result:
+        response = result["response"]
+        line += f" (first byte {response['ttfb'] or 0:.3f}s, {response['rows']:,} rows, {response['bytes']:,} bytes"
+        line += f", {response['error'] or response['status']})"
+    if "stats" in result:
+        stats = result["stats"]["runtime"]
+        line += f" median of {len(result['trials'])} [{stats['ci_low']:.3f}, {stats['ci_high']:.3f}]"
+    print(line, file=sys.stderr, flush=True)
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    """Define command line arguments."""
+    parser = argparse.ArgumentParser(prog="python -m delphi.operations.database_metrics",
+                                     description="Run a database_metrics benchmark from a spec file.")
+    parser.add_argument("spec", help="JSON or YAML benchmark spec")
+    parser.add_argument("--json", help="write the full results here (default: the spec's output.json)")
+    parser.add_argument("--csv", help="write one row per trial here (default: the spec's output.csv)")
+    parser.add_argument("--results-db", help="also save the run to this result store")
+    parser.add_argument("--git-sha", help="commit of the acquisition code being measured")
+    parser.add_argument("--quiet", action="store_true", help="don't print progress")
+    return parser
+
+
+def main(args: argparse.Namespace) -> None:
+    """Run the command line interface."""
+    spec = load_spec(args.spec)
+    for key in ["results_db", "git_sha"]:
+        if getattr(args, key):
+            spec[key] = getattr(args, key)
+    output = run_spec(spec, docker.from_env(), None if args.quiet else print_progress)
+    paths = dict(spec.get("output") or {}, **{k: getattr(args, k) for k in ["json", "csv"] if getattr(args, k)})
+    if paths.get("json"):
+        write_json(output, paths["json"])
+    if paths.get("csv"):
+        write_csv(output, paths["csv"])
+    if not paths:
+        json.dump(output, sys.stdout, indent=2, default=_to_json)
@@ -0,0 +1,92 @@
+"""
+Put the database into a known cache state before a query is measured.
+
+- `cold`: nothing cached. The database container is restarted without saving or reloading its InnoDB buffer
+  pool, and the OS page cache is dropped if a privileged container may be started. Timings are dominated by
+  reading from disk.
+- `warm`: the pages the query reads are in the buffer pool, but its result isn't in the query cache. Timings
+  show the CPU cost of evaluating the query.
+- `hot`: the query was just run and nothing was flushed, so its result may come straight from the query cache.
+"""
+from typing import Callable
+
+from docker import DockerClient
+from docker.errors import APIError, ContainerError
+from docker.models.containers import Container
+
+from delphi.operations.database_metrics.db_actions import _clear_cache, _run_sql, _stdout, wait_for_database
+
+CACHE_MODES = ["cold", "warm", "hot"]
+
+
+def drop_buffer_pool(container: Container) -> None:
+    """
+    Restart the database with an empty InnoDB buffer pool.
+
+    By default MariaDB dumps the buffer pool at shutdown and loads it again at startup, so a plain restart
+    stays warm. This turns off the dump and deletes any earlier one before restarting.
+
+    Parameters
+    ----------
+    container: Container
+        Docker Container object where the MariaDB database is running.
+    """
+    _run_sql(container, "SET GLOBAL innodb_buffer_pool_dump_at_shutdown = OFF;")
+    _stdout(container.exec_run(["rm", "-f", "/var/lib/mysql/ib_buffer_pool"], demux=True), "rm")
+    container.restart()
+    wait_for_database(container, poll_s=0.5)
+
+
+def drop_os_cache(client: DockerClient, container: Container) -> bool:
+    """
+    Drop the Docker host's page cache, using a privileged container from the database's image.
+
+    Parameters
+    ----------
+    client: DockerClient
+        DockerClient object to start the container with.
+    container: Container
+        Docker Container object where the MariaDB database is running.
+
+    Returns
+    -------
+    Whether the cache was dropped. It isn't if privileged containers aren't allowed.
+    """
+    try:
+        client.containers.run(container.image, entrypoint=["sh", "-c", "sync && echo 3 > /proc/sys/vm/drop_caches"],
+                              privileged=True, remove=True)
+    except (APIError, ContainerError):
+        return False
+    return True
+
+
+def prepare_cache(client: DockerClient, container: Container, mode: str, run: Callable[[], object]) -> dict:
+    """
+    Put the database into a cache state before measuring `run`.
+
+    Parameters
+    ----------
+    client: DockerClient
+        DockerClient object, used to drop the OS cache in `cold` mode.
+    container: Container
+        Docker Container object where the MariaDB database is running.
+    mode: str
+        One of CACHE_MODES.
+    run: Callable
+        Function which sends the query, called once beforehand in `warm` and `hot` modes.
+
+    Returns
+    -------
+    Dictionary with the `cache_mode`, and in `cold` mode whether the OS cache was dropped (`os_cache_dropped`).
+    """
+    if mode == "cold":
+        drop_buffer_pool(container)
+        return {"cache_mode": mode, "os_cache_dropped": drop_os_cache(client, container)}
+    if mode == "warm":
+        run()
+        _clear_cache(container)
+    elif mode == "hot":
+        run()
+    else:
+        raise ValueError(f"unknown cache mode {mode}, expected one of {CACHE_MODES}")
+    return {"cache_mode": mode}
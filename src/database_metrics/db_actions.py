@@ -1,10 +1,66 @@
 """Methods which send SQL queries to the MariaDB docker database."""
+import time
+
 from docker.models.containers import Container, ExecResult
 
+import delphi.operations.secrets as secrets
+from delphi.operations.database_metrics.parsers import parse_db_size, parse_db_sizes, parse_row_count
+
+
+class ExecError(RuntimeError):
+    """A command run in the database container exited with a non-zero status."""
+
+    def __init__(self, command: str, exit_code: int, stderr: bytes):
+        self.command = command
+        self.exit_code = exit_code
+        self.stderr = stderr
+        super().__init__(f"{command} exited with {exit_code}: {stderr.decode(errors='replace').strip()}")
+
+
+def _batch_query(container: Container, sql: str, user: str = "user", password: str = "pass") -> ExecResult:
+    """
+    Run a query with the mysql client in machine-readable batch mode.
+
+    The output has no header and one line of tab-separated, unescaped values per row, see parsers.parse_batch().
+    Standard output and standard error are kept apart, so warnings the client prints can't be parsed as results.
+
+    Parameters
+    ----------
+    container: Container
+        Docker Container object where the MariaDB database is running.
+    sql: str
+        Query to run, passed as an argument rather than through a shell.
+    user: str, optional
+        Database user. Defaults to user.
+    password: str, optional
+        Password of `user`. Defaults to pass.
+
+    Returns
+    -------
+    ExecResult from exec_run, whose output is a 2-tuple of standard output and standard error bytestrings,
+    either of which may be None.
+    """
+    return container.exec_run(["mysql", f"-u{user}", f"-p{password}", "--batch", "--raw", "--skip-column-names",
+                               "-e", sql], demux=True)
+
+
+def _stdout(result: ExecResult, command: str = "mysql") -> bytes:
+    """
+    Return the standard output of an ExecResult run with `demux=True`, e.g. from _batch_query(), if it succeeded.
+
+    Raises
+    ------
+    ExecError if the command exited with a non-zero status, so its output is never parsed as a result.
+    """
+    stdout, stderr = result.output
+    if result.exit_code != 0:
+        raise ExecError(command, result.exit_code, stderr or stdout or b"")
+    return stdout or b""
+
 
 def _get_epidata_db_size(container: Container) -> ExecResult:
     """
-    Query the size of the epidata database in megabytes.
+    Query the size of every schema in megabytes.
 
     Parameters
     ----------
@@ -13,13 +69,12 @@ def _get_epidata_db_size(container: Container) -> ExecResult:
 
     Returns
     -------
-    ExecResult from exec_run, which will be the exit code and the query result as a bytestring.
+    ExecResult from _batch_query(), with each schema's name and size on a line. See parsers.parse_db_sizes().
     """
-    db_sizes = container.exec_run(
-        'mysql -uuser -ppass -e '
-        '"SELECT table_schema db, sum(data_length + index_length)/1024/1024 size_mb '
-        'FROM information_schema.TABLES GROUP BY table_schema ORDER BY table_schema;"')
-    return db_sizes
+    return _batch_query(
+        container,
+        "SELECT table_schema, COALESCE(SUM(data_length + index_length), 0) / 1024 / 1024 "
+        "FROM information_schema.TABLES GROUP BY table_schema ORDER BY table_schema;")
 
 
 def _get_covidcast_rows(container: Container) -> ExecResult:
@@ -33,53 +88,213 @@ def _get_covidcast_rows(container: Container) -> ExecResult:
 
     Returns
     -------
-    ExecResult from exec_run, which will be the exit code and the query result as a bytestring.
+    ExecResult from _batch_query(), with the count on a single line. See parsers.parse_row_count().
     """
-    row_count = container.exec_run(
-        'mysql -uuser -ppass -e '
-        '"SELECT count(*) FROM epidata.covidcast;"')
-    return row_count
+    return _batch_query(container, "SELECT COUNT(*) FROM epidata.covidcast;")
 
 
-def _clear_cache(container: Container) -> ExecResult:
+def _run_sql(container: Container, sql: str) -> bytes:
     """
-    Clear MariaDB cache so query times can be measured independently.
+    Run any SQL statement as root with _batch_query(), and return its output.
 
-    https://mariadb.com/kb/en/query-cache/#emptying-and-disabling-the-query-cache
+    The statement is passed as an argument rather than through a shell, so it needs no quoting.
 
     Parameters
     ----------
     container: Container
         Docker Container object where the MariaDB database is running.
+    sql: str
+        Statement to run.
 
     Returns
     -------
-    ExecResult from exec_run, which will be the exit code and any output. No output means
-    the command was successful.
+    Standard output as a bytestring, in the batch format of _batch_query(), without a header.
+
+    Raises
+    ------
+    ExecError if the statement failed.
+    """
+    return _stdout(_batch_query(container, sql, user="root", password="pass"))
+
+
+def _clear_cache(container: Container) -> None:
+    """
+    Clear MariaDB cache so query times can be measured independently.
+
+    https://mariadb.com/kb/en/query-cache/#emptying-and-disabling-the-query-cache
+
+    Parameters
+    ----------
+    container: Container
+        Docker Container object where the MariaDB database is running.
+
+    Raises
+    ------
+    ExecError if the cache couldn't be cleared.
     """
-    return container.exec_run('mysql -uroot -ppass -e "FLUSH TABLES; RESET QUERY CACHE;"')
+    _run_sql(container, "FLUSH TABLES; RESET QUERY CACHE;")
 
 
-def _clear_db(container: Container) -> ExecResult:
+def _clear_db(container: Container) -> None:
     """
     Clear tables and cache so the covidcast tables and caches are reset.
 
-    Runs _clear_cache() and then deletes rows from the covidcast data and metadata tables.
+    Deletes rows from the covidcast data and metadata tables and then runs _clear_cache().
 
     Parameters
     ----------
     container: Container
         Docker Container object where the MariaDB database is running.
 
-    Returns
-    -------
-    2-Tuple of ExecResults from exec_run, which will be the exit code and any output.
-    No output means the command was successful. The first entry of the tuple is the ExecResult of
-    _clear_cache() and the second entry will be the ExecResult from the table clearing query.
-    """
-    clear_tables = container.exec_run(
-        'mysql -uroot -ppass -e '
-        '"USE epidata; '
-        'DELETE FROM covidcast; '
-        'DELETE FROM covidcast_meta_cache;"')
-    return _clear_cache(container), clear_tables
+    Raises
+    ------
+    ExecError if the tables or the cache couldn't be cleared, so a measurement never starts from a database
+    which still holds the previous dataset.
+    """
+    _run_sql(container, "USE epidata; DELETE FROM covidcast; DELETE FROM covidcast_meta_cache;")
+    _clear_cache(container)
+
+
+def wait_for_database(container: Container, timeout_s: float = 300, poll_s: float = 2) -> None:
+    """
+    Wait until a new database container accepts connections and has created the epidata schema.
+
+    Parameters
+    ----------
+    container: Container
+        Docker Container object of the database.
+    timeout_s: float, optional
+        Seconds to wait before giving up. Defaults to 300.
+    poll_s: float, optional
+        Seconds between checks. Defaults to 2.
+    """
+    deadline = time.time() + timeout_s
+    while _batch_query(container, "SELECT 1 FROM epidata.covidcast LIMIT 1").exit_code != 0:
+        if time.time() > deadline:
+            raise TimeoutError(f"database in {container.name} not ready after {timeout_s}s")
+        time.sleep(poll_s)
+
+
+class ExecProbe:
+    """
+    Measure database size and exact covidcast row count by running the `mysql` client in the container.
+
+    Every probe starts a new client process, and the row count scans the whole covidcast table, which can take
+    minutes on a large one. SqlProbe is much cheaper.
+    """
+
+    # raised when the database can't be read, see sampler.ContainerSampler
+    errors = (ExecError,)
+
+    def __init__(self, container: Container):
+        self.container = container
+
+    def db_size_mb(self) -> float:
+        """Return the size of the epidata database in megabytes."""
+        return parse_db_size(_stdout(_get_epidata_db_size(self.container)))
+
+    def db_sizes_mb(self) -> dict:
+        """Return the size of every schema in megabytes, by name."""
+        return parse_db_sizes(_stdout(_get_epidata_db_size(self.container)))
+
+    def covidcast_rows(self) -> int:
+        """Return the exact number of rows in epidata.covidcast."""
+        return parse_row_count(_stdout(_get_covidcast_rows(self.container)))
+
+    def close(self):
+        """Nothing to release."""
+
+
+class SqlProbe:
+    """
+    Measure database size and covidcast row count over one persistent connection to MariaDB.
+
+    By default both come from information_schema, which answers in milliseconds whatever the table size. The
+    row count is InnoDB's estimate, which is typically within 10% and is only refreshed when enough of the table
+    has changed, so set `exact_rows` to count the rows instead when that matters more than the cost.
+    """
+
+    def __init__(self, connection, exact_rows: bool = False):
+        """
+        Parameters
+        ----------
+        connection: mysql.connector connection
+            Open connection with autocommit enabled, so each probe sees the latest data.
+        exact_rows: bool, optional
+            Whether covidcast_rows() runs `SELECT count(*)` (True) or reads the estimate (False).
+            Defaults to False.
+        """
+        self.connection = connection
+        self.exact_rows = exact_rows
+
+    @staticmethod
+    def new_instance(host: str = None, user: str = None, password: str = None,
+                     exact_rows: bool = False) -> "SqlProbe":
+        """
+        Connect to the database. Credentials default to secrets.db.host and secrets.db.epi.
+
+        Returns
+        -------
+        SqlProbe using the new connection.
+        """
+        import mysql.connector
+        default_user, default_password = secrets.db.epi
+        connection = mysql.connector.connect(host=host or secrets.db.host,
+                                             user=user or default_user,
+                                             password=password or default_password,
+                                             database="epidata",
+                                             autocommit=True)
+        return SqlProbe(connection, exact_rows)
+
+    @property
+    def errors(self) -> tuple:
+        """Exceptions raised when the database can't be read, e.g. while it restarts. See sampler.ContainerSampler."""
+        import mysql.connector
+        return (mysql.connector.Error,)
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        self.connection.ping(reconnect=True)
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def _query_one(self, sql: str):
+        return self._query(sql)[0][0]
+
+    def db_size_mb(self) -> float:
+        """Return the size of the epidata database in megabytes, from information_schema."""
+        return float(self._query_one(
+            "SELECT sum(data_length + index_length)/1024/1024 FROM information_schema.TABLES "
+            "WHERE table_schema = 'epidata'") or 0)
+
+    def covidcast_rows(self) -> int:
+        """Return the estimated, or if `exact_rows` is set the exact, number of rows in epidata.covidcast."""
+        if self.exact_rows:
+            return int(self._query_one("SELECT count(*) FROM epidata.covidcast"))
+        return int(self._query_one(
+            "SELECT table_rows FROM information_schema.TABLES "
+            "WHERE table_schema = 'epidata' AND table_name = 'covidcast'") or 0)
+
+    def global_status(self, names: list) -> dict:
+        """
+        Read numeric server status counters.
+
+        Parameters
+        ----------
+        names: list of str
+            Variable names from `SHOW GLOBAL STATUS`, e.g. Innodb_buffer_pool_reads.
+
+        Returns
+        -------
+        Dictionary from each variable name found to its integer value.
+        """
+        rows = self._query("SHOW GLOBAL STATUS WHERE Variable_name IN (%s)" % ", ".join(["%s"] * len(names)),
+                           tuple(names))
+        return {name: int(value) for name, value in rows}
+
+    def close(self):
+        """Close the connection."""
+        self.connection.close()
@@ -0,0 +1,252 @@
+"""Send Epidata API queries with a pooled async HTTP client, timing and counting each response as it streams."""
+import asyncio
+import time
+from typing import Optional
+
+import aiohttp
+
+NOT_BRACKETS = bytes(b for b in range(256) if b not in b"{}[]")
+OPEN_OBJECT, OPEN_ARRAY = ord("{"), ord("[")
+
+
+class RowCounter:
+    """
+    Count the rows of a JSON response chunk by chunk, without parsing or keeping it.
+
+    Rows are objects which are elements of an array, e.g. the `epidata` list of the classic response format or
+    the top-level list of `format=json`. Strings are cut out before the brackets are scanned, so braces inside
+    values don't count, and a string split between chunks is carried over. Everything but the bracket scan is
+    done by bytes methods, so counting keeps up with reading the body.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self._stack = []
+        self._carry = b""
+        self._opened = False
+
+    def feed(self, chunk: bytes) -> None:
+        """Count the rows in the next chunk of the body."""
+        self.bytes += len(chunk)
+        text = self._carry + chunk
+        if b"\\" in text:
+            # escaped backslashes first, so an escaped backslash before a closing quote doesn't escape it
+            text = text.replace(b"\\\\", b"").replace(b'\\"', b"")
+        # with escapes gone, strings lie between alternate quotes; an odd number of quotes leaves the last one
+        # open, and it is carried with its contents into the next chunk
+        parts = text.split(b'"')
+        self._carry = b'"' + parts[-1] if len(parts) % 2 == 0 else b""
+        stack = self._stack
+        for c in b"".join(parts[::2]).translate(None, NOT_BRACKETS):
+            if c == OPEN_OBJECT:
+                if stack and stack[-1] == OPEN_ARRAY:
+                    self.rows += 1
+                stack.append(c)
+            elif c == OPEN_ARRAY:
+                stack.append(c)
+            elif stack:
+                stack.pop()
+            self._opened = True
+
+    @property
+    def complete(self) -> bool:
+        """Whether the body so far is a whole JSON document, i.e. it wasn't cut off."""
+        return self._opened and not self._stack and not self._carry
+
+
+class EpidataClient:
+    """
+    Send queries to the Epidata API over a pool of keep-alive connections.
+
+    Bodies are streamed and only counted, so large queries, e.g. every county with `geo_value=*`, take little
+    memory in the harness, and many can be in flight at once.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, url: str, chunk_size: int = 2 ** 16,
+                 max_bytes: Optional[int] = None):
+        """
+        Parameters
+        ----------
+        session: aiohttp.ClientSession
+            Session to send queries with, which holds the connection pool and timeouts.
+        url: str
+            Epidata API endpoint.
+        chunk_size: int, optional
+            Largest chunk of the body to read at once, in bytes. Defaults to 64 KiB.
+        max_bytes: int, optional
+            Stop reading a body after this many bytes and record a `max_bytes` error. Defaults to None (no limit).
+        """
+        self.session = session
+        self.url = url
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def new_instance(url: str,
+                     pool_size: int = 10,
+                     timeout_s: float = 300,
+                     connect_timeout_s: float = 10,
+                     read_timeout_s: float = 60,
+                     **kwargs) -> "EpidataClient":
+        """
+        Create a client with its own connection pool. Call from within a running event loop.
+
+        Parameters
+        ----------
+        url: str
+            Epidata API endpoint.
+        pool_size: int, optional
+            Most connections open at once, so most queries in flight. Defaults to 10.
+        timeout_s: float, optional
+            Seconds before a query is abandoned, including reading its whole body. Defaults to 300.
+        connect_timeout_s: float, optional
+            Seconds to wait for a connection. Defaults to 10.
+        read_timeout_s: float, optional
+            Seconds to wait for each read, so the first byte and every chunk after it. Defaults to 60.
+        kwargs:
+            Other arguments of EpidataClient().
+        """
+        timeout = aiohttp.ClientTimeout(total=timeout_s, sock_connect=connect_timeout_s, sock_read=read_timeout_s)
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=pool_size), timeout=timeout)
+        return EpidataClient(session, url, **kwargs)
+
+    async def fetch(self, params: dict) -> dict:
+        """
+        Send one query and stream its response.
+
+        Parameters
+        ----------
+        params: dict
+            Query parameters, as for actions.send_query().
+
+        Returns
+        -------
+        Dictionary with the HTTP `status`, `ttfb`, seconds until the response headers arrived, `total`, seconds
+        until the whole body was read, body size in `bytes`, number of `rows`, whether the body was `complete`
+        JSON, and the `error` name if the query failed or timed out, otherwise None.
+        """
+        record = {"status": None, "ttfb": None, "total": None, "bytes": 0, "rows": 0, "complete": False,
+                  "error": None}
+        counter = RowCounter()
+        start = time.perf_counter()
+        try:
+            async with self.session.get(self.url, params=params) as response:
+                record["ttfb"] = time.perf_counter() - start
+                record["status"] = response.status
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    counter.feed(chunk)
+                    if self.max_bytes is not None and counter.bytes > self.max_bytes:
+                        record["error"] = "max_bytes"
+                        break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            record["error"] = type(e).__name__
+        record["total"] = time.perf_counter() - start
+        record.update(bytes=counter.bytes, rows=counter.rows, complete=counter.complete)
+        return record
+
+    async def close(self):
+        """Close the connection pool."""
+        await self.session.close()
+
+    async def __aenter__(self) -> "EpidataClient":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class BlockingClient:
+    """
+    Send queries one at a time from synchronous code through an EpidataClient on a private event loop.
+
+    The loop and the client's connection pool live as long as this object, so a run of measurements reuses the
+    same connections instead of opening new ones for every query, and from any thread, since each BlockingClient
+    has a loop of its own.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: EpidataClient):
+        """
+        Parameters
+        ----------
+        loop: asyncio.AbstractEventLoop
+            Event loop which isn't running, where `client` was created.
+        client: EpidataClient
+            Client to send queries with.
+        """
+        self.loop = loop
+        self.client = client
+
+    @staticmethod
+    def new_instance(url: str, **kwargs) -> "BlockingClient":
+        """
+        Create a client on a new event loop.
+
+        Parameters
+        ----------
+        url: str
+            Epidata API endpoint.
+        kwargs:
+            Other arguments of EpidataClient.new_instance(), e.g. timeouts.
+        """
+        async def create():
+            return EpidataClient.new_instance(url, **kwargs)
+
+        loop = asyncio.new_event_loop()
+        return BlockingClient(loop, loop.run_until_complete(create()))
+
+    def fetch(self, params: dict) -> dict:
+        """Send one query and wait for its response. See EpidataClient.fetch()."""
+        return self.loop.run_until_complete(self.client.fetch(params))
+
+    def close(self) -> None:
+        """Close the connection pool and the event loop."""
+        self.loop.run_until_complete(self.client.close())
+        self.loop.close()
+
+
+def failure(record: dict) -> Optional[str]:
+    """
+    Say why a query failed, so its timings can be left out of statistics.
+
+    Parameters
+    ----------
+    record: dict
+        Output of EpidataClient.fetch().
+
+    Returns
+    -------
+    The `error` of the record, `HTTP <status>` for a status outside 2xx, or `incomplete` for a body which isn't
+    whole JSON, in that order; None if the query succeeded.
+    """
+    if record["error"] is not None:
+        return record["error"]
+    if not 200 <= record["status"] < 300:
+        return f"HTTP {record['status']}"
+    if not record["complete"]:
+        return "incomplete"
+    return None
+
+
+def query(params: dict, url: str, **kwargs) -> dict:
+    """
+    Send one query from synchronous code, with a client of its own. Use a BlockingClient to send several.
+
+    Parameters
+    ----------
+    params: dict
+        Query parameters.
+    url: str
+        Epidata API endpoint.
+    kwargs:
+        Other arguments of EpidataClient.new_instance(), e.g. timeouts.
+
+    Returns
+    -------
+    Output of EpidataClient.fetch().
+    """
+    async def run():
+        async with EpidataClient.new_instance(url, pool_size=1, **kwargs) as client:
+            return await client.fetch(params)
+
+    return asyncio.run(run())
@@ -0,0 +1,206 @@
+"""Generate concurrent query load against the Epidata API and summarize its latency and throughput."""
+import asyncio
+import random
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from delphi.operations.database_metrics.actions import API_URL
+from delphi.operations.database_metrics.epidata import EpidataClient, failure
+
+
+def ramp_fraction(elapsed: float, ramp_s: float) -> float:
+    """
+    Return the fraction of full load to apply after `elapsed` seconds of a linear ramp.
+
+    Parameters
+    ----------
+    elapsed: float
+        Seconds since the load started.
+    ramp_s: float
+        Length of the ramp in seconds. Load is at full strength immediately if this is 0.
+
+    Returns
+    -------
+    Float between 0 and 1.
+    """
+    if ramp_s <= 0:
+        return 1.0
+    return min(1.0, max(0.0, elapsed / ramp_s))
+
+
+async def _timed(client: EpidataClient, query: int, params: dict, scheduled: float, origin: float) -> dict:
+    """Send one query and return its record. Latency is measured from the `scheduled` send time."""
+    record = await client.fetch(params)
+    record.update(query=query, start=scheduled - origin, latency=time.perf_counter() - scheduled)
+    return record
+
+
+async def run_load(queries: List[dict],
+                   weights: Optional[List[float]] = None,
+                   clients: int = 10,
+                   duration_s: float = 60,
+                   ramp_s: float = 0,
+                   rate: Optional[float] = None,
+                   think_time_s: float = 0,
+                   timeout_s: float = 30,
+                   seed: int = 0,
+                   url: str = API_URL,
+                   client: Optional[EpidataClient] = None) -> List[dict]:
+    """
+    Send a weighted mix of queries concurrently for a fixed duration.
+
+    In closed-loop mode (`rate` is None), `clients` clients each send a query, wait for the response and
+    `think_time_s`, and repeat. During the ramp, clients join one at a time at evenly spaced intervals.
+
+    In open-loop mode, queries arrive as a Poisson process at `rate` queries per second, whether or not
+    earlier queries have finished, and at most `clients` are in flight at once. During the ramp, the arrival
+    rate rises linearly from 0. Latency is measured from the scheduled arrival time, so time spent waiting
+    for a free connection counts against the server rather than being hidden (coordinated omission).
+
+    Parameters
+    ----------
+    queries: list of dicts
+        Query parameters, as for actions.send_query().
+    weights: list of floats, optional
+        Relative frequency of each query. Defaults to equal weights.
+    clients: int, optional
+        Number of concurrent clients, which is also the size of the HTTP connection pool. Defaults to 10.
+    duration_s: float, optional
+        Seconds to send queries for, including the ramp. Defaults to 60.
+    ramp_s: float, optional
+        Seconds to ramp up to full load. Defaults to 0.
+    rate: float, optional
+        Target arrival rate in queries per second for open-loop mode. Defaults to None (closed loop).
+    think_time_s: float, optional
+        Seconds each closed-loop client waits between queries. Defaults to 0.
+    timeout_s: float, optional
+        Seconds before a query is abandoned, unless `client` is given. Defaults to 30.
+    seed: int, optional
+        Seed for the query mix and arrival times. Defaults to 0.
+    url: str, optional
+        Epidata API endpoint.
+    client: EpidataClient, optional
+        Client to send queries with, which is left open. Defaults to a new one for `url` with a pool of `clients`
+        connections and a timeout of `timeout_s`, which is closed afterwards.
+
+    Returns
+    -------
+    List of dicts, one per query sent: the output of EpidataClient.fetch(), with its time to first byte, rows,
+    and error, plus the query index, `start` time in seconds since the load began, and `latency` in seconds.
+
+    Raises
+    ------
+    ValueError
+        If `clients` is less than 1, or `duration_s` or `rate` isn't positive, before any query is sent.
+    """
+    if clients < 1:
+        raise ValueError(f"clients must be at least 1, not {clients}")
+    if duration_s <= 0:
+        raise ValueError(f"duration_s must be positive, not {duration_s}")
+    if rate is not None and rate <= 0:
+        raise ValueError(f"rate must be positive, not {rate}")
+    if client is None:
+        async with EpidataClient.new_instance(url, pool_size=clients, timeout_s=timeout_s) as client:
+            return await run_load(queries, weights, clients, duration_s, ramp_s, rate, think_time_s, timeout_s,
+                                  seed, url, client)
+    rng = random.Random(seed)
+    choose = lambda: rng.choices(range(len(queries)), weights=weights)[0]
+    origin = time.perf_counter()
+    deadline = origin + duration_s
+    if rate is None:
+        async def closed_loop(delay: float) -> List[dict]:
+            await asyncio.sleep(delay)
+            records = []
+            while time.perf_counter() < deadline:
+                i = choose()
+                records.append(await _timed(client, i, queries[i], time.perf_counter(), origin))
+                if think_time_s:
+                    await asyncio.sleep(think_time_s)
+            return records
+        results = await asyncio.gather(*[closed_loop(ramp_s * c / clients) for c in range(clients)])
+        return sorted((r for records in results for r in records), key=lambda r: r["start"])
+
+    # non-homogeneous Poisson arrivals by thinning a process at the full rate
+    tasks = []
+    scheduled = origin
+    while True:
+        scheduled += rng.expovariate(rate)
+        if scheduled >= deadline:
+            break
+        if rng.random() > ramp_fraction(scheduled - origin, ramp_s):
+            continue
+        i = choose()
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        tasks.append(asyncio.ensure_future(_timed(client, i, queries[i], scheduled, origin)))
+    return list(await asyncio.gather(*tasks))
+
+
+def summarize_load(records: List[dict], duration_s: float, num_queries: int) -> dict:
+    """
+    Summarize throughput and latency percentiles for each query and overall.
+
+    Parameters
+    ----------
+    records: list of dicts
+        Output of run_load().
+    duration_s: float
+        Seconds the load ran for.
+    num_queries: int
+        Number of distinct queries in the mix.
+
+    Returns
+    -------
+    Dictionary with a key for each query index (`query0`, `query1`, ...) and `all`. Each value is a dict of
+    the number of queries sent, errors (queries which failed, see epidata.failure()), throughput of successful
+    queries per second, mean and p50/p95/p99 latency and p50/p95 time to first byte in seconds of successful
+    queries, and total bytes and rows received.
+    """
+    def summarize(group: List[dict]) -> dict:
+        ok = [r for r in group if failure(r) is None]
+        latencies = np.array([r["latency"] for r in ok])
+        summary = {"count": len(group),
+                   "errors": len(group) - len(ok),
+                   "throughput": len(ok) / duration_s if duration_s else 0,
+                   "bytes": sum(r["bytes"] for r in group),
+                   "rows": sum(r["rows"] for r in group)}
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            ttfb_p50, ttfb_p95 = np.percentile([r["ttfb"] for r in ok], [50, 95])
+            summary.update({"latency_mean": float(latencies.mean()), "latency_p50": float(p50),
+                            "latency_p95": float(p95), "latency_p99": float(p99),
+                            "ttfb_p50": float(ttfb_p50), "ttfb_p95": float(ttfb_p95)})
+        else:
+            summary.update({"latency_mean": None, "latency_p50": None,
+                            "latency_p95": None, "latency_p99": None, "ttfb_p50": None, "ttfb_p95": None})
+        return summary
+
+    output = {f"query{i}": summarize([r for r in records if r["query"] == i]) for i in range(num_queries)}
+    output["all"] = summarize(records)
+    return output
+
+
+def generate_load(queries: List[dict], weights: Optional[List[float]] = None, **kwargs) -> dict:
+    """
+    Run run_load() to completion and summarize it.
+
+    Parameters
+    ----------
+    queries: list of dicts
+        Query parameters, as for actions.send_query().
+    weights: list of floats, optional
+        Relative frequency of each query. Defaults to equal weights.
+    kwargs:
+        Any other arguments of run_load().
+
+    Returns
+    -------
+    Output of summarize_load(), plus the load settings under `settings`.
+    """
+    duration_s = kwargs.get("duration_s", 60)
+    records = asyncio.run(run_load(queries, weights, **kwargs))
+    output = summarize_load(records, duration_s, len(queries))
+    output["settings"] = dict(kwargs, weights=weights)
+    output["settings"].pop("client", None)
+    return output
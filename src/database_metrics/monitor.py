@@ -1,16 +1,23 @@
-import multiprocessing as mp
 import time
 from functools import partial
-from typing import Callable
+from typing import Any, Callable, Optional, Tuple
 
 from docker.models.containers import Container
 from docker import DockerClient
-from delphi.operations.database_metrics.db_actions import _get_epidata_db_size, \
-    _get_covidcast_rows, \
-    _clear_db, \
-    _clear_cache
-from delphi.operations.database_metrics.actions import load_data, update_meta, send_query
-from delphi.operations.database_metrics.parsers import parse_metrics, parse_row_count, parse_db_size
+from delphi.operations.database_metrics.db_actions import _clear_db, \
+    _clear_cache, \
+    ExecProbe
+from delphi.operations.database_metrics.actions import API_URL, SYNTHETIC_VOLUME, load_data, update_meta, \
+    send_query, generate_synthetic, load_synthetic, dataset_label
+from delphi.operations.database_metrics.loadgen import generate_load
+from delphi.operations.database_metrics.cache import CACHE_MODES, prepare_cache
+from delphi.operations.database_metrics.epidata import BlockingClient, failure
+from delphi.operations.database_metrics.plans import PLAN_SOURCES, capture_plan
+from delphi.operations.database_metrics.profiling import Profiler
+from delphi.operations.database_metrics.parsers import parse_metrics, summarize_trials
+from delphi.operations.database_metrics.sampler import ContainerSampler, DatabaseSource, get_source
+from delphi.operations.database_metrics.worker import WorkerContainer, measure_startup
+from delphi.operations.database_metrics import store
 
 
 def measure_database(datasets: list,
@@ -19,19 +26,42 @@ def measure_database(datasets: list,
                      python_image_name: str = "delphi-python",
                      queries: list = None,
                      clear_cache: bool = True,
-                     append_datasets: bool = False) -> dict:
+                     append_datasets: bool = False,
+                     sample_interval: float = 0.1,
+                     cgroup_root: str = "/sys/fs/cgroup",
+                     load_test: dict = None,
+                     warmup: int = 0,
+                     repetitions: int = 1,
+                     results_db: str = None,
+                     git_sha: str = None,
+                     probe=None,
+                     status_probe=None,
+                     status_interval: float = 1.0,
+                     network: str = "delphi-net",
+                     api_url: str = API_URL,
+                     container_resources: dict = None,
+                     synthetic_volume: str = SYNTHETIC_VOLUME,
+                     query_plans: str = None,
+                     cache_modes: list = None,
+                     progress: Callable[[str, str, dict], Any] = None,
+                     warm_worker: bool = False,
+                     container_overhead: bool = False,
+                     profile: str = None,
+                     profile_top: int = 20) -> dict:
     """
     Measure performance metrics for a list of functions and datasets.
 
     For each dataset in `datasets`, measure load time, metadata update time, and optional queries.
     Datasets are specified by a tuple of (source, file_pattern).
     e.g. ("usa-facts", "202003*_county*"), which will load all the county level usa-facts data
-    for March 2020.
+    for March 2020. A dataset can instead be a dict with `"type": "synthetic"` and the keys of
+    synthetic.get_spec(), which is generated before it is measured.
 
     Parameters
     ----------
-    datasets: list of tuples
-        List of 2-tuples defined as (source, patterns for files) to be included in each dataset.
+    datasets: list of tuples or dicts
+        List of 2-tuples defined as (source, patterns for files) to be included in each dataset, or synthetic
+        dataset specs.
     client: DockerClient
         DockerClient object to access and execute python images.
     db_container_name: str, optional
@@ -46,74 +76,502 @@ def measure_database(datasets: list,
     append_datasets: boolean, optional
         Boolean for whether to append each dataset onto the previous one (True), or clear the
         database and cache for each dataset (False). Defaults to False.
+    sample_interval: float, optional
+        Seconds between container memory and CPU samples. Defaults to 0.1.
+    cgroup_root: str, optional
+        Where the host's cgroup hierarchy is mounted, for sampling faster than the Docker stats stream.
+        See get_metrics(). Defaults to /sys/fs/cgroup.
+    load_test: dict, optional
+        If given, also run a concurrent load test of `queries` against each dataset with measure_load().
+        The dict holds keyword arguments of loadgen.run_load(), e.g. {"clients": 20, "duration_s": 120}, plus
+        optional `weights` for the query mix. Defaults to None (no load test).
+    warmup: int, optional
+        Number of untimed runs of each operation before it is measured. Defaults to 0.
+    repetitions: int, optional
+        Number of measured runs of each operation. If more than 1, each result is the output of
+        parsers.summarize_trials() instead of parse_metrics(). Loads are repeated by clearing the database
+        before each run, so with `append_datasets` they are only warmed up and measured once. Defaults to 1.
+    results_db: str, optional
+        If given, save the output as a new run in this SQLite result store with store.save_run(), and record its
+        ID under `run_id`. Defaults to None (not saved).
+    git_sha: str, optional
+        Commit of the acquisition code being measured, to key the saved run. Defaults to the commit of the
+        working directory.
+    probe: SqlProbe or ExecProbe, optional
+        How to measure database size and covidcast rows around each operation. Pass
+        db_actions.SqlProbe.new_instance() to use a persistent connection and cheap information_schema
+        estimates. Defaults to an ExecProbe, which runs the mysql client in the container and counts rows
+        exactly.
+    status_probe: SqlProbe, optional
+        If given, also sample covidcast rows, database size, and server status counters every `status_interval`
+        seconds during each operation. This must be a separate SqlProbe from `probe`, as it is used from
+        another thread. See parsers.to_timeseries() for plotting. Defaults to None (not sampled).
+    status_interval: float, optional
+        Seconds between database samples. Defaults to 1.0.
+    network: str, optional
+        Docker network to run the python containers on. Defaults to delphi-net.
+    api_url: str, optional
+        Epidata API endpoint for queries. Defaults to the delphi_web_epidata container.
+    container_resources: dict, optional
+        Extra keyword arguments of containers.run() for the python containers, e.g. {"cpuset_cpus": "0-3"}.
+    synthetic_volume: str, optional
+        Docker volume to generate synthetic datasets into. Defaults to delphi_metrics_synthetic.
+    query_plans: str, optional
+        If given, after timing each query record how MariaDB executes it under `plan`, with
+        plans.capture_plan(). One of plans.PLAN_SOURCES: `translate` derives the SQL from the query parameters,
+        and `log` captures it from the general log by sending the query again. Defaults to None (no plans).
+    cache_modes: list of str, optional
+        Cache states to measure each query in, from cache.CACHE_MODES: `cold`, `warm`, or `hot`. Results for
+        each mode are stored under `query<i>_<mode>` instead of `query<i>`, labelled with `cache_mode`.
+        Defaults to None, where the query cache is flushed or not according to `clear_cache`.
+    progress: Callable, optional
+        Called with the dataset label, operation, e.g. `load` or `query0`, and result after each measurement,
+        e.g. to report progress of a long benchmark. Defaults to None.
+    warm_worker: bool, optional
+        If True, run loads and metadata updates with exec_run in one python container started beforehand, so
+        their measurements don't include container startup, which is reported under `container_overhead`
+        instead. Defaults to False, which starts a new container for every operation.
+    container_overhead: bool, optional
+        If True, also measure the startup overhead of a new container without `warm_worker`, see
+        worker.measure_startup(). Defaults to False.
+    profile: str, optional
+        If given, run the acquisition code of loads and metadata updates under this profiler, `cprofile` or
+        `py-spy`, and summarize where the time went under `profile` in each result, with
+        profiling.Profiler.collect(). Profiles of all warmup and measured runs are combined and kept in the
+        profiling.PROFILE_VOLUME volume. cProfile inflates the measured runtimes. Defaults to None (not profiled).
+    profile_top: int, optional
+        Number of hot spots to summarize per measurement. Defaults to 20.
 
     Returns
     -------
     Dictionary of metrics. Keys will be the datasets and values will be dicts containing the output
-    of parse_metrics() for loading, metadata updates, and queries.
+    of parse_metrics() (or summarize_trials()) for loading, metadata updates, and queries, and of measure_load()
+    under `load_test` if requested.
+
+    Raises
+    ------
+    ValueError
+        If `warmup` or `repetitions` is out of range, `query_plans` or a cache mode in `cache_modes` is unknown,
+        or `load_test` is given without `queries`, before anything is measured.
     """
+    _check_trials(warmup, repetitions)
+    if query_plans is not None and query_plans not in PLAN_SOURCES:
+        raise ValueError(f"unknown query_plans {query_plans}, expected one of {PLAN_SOURCES}")
+    unknown = [mode for mode in cache_modes or [] if mode not in CACHE_MODES]
+    if unknown:
+        raise ValueError(f"unknown cache_modes {unknown}, expected some of {CACHE_MODES}")
+    if load_test is not None and not queries:
+        raise ValueError("a load test needs queries to send")
     db_container = client.containers.get(db_container_name)
     output = {"load": [], "meta": [], "datasets": datasets, "queries": queries,
               "append_datasets": append_datasets}
-    query_funcs = [partial(send_query, params=p) for p in queries] if queries is not None else []
-    meta_func = partial(update_meta, client=client, image=python_image_name)
-    for dataset in datasets:
-        if not append_datasets:
-            _clear_db(db_container)
-        load_func = partial(load_data, client=client, image=python_image_name,
-                            source=dataset[0], file_pattern=dataset[1])
-        output["load"].append(parse_metrics(get_metrics(load_func, db_container, clear_cache)))
-        output["meta"].append(parse_metrics(get_metrics(meta_func, db_container, clear_cache)))
-        for i, query in enumerate(query_funcs):
-            output[f"query{i}"] = output.get(f"query{i}", [])
-            output[f"query{i}"].append(parse_metrics(get_metrics(query, db_container, clear_cache)))
+    profiler = None
+    worker_volumes = {synthetic_volume: {"bind": "/synthetic", "mode": "ro"}}
+    worker_resources = container_resources
+    if profile is not None:
+        profiler = Profiler.new_instance(client, python_image_name, profile, top=profile_top)
+        worker_volumes.update(profiler.volumes)
+        worker_resources = dict(container_resources or {}, **profiler.options)
+    worker = None
+    if warm_worker:
+        worker = WorkerContainer.new_instance(client, python_image_name, network, worker_resources,
+                                              volumes=worker_volumes)
+        output["container_overhead"] = worker.overhead
+    elif container_overhead:
+        output["container_overhead"] = measure_startup(client, python_image_name, network, container_resources)
+    # one client for the whole run, so queries reuse its connection rather than each opening one
+    query_client = BlockingClient.new_instance(api_url, pool_size=1) if queries else None
+    query_funcs = [partial(send_query, params=p, client=query_client) for p in queries] if queries else []
+    python = {"client": client, "image": python_image_name, "network": network, "resources": container_resources,
+              "worker": worker, "profiler": profiler}
+    meta_func = partial(update_meta, **python)
+    metrics = partial(get_metrics, container=db_container, clear_cache=clear_cache,
+                      sample_interval=sample_interval, cgroup_root=cgroup_root, probe=probe,
+                      status_probe=status_probe, status_interval=status_interval)
+    query_metrics = partial(get_query_metrics, **metrics.keywords)
+
+    def report(dataset, operation):
+        if progress is not None:
+            progress(dataset_label(dataset), operation, output[operation][-1])
+
+    def start_profile(k, operation):
+        if profiler is not None:
+            profiler.start(f"{k}-{operation}")
+
+    def collect_profile(operation):
+        if profiler is not None:
+            output[operation][-1]["profile"] = profiler.collect(worker)
+
+    try:
+        for k, dataset in enumerate(datasets):
+            if not append_datasets:
+                _clear_db(db_container)
+            if isinstance(dataset, dict) and dataset.get("type") == "synthetic":
+                generate_synthetic(client, python_image_name, dataset, synthetic_volume)
+                load_func = partial(load_synthetic, volume=synthetic_volume, **python)
+            else:
+                load_func = partial(load_data, source=dataset[0], file_pattern=dataset[1], **python)
+            start_profile(k, "load")
+            if append_datasets:
+                output["load"].append(measure_trials(partial(metrics, load_func)))
+            else:
+                output["load"].append(measure_trials(partial(metrics, load_func), warmup, repetitions,
+                                                     partial(_clear_db, db_container)))
+            collect_profile("load")
+            report(dataset, "load")
+            start_profile(k, "meta")
+            output["meta"].append(measure_trials(partial(metrics, meta_func), warmup, repetitions))
+            collect_profile("meta")
+            report(dataset, "meta")
+            for i, query in enumerate(query_funcs):
+                keys = []
+                for mode in cache_modes or [None]:
+                    key = f"query{i}" if mode is None else f"query{i}_{mode}"
+                    output[key] = output.get(key, [])
+                    if mode is None:
+                        output[key].append(measure_trials(partial(query_metrics, query), warmup, repetitions))
+                    else:
+                        output[key].append(measure_cached(query_metrics, query, client, db_container, mode,
+                                                          warmup, repetitions))
+                    keys.append(key)
+                if query_plans is not None:
+                    plan = capture_plan(db_container, queries[i], query if query_plans == "log" else None)
+                    for key in keys:
+                        output[key][-1]["plan"] = plan
+                for key in keys:
+                    report(dataset, key)
+            if load_test is not None:
+                output["load_test"] = output.get("load_test", [])
+                output["load_test"].append(measure_load(db_container, queries, clear_cache=clear_cache,
+                                                        sample_interval=sample_interval, cgroup_root=cgroup_root,
+                                                        probe=probe, status_probe=status_probe,
+                                                        status_interval=status_interval,
+                                                        **dict({"url": api_url}, **load_test)))
+                report(dataset, "load_test")
+    finally:
+        if worker is not None:
+            worker.remove()
+        if query_client is not None:
+            query_client.close()
+    if cache_modes is not None:
+        output["cache_modes"] = cache_modes
+    if results_db is not None:
+        output["run_id"] = store.save_run(store.connect(results_db), output, git_sha)
     return output
 
 
-def get_metrics(func: Callable, container: Container, clear_cache: bool) -> tuple:
+def _check_trials(warmup: int, repetitions: int) -> None:
+    """Raise ValueError unless there is at least one measured run and no negative number of warmup runs."""
+    if repetitions < 1:
+        raise ValueError(f"repetitions must be at least 1, not {repetitions}")
+    if warmup < 0:
+        raise ValueError(f"warmup can't be negative, not {warmup}")
+
+
+def measure_trials(measure: Callable[[], tuple],
+                   warmup: int = 0,
+                   repetitions: int = 1,
+                   reset: Optional[Callable[[], Any]] = None) -> dict:
     """
-    Get runtime, disk usage, and memory usage for a container during a function call.
+    Measure an operation repeatedly after some warmup runs.
 
-    The runtime may be up to 1s higher than the actual time since container.stats()
-    takes a second to return. This also means if the function finishes in under 1s, it will
-    still report a runtime of 1s.
+    Parameters
+    ----------
+    measure: Callable
+        Function which runs the operation and returns the metrics tuple from get_metrics().
+    warmup: int, optional
+        Number of runs to discard before measuring. Defaults to 0.
+    repetitions: int, optional
+        Number of measured runs. Defaults to 1.
+    reset: Callable, optional
+        Function to restore the starting state between runs of an operation which is not repeatable,
+        e.g. clearing the database between loads. Defaults to None.
 
-    This polling behavior is also the reason for the use of `else: break` in the for loop instead of
-    `while worker_process.is_alive()`, since keeping the same container.stats generator instead of
-    calling it each loop lets us capture more data points.
+    Returns
+    -------
+    Output of parse_metrics() if there was a single measured run, otherwise of summarize_trials(). Measured runs
+    of a query which failed, see epidata.failure(), are left out of it and listed under `failed_trials` instead,
+    as their response records with the `error`. If every run failed, the output only has `failed_trials`, so
+    the rest of a benchmark is still measured and its statistics are missing.
+
+    Raises
+    ------
+    ValueError
+        If `warmup` is negative or `repetitions` is less than 1.
+    """
+    _check_trials(warmup, repetitions)
+    trials, failed = [], []
+    for i in range(warmup + repetitions):
+        if i and reset is not None:
+            reset()
+        metrics = measure()
+        if i >= warmup:
+            trial = parse_metrics(metrics)
+            error = failure(trial["response"]) if "response" in trial else None
+            if error is None:
+                trials.append(trial)
+            else:
+                failed.append(dict(trial["response"], error=error))
+    if not trials:
+        return {"failed_trials": failed}
+    output = trials[0] if repetitions == 1 else summarize_trials(trials)
+    if failed:
+        output["failed_trials"] = failed
+    return output
+
+
+def measure_cached(metrics: Callable,
+                   query: Callable,
+                   client: DockerClient,
+                   container: Container,
+                   mode: str,
+                   warmup: int = 0,
+                   repetitions: int = 1) -> dict:
+    """
+    Measure a query in a cache state, preparing the cache before every run.
 
     Parameters
     ----------
-    func: Callable
-        Function to run while metrics are captured.
+    metrics: Callable
+        get_query_metrics() with everything but the function bound.
+    query: Callable
+        Function which sends the query.
+    client: DockerClient
+        DockerClient object, see cache.prepare_cache().
+    container: Container
+        Docker Container object where the MariaDB database is running.
+    mode: str
+        Cache mode, see cache.prepare_cache().
+    warmup: int, optional
+        Number of runs to discard before measuring. Defaults to 0.
+    repetitions: int, optional
+        Number of measured runs. Defaults to 1.
+
+    Returns
+    -------
+    Output of measure_trials(), plus the output of cache.prepare_cache() for the last run.
+    """
+    state = {}
+
+    def measure():
+        state.update(prepare_cache(client, container, mode, query))
+        return metrics(query, clear_cache=False)
+
+    output = measure_trials(measure, warmup, repetitions)
+    output.update(state)
+    return output
+
+
+def measure_load(container: Container,
+                 queries: list,
+                 weights: list = None,
+                 clear_cache: bool = True,
+                 sample_interval: float = 0.1,
+                 cgroup_root: str = "/sys/fs/cgroup",
+                 probe=None,
+                 status_probe=None,
+                 status_interval: float = 1.0,
+                 **kwargs) -> dict:
+    """
+    Run a concurrent query load test while capturing container metrics.
+
+    The load is generated with asyncio in this process, while the container is sampled on a background thread.
+
+    Parameters
+    ----------
+    container: Container
+        Docker Container object where the MariaDB database is running.
+    queries: list of dictionaries
+        Query parameters making up the load.
+    weights: list of floats, optional
+        Relative frequency of each query. Defaults to equal weights.
+    clear_cache: bool, optional
+        Boolean that determines whether the MariaDB query cache should be flushed (True) or not (False) before running.
+    sample_interval: float, optional
+        Seconds between container memory and CPU samples. Defaults to 0.1.
+    cgroup_root: str, optional
+        Mount point of the host's cgroup hierarchy. Defaults to /sys/fs/cgroup.
+    probe: SqlProbe or ExecProbe, optional
+        How to measure database size and covidcast rows. Defaults to an ExecProbe.
+    status_probe: SqlProbe, optional
+        Separate probe to sample the database with during the load test. Defaults to None (not sampled).
+    status_interval: float, optional
+        Seconds between database samples. Defaults to 1.0.
+    kwargs:
+        Keyword arguments of loadgen.run_load(), e.g. clients, duration_s, ramp_s, rate.
+
+    Returns
+    -------
+    Output of parse_metrics() for the whole load test, with per-query throughput and latency percentiles from
+    loadgen.summarize_load() under `load_test`.
+    """
+    run = partial(generate_load, queries, weights, **kwargs)
+    metrics, summary = capture_metrics(run, container, clear_cache, sample_interval, cgroup_root, probe,
+                                       status_probe, status_interval)
+    output = parse_metrics(metrics)
+    output["load_test"] = summary
+    return output
+
+
+def capture_metrics(run: Callable[[], Any],
+                    container: Container,
+                    clear_cache: bool,
+                    sample_interval: float = 0.1,
+                    cgroup_root: str = "/sys/fs/cgroup",
+                    probe=None,
+                    status_probe=None,
+                    status_interval: float = 1.0) -> Tuple[tuple, Any]:
+    """
+    Capture runtime, disk usage, and memory and CPU usage for a container while calling `run` in this process.
+
+    A ContainerSampler records timestamped container samples on a background thread, so sampling never delays
+    `run` or its timing. Runtime is measured with time.perf_counter() around `run` alone.
+
+    Parameters
+    ----------
+    run: Callable
+        Function to call while metrics are captured.
     container: Container
         Docker Container object which will be monitored.
     clear_cache: bool
         Boolean that determines whether the MariaDB query cache should be flushed (True) or not (False) before running.
+    sample_interval: float, optional
+        Seconds between container samples. Defaults to 0.1.
+    cgroup_root: str, optional
+        Mount point of the host's cgroup hierarchy. Defaults to /sys/fs/cgroup.
+    probe: SqlProbe or ExecProbe, optional
+        How to measure database size and covidcast rows. Defaults to an ExecProbe of `container`.
+    status_probe: SqlProbe, optional
+        Separate probe to sample the database with on another background thread. Defaults to None (not sampled).
+    status_interval: float, optional
+        Seconds between database samples. Defaults to 1.0.
 
     Returns
     -------
-    6-Tuple of start/end disk usage, start/end covidcast table size, runtime, and list of dicts containing docker stats.
+    2-Tuple of the metrics tuple described in get_metrics() and the return value of `run`.
     """
-    worker_process = mp.Process(target=func)
     if clear_cache:
         _clear_cache(container)
-    container_stats = [container.stats(stream=False)]  # get one stat right before starting process
-    start_size = _get_epidata_db_size(container).output
-    start_rows = _get_covidcast_rows(container).output
-    start_time = time.time()
-    worker_process.start()
-    for stat in container.stats(decode=True):
-        if worker_process.is_alive():
-            container_stats.append(stat)
-        else:
-            break
-    end_time = time.time()
-    end_size = _get_epidata_db_size(container).output
-    end_rows = _get_covidcast_rows(container).output
-    return (parse_db_size(start_size),
-            parse_db_size(end_size),
-            parse_row_count(start_rows),
-            parse_row_count(end_rows),
-            end_time-start_time,
-            container_stats)
+    probe = probe or ExecProbe(container)
+    start_size = probe.db_size_mb()
+    start_rows = probe.covidcast_rows()
+    sampler = ContainerSampler(get_source(container, cgroup_root), sample_interval)
+    sampler.start()  # takes one sample right before starting
+    db_sampler = None
+    try:
+        if status_probe is not None:
+            db_sampler = ContainerSampler(DatabaseSource(status_probe), status_interval)
+            db_sampler.start()
+        start_time = time.perf_counter()
+        result = run()
+        runtime = time.perf_counter() - start_time
+    finally:
+        # stop sampling even if `run` raised, so no thread is left polling the container or database
+        samples = sampler.stop()
+        db_samples = db_sampler.stop() if db_sampler is not None else {}
+    if sampler.error is not None:
+        samples["error"] = sampler.error
+    if db_sampler is not None and db_sampler.error is not None:
+        db_samples["error"] = db_sampler.error
+    end_size = probe.db_size_mb()
+    end_rows = probe.covidcast_rows()
+    return (start_size,
+            end_size,
+            start_rows,
+            end_rows,
+            runtime,
+            samples,
+            db_samples), result
+
+
+def get_metrics(func: Callable,
+                container: Container,
+                clear_cache: bool,
+                sample_interval: float = 0.1,
+                cgroup_root: str = "/sys/fs/cgroup",
+                probe=None,
+                status_probe=None,
+                status_interval: float = 1.0) -> tuple:
+    """
+    Get runtime, disk usage, and memory and CPU usage for a container during a function call.
+
+    The function runs in this process while a ContainerSampler records timestamped container samples on a
+    background thread, so sampling never delays the function or its timing. Runtime is measured with
+    time.perf_counter() around the function alone. The functions measured start containers and wait for them,
+    so they don't compete with sampling for the interpreter; and they aren't run in a forked process, which could
+    inherit locks held by the sampler's thread, or by other workers' threads in parallel.measure_parallel().
+
+    Samples are read from the container's cgroup files when they are visible under `cgroup_root`,
+    which allows sub-second sampling. Otherwise they come from the Docker stats stream, which only
+    updates about once per second.
+
+    Parameters
+    ----------
+    func: Callable
+        Function to run while metrics are captured.
+    container: Container
+        Docker Container object which will be monitored.
+    clear_cache: bool
+        Boolean that determines whether the MariaDB query cache should be flushed (True) or not (False) before running.
+    sample_interval: float, optional
+        Seconds between container samples. Defaults to 0.1.
+    cgroup_root: str, optional
+        Mount point of the host's cgroup hierarchy. Defaults to /sys/fs/cgroup.
+    probe: SqlProbe or ExecProbe, optional
+        How to measure database size and covidcast rows. Defaults to an ExecProbe of `container`.
+    status_probe: SqlProbe, optional
+        Separate probe to sample the database with during the function. Defaults to None (not sampled).
+    status_interval: float, optional
+        Seconds between database samples. Defaults to 1.0.
+
+    Returns
+    -------
+    7-Tuple of start/end disk usage, start/end covidcast table size, runtime, columns of timestamped container
+    samples from ContainerSampler, and columns of timestamped database samples (empty unless `status_probe`
+    is given). Samples which ended early have the ContainerSampler `error` under `error`.
+    """
+    return capture_metrics(func, container, clear_cache, sample_interval, cgroup_root, probe,
+                           status_probe, status_interval)[0]
+
+
+def get_query_metrics(query: Callable[[], dict],
+                      container: Container,
+                      clear_cache: bool,
+                      sample_interval: float = 0.1,
+                      cgroup_root: str = "/sys/fs/cgroup",
+                      probe=None,
+                      status_probe=None,
+                      status_interval: float = 1.0) -> tuple:
+    """
+    Get the metrics of get_metrics() for a query, plus its response.
+
+    Unlike get_metrics(), the function's return value is kept: actions.send_query() streams the response
+    without keeping it, and returns its time to first byte and response size.
+
+    Parameters
+    ----------
+    query: Callable
+        Function which sends the query and returns the output of epidata.EpidataClient.fetch(), e.g. a partial
+        of actions.send_query().
+    container: Container
+        Docker Container object which will be monitored.
+    clear_cache: bool
+        Boolean that determines whether the MariaDB query cache should be flushed (True) or not (False) before running.
+    sample_interval: float, optional
+        Seconds between container samples. Defaults to 0.1.
+    cgroup_root: str, optional
+        Mount point of the host's cgroup hierarchy. Defaults to /sys/fs/cgroup.
+    probe: SqlProbe or ExecProbe, optional
+        How to measure database size and covidcast rows. Defaults to an ExecProbe of `container`.
+    status_probe: SqlProbe, optional
+        Separate probe to sample the database with during the query. Defaults to None (not sampled).
+    status_interval: float, optional
+        Seconds between database samples. Defaults to 1.0.
+
+    Returns
+    -------
+    8-Tuple of the 7-tuple described in get_metrics() and the query's response record.
+    """
+    metrics, response = capture_metrics(query, container, clear_cache, sample_interval, cgroup_root, probe,
+                                        status_probe, status_interval)
+    return metrics + (response,)
@@ -0,0 +1,284 @@
+"""Measure independent datasets in parallel, each worker with its own pinned database container."""
+import queue
+import re
+import socket
+import threading
+from typing import List, Optional
+
+from docker import DockerClient
+from docker.models.containers import Container
+
+from delphi.operations.database_metrics.actions import API_URL, dataset_label
+from delphi.operations.database_metrics.db_actions import wait_for_database
+from delphi.operations.database_metrics.monitor import measure_database
+from delphi.operations.database_metrics import store
+
+DB_ALIAS = "delphi_database_epidata"
+WEB_ALIAS = "delphi_web_epidata"
+# measure_database() output keys with a result for each dataset, besides query<i> and query<i>_<mode>
+PER_DATASET = ("load", "meta", "load_test")
+
+
+def get_cpusets(total_cpus: int, workers: int, cpus_per_worker: Optional[int] = None) -> List[str]:
+    """
+    Split CPUs into disjoint sets, one per worker.
+
+    Parameters
+    ----------
+    total_cpus: int
+        Number of CPUs on the Docker host.
+    workers: int
+        Number of workers.
+    cpus_per_worker: int, optional
+        CPUs to give each worker. Defaults to an even split of `total_cpus`.
+
+    Returns
+    -------
+    List of cpuset strings for containers.run(cpuset_cpus=...), e.g. ["0-3", "4-7"].
+    """
+    cpus_per_worker = cpus_per_worker or total_cpus // workers
+    if cpus_per_worker < 1 or cpus_per_worker * workers > total_cpus:
+        raise ValueError(f"can't pin {workers} workers with {cpus_per_worker} CPUs each to {total_cpus} CPUs")
+    return [f"{i * cpus_per_worker}-{(i + 1) * cpus_per_worker - 1}" for i in range(workers)]
+
+
+def merge_outputs(outputs: List[dict], datasets: list) -> dict:
+    """
+    Merge the measure_database() outputs of single datasets into the output for all of them.
+
+    Parameters
+    ----------
+    outputs: list of dicts
+        Output of measure_database() for each dataset, in the order of `datasets`.
+    datasets: list of tuples
+        All datasets measured.
+
+    Returns
+    -------
+    Dictionary in the same shape as measure_database() output for `datasets`. Results of each dataset are
+    concatenated, while settings shared by every output, such as `cache_modes`, are taken from the first.
+    `container_overhead`, measured by each worker for every dataset, is keyed by dataset label.
+    """
+    merged = {"datasets": datasets, "queries": outputs[0]["queries"], "append_datasets": False}
+    if "cache_modes" in outputs[0]:
+        merged["cache_modes"] = outputs[0]["cache_modes"]
+    for output in outputs:
+        for key, values in output.items():
+            if key in PER_DATASET or re.fullmatch(r"query\d+(_\w+)?", key):
+                merged.setdefault(key, []).extend(values)
+        if "container_overhead" in output:
+            overhead = merged.setdefault("container_overhead", {})
+            overhead.update({dataset_label(d): output["container_overhead"] for d in output["datasets"]})
+    return merged
+
+
+class Worker:
+    """A database container, and optionally a web server, on a private network pinned to some CPUs."""
+
+    def __init__(self, client: DockerClient, name: str, network, db: Container, web: Optional[Container],
+                 resources: dict):
+        self.client = client
+        self.name = name
+        self.network = network
+        self.db = db
+        self.web = web
+        self.resources = resources
+
+    @staticmethod
+    def new_instance(client: DockerClient,
+                     name: str,
+                     db_image: str,
+                     web_image: Optional[str],
+                     cpuset: str,
+                     mem_limit: Optional[str] = None,
+                     harness: Optional[str] = None,
+                     db_command: Optional[List[str]] = None) -> "Worker":
+        """
+        Start a worker's containers.
+
+        The network gives the database the alias delphi_database_epidata, and the web server
+        delphi_web_epidata, so the python and web images find them without changes.
+
+        Parameters
+        ----------
+        client: DockerClient
+            DockerClient object to start containers with.
+        name: str
+            Prefix for the network and container names.
+        db_image: str
+            Image of the epidata database.
+        web_image: str, optional
+            Image of the Epidata API web server, needed to run queries. Defaults to None (no web server).
+        cpuset: str
+            CPUs the worker's containers may run on.
+        mem_limit: str, optional
+            Memory limit of each of the worker's database and python containers, e.g. "4g". Defaults to None
+            (unlimited).
+        harness: str, optional
+            Name or ID of the container running this code, which joins the network to send queries.
+        db_command: list of str, optional
+            Arguments of the database container, e.g. ["--innodb_buffer_pool_size=4G"] to start MariaDB with
+            other server variables. Defaults to None (the image's command).
+
+        Returns
+        -------
+        Worker whose database is ready.
+        """
+        network = client.networks.create(name)
+        # the python containers measure_database() starts share the database's CPUs and memory limit
+        resources = {"cpuset_cpus": cpuset}
+        if mem_limit is not None:
+            resources["mem_limit"] = mem_limit
+        worker = Worker(client, name, network, None, None, resources)
+
+        def start(image: str, alias: str, **kwargs) -> Container:
+            # containers.run() can't set a network alias, so connect before starting
+            container = client.containers.create(image, name=f"{name}_{alias}", cpuset_cpus=cpuset, **kwargs)
+            network.connect(container, aliases=[alias])
+            container.start()
+            return container
+
+        try:
+            worker.db = start(db_image, DB_ALIAS, mem_limit=mem_limit, command=db_command)
+            if web_image is not None:
+                worker.web = start(web_image, WEB_ALIAS)
+                if harness is not None:
+                    network.connect(harness)
+            wait_for_database(worker.db)
+        except Exception:
+            worker.remove(harness)
+            raise
+        return worker
+
+    def remove(self, harness: Optional[str] = None) -> None:
+        """Remove the worker's containers and network."""
+        if harness is not None and self.web is not None:
+            self.network.disconnect(harness, force=True)
+        for container in [self.web, self.db]:
+            if container is not None:
+                container.remove(force=True)
+        self.network.remove()
+
+    @property
+    def api_url(self) -> str:
+        """Epidata API endpoint of the worker's web server, if it has one."""
+        return f"http://{self.web.name}:80/epidata/api.php" if self.web is not None else API_URL
+
+    def measure(self, datasets: list, python_image_name: str, queries: Optional[list], **kwargs) -> dict:
+        """Run measure_database() for datasets against this worker's containers."""
+        return measure_database(datasets, self.client, self.db.name, python_image_name, queries,
+                                network=self.name, container_resources=self.resources,
+                                api_url=self.api_url, synthetic_volume=f"{self.name}_synthetic", **kwargs)
+
+
+def measure_parallel(datasets: list,
+                     client: DockerClient,
+                     workers: int = 2,
+                     python_image_name: str = "delphi_python",
+                     queries: list = None,
+                     db_image: str = "delphi_database_epidata",
+                     web_image: str = "delphi_web_epidata",
+                     cpus_per_worker: int = None,
+                     mem_limit: str = None,
+                     prefix: str = "delphi_metrics",
+                     harness: str = None,
+                     results_db: str = None,
+                     git_sha: str = None,
+                     **kwargs) -> dict:
+    """
+    Measure datasets independently and in parallel, each worker against its own database container.
+
+    Each worker gets a private Docker network with a fresh database container, and a web server if there are
+    queries, started from the dev/docker images. All of a worker's containers, including the python containers
+    loading data, are pinned to a disjoint set of CPUs so workers don't skew each other. Each worker measures
+    one dataset at a time from a shared queue, clearing its database in between, so this is equivalent to
+    measure_database() with `append_datasets=False`.
+
+    Parameters
+    ----------
+    datasets: list of tuples
+        List of 2-tuples defined as (source, patterns for files) to be included in each dataset.
+    client: DockerClient
+        DockerClient object to start containers with.
+    workers: int, optional
+        Number of datasets to measure at once. Defaults to 2.
+    python_image_name: str, optional
+        Name of Docker image containing the data loading and metadata updating code.
+    queries: list of dictionaries, optional
+        List of query parameters to test query runtimes on. Defaults to empty list.
+    db_image: str, optional
+        Image of the epidata database. Defaults to delphi_database_epidata.
+    web_image: str, optional
+        Image of the Epidata API web server, only started if there are queries. Defaults to delphi_web_epidata.
+    cpus_per_worker: int, optional
+        CPUs to pin each worker to. Defaults to an even split of the Docker host's CPUs.
+    mem_limit: str, optional
+        Memory limit of each worker's database container, and of each python container, e.g. "4g". Defaults to
+        None (unlimited).
+    prefix: str, optional
+        Prefix for the names of the networks and containers created. Defaults to delphi_metrics.
+    harness: str, optional
+        Name or ID of the container running this code, which joins each worker's network to send queries.
+        Defaults to this host's name, which Docker sets to the container ID.
+    results_db: str, optional
+        If given, save the merged output to this result store. See measure_database().
+    git_sha: str, optional
+        Commit of the acquisition code being measured, to key the saved run.
+    kwargs:
+        Other arguments of measure_database(). `probe` and `status_probe` aren't supported, since each worker
+        has its own database.
+
+    Returns
+    -------
+    Dictionary of metrics in the same shape as measure_database() output, see merge_outputs().
+    """
+    if kwargs.get("append_datasets"):
+        raise ValueError("datasets can't be appended when they are measured in parallel")
+    if "probe" in kwargs or "status_probe" in kwargs:
+        raise ValueError("probes connect to a single database and can't be shared between workers")
+    if not datasets:
+        raise ValueError("there are no datasets to measure")
+    if workers < 1:
+        raise ValueError(f"workers must be at least 1, not {workers}")
+    kwargs.pop("append_datasets", None)
+    workers = min(workers, len(datasets))
+    cpusets = get_cpusets(client.info()["NCPU"], workers, cpus_per_worker)
+    web_image = web_image if queries else None
+    harness = (harness or socket.gethostname()) if web_image is not None else None
+
+    pending = queue.Queue()
+    for i, dataset in enumerate(datasets):
+        pending.put((i, dataset))
+    outputs = [None] * len(datasets)
+    errors = []
+
+    def work(index: int) -> None:
+        try:
+            worker = Worker.new_instance(client, f"{prefix}_{index}", db_image, web_image, cpusets[index],
+                                         mem_limit, harness)
+        except Exception as e:
+            errors.append(e)
+            return
+        try:
+            while not errors:
+                try:
+                    i, dataset = pending.get_nowait()
+                except queue.Empty:
+                    break
+                outputs[i] = worker.measure([dataset], python_image_name, queries, **kwargs)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            worker.remove(harness)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    output = merge_outputs(outputs, datasets)
+    if results_db is not None:
+        output["run_id"] = store.save_run(store.connect(results_db), output, git_sha)
+    return output
@@ -1,55 +1,242 @@
 """Parse database and container metrics into more usable formats."""
+from typing import Dict, List
 
+import numpy as np
+import pandas as pd
 
-def parse_db_size(query_result: bytes) -> float:
+TRIAL_STATS = ["runtime", "ttfb", "peak_memory_mb", "peak_working_set_mb", "avg_cpu_cores", "size_loaded_mb",
+               "rows_loaded"]
+MB = 1024 * 1024
+
+
+def parse_batch(output: bytes) -> List[List[str]]:
+    r"""
+    Split `mysql --batch --raw --skip-column-names` output into rows of column values.
+
+    With these options every row is one line of tab-separated values, with nothing escaped and no header, e.g.
+    `b'epidata\t7.79687500\ninformation_schema\t0.18750000\n'`. NULL values are the string `NULL`.
+
+    Parameters
+    ----------
+    output: bytes
+        Standard output of the mysql client.
+
+    Returns
+    -------
+    List of rows, each a list of strings.
+    """
+    return [line.split("\t") for line in output.decode().splitlines()]
+
+
+def parse_db_sizes(output: bytes) -> Dict[str, float]:
+    r"""
+    Parse the output of the SQL query in _get_epidata_db_size() into the size of every schema.
+
+    Parameters
+    ----------
+    output: bytes
+        Standard output from _get_epidata_db_size(), e.g. `b'epidata\t7.79687500\nmysql\t2.5\n'`.
+
+    Returns
+    -------
+    Dictionary of the size of each schema in megabytes, by schema name.
+    """
+    return {schema: float(size) for schema, size in parse_batch(output)}
+
+
+def parse_db_size(output: bytes, schema: str = "epidata") -> float:
     r"""
-    Parse the output of the SQL query in _get_epidata_db_size() to return the epidata database size.
+    Parse the output of the SQL query in _get_epidata_db_size() to return the size of one schema.
 
-    The _get_epidata_db_size() ExecResult output will be a bytestring like
-    `b'db\tsize_mb\nepidata\t7.79687500\ninformation_schema\t0.18750000\n'`. This function
-    will parse out the first value which should correspond to the epidata db.
+    The schema is found by name, wherever it sorts among the others.
 
     Parameters
     ----------
-    query_result: bytes
-        Bytestring result from _get_epidata_db_size().
+    output: bytes
+        Standard output from _get_epidata_db_size().
+    schema: str, optional
+        Schema to return the size of. Defaults to epidata.
 
     Returns
     -------
-    Float representing size of epidata database in megabytes.
+    Float representing size of the schema in megabytes.
+
+    Raises
+    ------
+    ValueError if the schema isn't in the output, e.g. when measuring the wrong database.
     """
-    db_disks = query_result.decode().split("\n")
-    epidata_usage = db_disks[1].split("\t")[1]
-    return float(epidata_usage)
+    sizes = parse_db_sizes(output)
+    if schema not in sizes:
+        raise ValueError(f"no {schema} schema in database sizes {sorted(sizes)}")
+    return sizes[schema]
 
 
-def parse_row_count(query_result: bytes) -> int:
+def parse_row_count(output: bytes) -> int:
     r"""
     Parse the output of the SQL query in _get_covidcast_rows() to return the covidcast row count.
 
-    The _get_covidcast_rows() ExecResult output will be a bytestring like
-    b'count(*)\n1604\n'. This function will retrieve 1604 as an integer
+    The output is a single value like `b'1604\n'`, which is converted without splitting or decoding it.
+
+    Parameters
+    ----------
+    output: bytes
+        Standard output from _get_covidcast_rows().
+
+    Returns
+    -------
+    Integer number of rows.
+
+    Raises
+    ------
+    ValueError if the output isn't a single integer.
+    """
+    return int(output)
+
+
+def _series(values: np.ndarray) -> list:
+    """Convert an array to a list for JSON, with None for NaN."""
+    return [None if np.isnan(v) else float(v) for v in values]
+
+
+def _rates(counter: np.ndarray, time: np.ndarray) -> np.ndarray:
+    """Rate of change of a cumulative counter since the previous sample, NaN for the first sample."""
+    elapsed = np.diff(time)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rates = np.where(elapsed > 0, np.diff(counter) / elapsed, np.nan)
+    return np.concatenate([[np.nan], rates])
+
+
+def parse_samples(samples: Dict[str, np.ndarray]) -> dict:
+    """
+    Convert the samples captured by ContainerSampler into memory, CPU, and block I/O time series.
+
+    Parameters
+    ----------
+    samples: dict of arrays
+        Columns with `time` (seconds from time.perf_counter()), `memory_usage` and `memory_cache` (bytes),
+        `cpu_usage_ns` (cumulative CPU time in nanoseconds), and `blkio_read_bytes` and `blkio_write_bytes`
+        (cumulative bytes). Missing cache and block I/O columns are read as 0.
+
+    Returns
+    -------
+    Dictionary of equal-length float arrays, which stay compact for long runs until they are written out, e.g. by
+    benchmark.write_json(): `time_s`, seconds since the first sample, `memory_mb`, total usage, `working_set_mb`,
+    usage minus page cache, `cpu_cores`, the average number of cores used since the previous sample (0 for the
+    first sample), and `read_mb` and `write_mb`, block I/O since the first sample.
+    """
+    time = np.asarray(samples["time"], dtype=float)
+    zeros = np.zeros_like(time)
+    memory = np.asarray(samples["memory_usage"], dtype=float)
+    cache = np.asarray(samples.get("memory_cache", zeros), dtype=float)
+    read = np.asarray(samples.get("blkio_read_bytes", zeros), dtype=float)
+    write = np.asarray(samples.get("blkio_write_bytes", zeros), dtype=float)
+    cores = np.nan_to_num(_rates(np.asarray(samples["cpu_usage_ns"], dtype=float), time) / 1e9)
+    return {"time_s": time - time[0],
+            "memory_mb": memory / MB,
+            "working_set_mb": (memory - cache) / MB,
+            "cpu_cores": cores,
+            "read_mb": (read - read[0]) / MB,
+            "write_mb": (write - write[0]) / MB}
+
+
+def summarize_samples(samples: Dict[str, np.ndarray]) -> dict:
+    """
+    Reduce the samples captured by ContainerSampler to totals over the operation.
+
+    Parameters
+    ----------
+    samples: dict of arrays
+        Columns as for parse_samples().
+
+    Returns
+    -------
+    Dictionary with `peak_memory_mb`, the highest total usage, `peak_working_set_mb`, the highest usage minus
+    page cache, as `docker stats` reports it, `avg_cpu_cores`, CPU time over the time sampled, and
+    `read_bytes` and `written_bytes` by block devices.
+    """
+    time = np.asarray(samples["time"], dtype=float)
+    zeros = np.zeros_like(time)
+    memory = np.asarray(samples["memory_usage"], dtype=float)
+    working_set = memory - np.asarray(samples.get("memory_cache", zeros), dtype=float)
+    cpu = np.asarray(samples["cpu_usage_ns"], dtype=float)
+    read = np.asarray(samples.get("blkio_read_bytes", zeros), dtype=float)
+    write = np.asarray(samples.get("blkio_write_bytes", zeros), dtype=float)
+    elapsed = time[-1] - time[0]
+    return {"peak_memory_mb": float(memory.max() / MB),
+            "peak_working_set_mb": float(working_set.max() / MB),
+            "avg_cpu_cores": float((cpu[-1] - cpu[0]) / 1e9 / elapsed) if elapsed > 0 else 0.0,
+            "read_bytes": int(read[-1] - read[0]),
+            "written_bytes": int(write[-1] - write[0])}
+
+
+def parse_db_samples(db_samples: Dict[str, np.ndarray], origin: float) -> dict:
+    """
+    Convert the samples captured by a sampler.DatabaseSource into a database time series.
+
+    Parameters
+    ----------
+    db_samples: dict of arrays
+        Columns with `time` (seconds from time.perf_counter()), `rows`, `db_size_mb`, and status counters.
+    origin: float
+        time.perf_counter() value to measure `time_s` from, normally that of the first container sample.
+
+    Returns
+    -------
+    Dictionary of equal-length lists: `time_s`, `rows`, `db_size_mb`, every status counter, and, since the
+    previous sample (None for the first), `rows_per_s` from Innodb_rows_inserted and `buffer_pool_hit_rate`,
+    the fraction of InnoDB page reads served from the buffer pool.
+    """
+    time = np.asarray(db_samples["time"], dtype=float)
+    series = {"time_s": (time - origin).tolist()}
+    nan = np.full_like(time, np.nan)
+    rows_per_s = nan
+    if "Innodb_rows_inserted" in db_samples:
+        rows_per_s = _rates(np.asarray(db_samples["Innodb_rows_inserted"], dtype=float), time)
+    hit_rate = nan
+    if "Innodb_buffer_pool_read_requests" in db_samples:
+        requests = np.diff(np.asarray(db_samples["Innodb_buffer_pool_read_requests"], dtype=float))
+        reads = np.diff(np.asarray(db_samples.get("Innodb_buffer_pool_reads", nan), dtype=float))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rates = np.where(requests > 0, 1 - np.nan_to_num(reads) / requests, np.nan)
+        hit_rate = np.concatenate([[np.nan], rates])
+    series["rows_per_s"] = _series(rows_per_s)
+    series["buffer_pool_hit_rate"] = _series(hit_rate)
+    for key, values in db_samples.items():
+        if key != "time":
+            series[key] = _series(np.asarray(values, dtype=float))
+    return series
+
+
+def to_timeseries(result: dict) -> pd.DataFrame:
+    """
+    Build a tidy time series of one measurement for plotting.
+
+    If database samples were taken, each is joined to the nearest container sample in time, so e.g. rows per
+    second can be plotted against table size alongside memory and CPU.
 
     Parameters
     ----------
-    query_result: bytes
-        Bytestring result from _get_epidata_db_size().
+    result: dict
+        Output of parse_metrics().
 
     Returns
     -------
-    Float representing size of epidata database in megabytes.
+    DataFrame with columns `time_s`, `metric`, and `value`, one row per metric per sample.
     """
-    db_rows = query_result.decode().split("\n")[1]
-    return int(db_rows)
+    frame = pd.DataFrame(result["samples"])
+    if result.get("db_samples"):
+        frame = pd.merge_asof(pd.DataFrame(result["db_samples"]).sort_values("time_s"),
+                              frame.sort_values("time_s"), on="time_s", direction="nearest")
+    frame = frame.melt(id_vars="time_s", var_name="metric", value_name="value")
+    return frame.dropna(subset=["value"]).sort_values(["metric", "time_s"]).reset_index(drop=True)
 
 
 def parse_metrics(metrics: tuple) -> dict:
     """
     Parse and convert the metrics captured by get_metrics() into a dictionary.
 
-    The main role of this is to parse the enormous dict returned by docker.container.stats and just
-    retrieve the memory usage as a list. NOTE: memory_usage_mb is total usage in megabytes,
-    while the `docker stats` command line command reports total - cache.
+    `peak_memory_mb` is total usage, including page cache the kernel can reclaim, while `peak_working_set_mb`
+    matches what the `docker stats` command line command reports.
 
     Parameters
     ----------
@@ -59,13 +246,99 @@ def parse_metrics(metrics: tuple) -> dict:
     Returns
     -------
     Dictionary containing the final rows in the covidcast table, rows loaded to the the covidcast table during the
-    operation, final database size, change in database size during the operation, runtime, and the maximum memory
-    usage queried during the function call.
+    operation, final database size, change in database size during the operation, runtime, the totals from
+    summarize_samples(), and the time series from parse_samples(). If the database was sampled, its time series
+    from parse_db_samples() is under `db_samples`. If either sampler stopped early, its error is under
+    `samples_error` or `db_samples_error`, and its series ends there. For a query from get_query_metrics(), its
+    response record is under `response`, and its time to first byte under `ttfb`.
     """
     output = {"final_table_rows": metrics[3],
               "rows_loaded": metrics[3] - metrics[2],
               "db_size_mb": metrics[1],
               "size_loaded_mb": metrics[1] - metrics[0],
-              "runtime": metrics[4],
-              "peak_memory_mb": max(i["memory_stats"]["usage"] / 1024 / 1024 for i in metrics[5])}
+              "runtime": metrics[4]}
+    samples = dict(metrics[5])
+    if "error" in samples:
+        output["samples_error"] = samples.pop("error")
+    output.update(summarize_samples(samples))
+    output["samples"] = parse_samples(samples)
+    if len(metrics) > 6 and len(metrics[6]):
+        db_samples = dict(metrics[6])
+        if "error" in db_samples:
+            output["db_samples_error"] = db_samples.pop("error")
+        output["db_samples"] = parse_db_samples(db_samples, samples["time"][0])
+    if len(metrics) > 7 and metrics[7] is not None:
+        output["response"] = metrics[7]
+        output["ttfb"] = metrics[7]["ttfb"]
+    return output
+
+
+def bootstrap_ci(values: list, confidence: float = 0.95, resamples: int = 1000, seed: int = 0) -> tuple:
+    """
+    Estimate a confidence interval for the median of `values` with the percentile bootstrap.
+
+    Parameters
+    ----------
+    values: list of floats
+        Observed values.
+    confidence: float, optional
+        Coverage of the interval. Defaults to 0.95.
+    resamples: int, optional
+        Number of bootstrap resamples. Defaults to 1000.
+    seed: int, optional
+        Seed for the resampling, so repeated summaries of the same trials agree. Defaults to 0.
+
+    Returns
+    -------
+    2-Tuple of the lower and upper bounds of the interval.
+    """
+    values = np.asarray(values, dtype=float)
+    rng = np.random.default_rng(seed)
+    medians = np.median(rng.choice(values, size=(resamples, len(values)), replace=True), axis=1)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(medians, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+
+def summarize_trials(trials: List[dict], outlier_k: float = 1.5, confidence: float = 0.95) -> dict:
+    """
+    Combine the parse_metrics() output of repeated trials of one operation.
+
+    Each statistic in TRIAL_STATS which every trial has is summarized by its median, quartiles, interquartile
+    range, and a bootstrap confidence interval for the median. Trials whose runtime falls outside Tukey's fences,
+    more than `outlier_k` IQRs beyond the quartiles, are flagged as outliers; these are usually runs disturbed by
+    other activity on the host. They are still included in the summary, which is robust to a few of them.
+
+    Parameters
+    ----------
+    trials: list of dicts
+        Output of parse_metrics() for each trial, in the order they ran.
+    outlier_k: float, optional
+        Width of Tukey's fences in IQRs. Defaults to 1.5.
+    confidence: float, optional
+        Coverage of the bootstrap confidence intervals. Defaults to 0.95.
+
+    Returns
+    -------
+    The parse_metrics() output of the trial with the median runtime (the lower one for an even number of
+    trials), plus `stats`, a dict of `median`, `q1`, `q3`, `iqr`, `ci_low`, and `ci_high` for each statistic,
+    `trials`, the list of trial outputs each with an `outlier` flag, and `outliers`, the indices of the
+    outlying trials.
+    """
+    stats = {}
+    for key in (k for k in TRIAL_STATS if all(k in t for t in trials)):
+        values = np.array([t[key] for t in trials], dtype=float)
+        q1, median, q3 = np.percentile(values, [25, 50, 75])
+        ci_low, ci_high = bootstrap_ci(values, confidence)
+        stats[key] = {"median": float(median), "q1": float(q1), "q3": float(q3), "iqr": float(q3 - q1),
+                      "ci_low": ci_low, "ci_high": ci_high}
+    runtime = stats["runtime"]
+    low = runtime["q1"] - outlier_k * runtime["iqr"]
+    high = runtime["q3"] + outlier_k * runtime["iqr"]
+    trials = [dict(t, outlier=not low <= t["runtime"] <= high) for t in trials]
+    order = sorted(range(len(trials)), key=lambda i: trials[i]["runtime"])
+    output = {k: v for k, v in trials[order[(len(trials) - 1) // 2]].items() if k != "outlier"}
+    output.update({"stats": stats,
+                   "trials": trials,
+                   "outliers": [i for i, t in enumerate(trials) if t["outlier"]]})
     return output
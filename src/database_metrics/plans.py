@@ -0,0 +1,215 @@
+"""Find the SQL behind an Epidata query and record how MariaDB executes it."""
+import hashlib
+import json
+from typing import Callable, List, Optional
+
+from docker.models.containers import Container
+
+from delphi.operations.database_metrics.db_actions import _run_sql
+
+COLUMNS = ["signal", "time_value", "geo_value", "direction", "value", "stderr", "sample_size", "issue", "lag"]
+KEY_FIELDS = ["source", "signal", "time_type", "geo_type", "time_value", "geo_value"]
+# how monitor.measure_database() gets the SQL of a query: from query_to_sql(), or the general log
+PLAN_SOURCES = ["translate", "log"]
+
+
+def _quote(value: str) -> str:
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def _list(value) -> List[str]:
+    return value if isinstance(value, list) else str(value).split(",")
+
+
+def _range_condition(column: str, values) -> str:
+    """SQL condition for a list of values and `first-last` ranges, as accepted by the API."""
+    conditions = []
+    for value in _list(values):
+        if "-" in str(value):
+            first, last = str(value).split("-")
+            conditions.append(f"(t.`{column}` BETWEEN {int(first)} AND {int(last)})")
+        else:
+            conditions.append(f"t.`{column}` = {int(value)}")
+    return "(" + " OR ".join(conditions) + ")"
+
+
+def query_to_sql(params: dict) -> str:
+    """
+    Translate the parameters of a covidcast API query into the SQL the API issues for it.
+
+    This follows the covidcast endpoint's query builder: the latest issue of each row unless `issues`, `lag`,
+    or `as_of` is given, ordered by signal, time, and location. Use capture_sql() to see the exact statements
+    if the API has changed.
+
+    Parameters
+    ----------
+    params: dict
+        Query parameters, as for actions.send_query().
+
+    Returns
+    -------
+    SQL statement.
+    """
+    signals = _list(params.get("signals", params.get("signal")))
+    conditions = [f"t.`source` = {_quote(params['data_source'])}",
+                  f"t.`signal` IN ({', '.join(_quote(s) for s in signals)})",
+                  f"t.`time_type` = {_quote(params['time_type'])}",
+                  f"t.`geo_type` = {_quote(params['geo_type'])}",
+                  _range_condition("time_value", params["time_values"])]
+    geo_values = params.get("geo_values", params.get("geo_value", "*"))
+    if geo_values != "*":
+        conditions.append(f"t.`geo_value` IN ({', '.join(_quote(g) for g in _list(geo_values))})")
+    join = ""
+    if "issues" in params:
+        conditions.append(_range_condition("issue", params["issues"]))
+    elif "lag" in params:
+        conditions.append(f"t.`lag` = {int(params['lag'])}")
+    elif "as_of" in params:
+        keys = ", ".join(f"`{k}`" for k in KEY_FIELDS)
+        on = " AND ".join(f"x.`{k}` = t.`{k}`" for k in KEY_FIELDS)
+        join = (f" JOIN (SELECT {keys}, MAX(`issue`) `max_issue` FROM `epidata`.`covidcast` "
+                f"WHERE `issue` <= {int(params['as_of'])} GROUP BY {keys}) x "
+                f"ON {on} AND x.`max_issue` = t.`issue`")
+    else:
+        conditions.append("t.`is_latest_issue` IS TRUE")
+    columns = ", ".join(f"t.`{c}`" for c in COLUMNS)
+    return (f"SELECT {columns} FROM `epidata`.`covidcast` t{join} WHERE {' AND '.join(conditions)} "
+            f"ORDER BY t.`signal` ASC, t.`time_value` ASC, t.`geo_value` ASC")
+
+
+def capture_sql(container: Container, run: Callable[[], object]) -> List[str]:
+    """
+    Record the covidcast SELECT statements the database receives while `run` is called, using the general log.
+
+    The general log is written to the mysql.general_log table and turned off again afterwards. It slows every
+    statement down, so don't capture during a measurement.
+
+    Parameters
+    ----------
+    container: Container
+        Docker Container object where the MariaDB database is running.
+    run: Callable
+        Function which sends the query, e.g. a partial of actions.send_query().
+
+    Returns
+    -------
+    List of SQL statements, in the order they were received.
+
+    Raises
+    ------
+    db_actions.ExecError if the general log couldn't be turned on or read.
+    """
+    _run_sql(container, "SET GLOBAL log_output = 'TABLE'; TRUNCATE TABLE mysql.general_log; "
+                        "SET GLOBAL general_log = 1;")
+    try:
+        run()
+    finally:
+        _run_sql(container, "SET GLOBAL general_log = 0;")
+    output = _run_sql(container, "SELECT REPLACE(REPLACE(argument, '\\n', ' '), '\\t', ' ') "
+                                 "FROM mysql.general_log WHERE command_type = 'Query' "
+                                 "AND argument LIKE 'SELECT%covidcast%' ORDER BY event_time;")
+    return [line for line in output.decode().split("\n") if line]
+
+
+def explain(container: Container, sql: str, analyze: bool = False) -> dict:
+    """
+    Get the plan MariaDB chooses for a statement.
+
+    Parameters
+    ----------
+    container: Container
+        Docker Container object where the MariaDB database is running.
+    sql: str
+        SELECT statement.
+    analyze: bool, optional
+        If True, run the statement with ANALYZE FORMAT=JSON, so the plan also has the rows actually read
+        (`r_rows`) and time spent. Otherwise only EXPLAIN FORMAT=JSON estimates. Defaults to False.
+
+    Returns
+    -------
+    Plan as a dictionary.
+
+    Raises
+    ------
+    db_actions.ExecError if MariaDB couldn't explain the statement.
+    """
+    return json.loads(_run_sql(container, f"{'ANALYZE' if analyze else 'EXPLAIN'} FORMAT=JSON {sql}").decode())
+
+
+def summarize_plan(plan: dict) -> dict:
+    """
+    Pick out how each table is accessed in a plan from explain().
+
+    Parameters
+    ----------
+    plan: dict
+        Output of explain().
+
+    Returns
+    -------
+    Dictionary with `tables`, a list with the table name, access type, index used and considered, and estimated
+    (`rows`) and, if analyzed, actual (`r_rows`) rows read for each table access; `rows_examined`, the total of
+    actual rows read if analyzed and otherwise of estimated rows; `uses_index`, whether every access used an
+    index; and `fingerprint`, a hash of the access pattern which changes when the plan does.
+    """
+    tables = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if "table_name" in node:
+                tables.append({"table": node["table_name"],
+                               "access_type": node.get("access_type"),
+                               "key": node.get("key"),
+                               "possible_keys": node.get("possible_keys"),
+                               "rows": node.get("rows"),
+                               "r_rows": node.get("r_rows")})
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(plan)
+    analyzed = any(t["r_rows"] is not None for t in tables)
+    rows_examined = sum((t["r_rows"] if analyzed else t["rows"]) or 0 for t in tables)
+    pattern = json.dumps([(t["table"], t["access_type"], t["key"]) for t in tables])
+    return {"tables": tables,
+            "rows_examined": rows_examined,
+            "uses_index": all(t["key"] is not None for t in tables),
+            "fingerprint": hashlib.sha256(pattern.encode()).hexdigest()[:12]}
+
+
+def capture_plan(container: Container,
+                 params: dict,
+                 run: Optional[Callable[[], object]] = None,
+                 analyze: bool = True) -> dict:
+    """
+    Find the SQL for a query and record its plan.
+
+    Parameters
+    ----------
+    container: Container
+        Docker Container object where the MariaDB database is running.
+    params: dict
+        Query parameters, translated with query_to_sql() if `run` isn't given.
+    run: Callable, optional
+        Function which sends the query. If given, the SQL is captured from the general log instead of
+        translated. Defaults to None.
+    analyze: bool, optional
+        Whether to run the statements with ANALYZE rather than only EXPLAIN them. Defaults to True.
+
+    Returns
+    -------
+    Dictionary with the list of `statements`, each with its `sql`, `plan` from explain(), and the output of
+    summarize_plan(), and `rows_examined`, `uses_index`, and `fingerprint` over all statements.
+    """
+    sqls = capture_sql(container, run) if run is not None else [query_to_sql(params)]
+    statements = []
+    for sql in sqls:
+        plan = explain(container, sql, analyze)
+        statements.append(dict(summarize_plan(plan), sql=sql, plan=plan))
+    fingerprint = "+".join(s["fingerprint"] for s in statements)
+    return {"statements": statements,
+            "rows_examined": sum(s["rows_examined"] for s in statements),
+            "uses_index": all(s["uses_index"] for s in statements),
+            "fingerprint": hashlib.sha256(fingerprint.encode()).hexdigest()[:12]}
@@ -0,0 +1,227 @@
+"""
+Profile the acquisition code while it is measured, to find where ingestion and metadata updates spend their time.
+
+A Profiler makes actions.load_data(), actions.load_synthetic(), and actions.update_meta() run their Python modules
+under cProfile, which writes a pstats file per process, or under py-spy, a sampling profiler which writes collapsed
+stacks that flamegraph.pl or speedscope render as a flamegraph. Files are written to a Docker volume, one directory
+per measurement, and summarized into hot spots by running this module in the python container:
+
+```
+python3 -m delphi.operations.database_metrics.profiling /profiles/<run>/<measurement> --top 20
+```
+
+cProfile instruments every call, so it slows the code down and runtimes measured under it are inflated; py-spy
+samples from outside the process and distorts them much less, but needs the SYS_PTRACE capability.
+"""
+import argparse
+import glob
+import json
+import os
+import pstats
+import re
+import time
+import uuid
+from collections import Counter
+from typing import List, Optional
+
+from docker import DockerClient
+
+from delphi.operations.database_metrics.actions import _run
+
+PROFILE_VOLUME = "delphi_metrics_profiles"
+PROFILERS = {"cprofile": ".pstats", "py-spy": ".txt"}
+
+
+def summarize_pstats(paths: List[str], top: int = 20) -> List[dict]:
+    """
+    Summarize cProfile output into the functions with the most time spent in themselves.
+
+    Parameters
+    ----------
+    paths: list of str
+        pstats files, which are combined, e.g. one per process of a measurement.
+    top: int, optional
+        Number of functions to return. Defaults to 20.
+
+    Returns
+    -------
+    List of dictionaries sorted by self time, each with the `function` as `file:line(name)`, number of `calls`,
+    `self_s` and `cumulative_s` in seconds, and `self_fraction` and `cumulative_fraction` of all profiled time.
+    """
+    stats = pstats.Stats(*paths)
+    total = stats.total_tt or 1
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    return [{"function": pstats.func_std_string(func), "calls": calls, "self_s": self_s, "cumulative_s": cum_s,
+             "self_fraction": self_s / total, "cumulative_fraction": cum_s / total}
+            for func, (_, calls, self_s, cum_s, _) in rows]
+
+
+def summarize_stacks(paths: List[str], top: int = 20) -> List[dict]:
+    """
+    Summarize py-spy collapsed stacks into the functions most often on top of the stack.
+
+    Parameters
+    ----------
+    paths: list of str
+        Files written by `py-spy record --format raw`, with one `frame;frame;... count` line per distinct stack.
+    top: int, optional
+        Number of functions to return. Defaults to 20.
+
+    Returns
+    -------
+    List of dictionaries sorted by self samples, each with the `function` as py-spy names it, `self_samples`, and
+    `self_fraction` and `cumulative_fraction` of all samples, where cumulative counts samples with the function
+    anywhere on the stack.
+    """
+    own, anywhere = Counter(), Counter()
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                if not stack:
+                    continue
+                frames = stack.split(";")
+                own[frames[-1]] += int(count)
+                for frame in set(frames):
+                    anywhere[frame] += int(count)
+    total = sum(own.values()) or 1
+    return [{"function": frame, "self_samples": count, "self_fraction": count / total,
+             "cumulative_fraction": anywhere[frame] / total}
+            for frame, count in own.most_common(top)]
+
+
+def summarize_directory(directory: str, top: int = 20) -> dict:
+    """
+    Summarize every profile in a measurement's directory.
+
+    Parameters
+    ----------
+    directory: str
+        Directory of profiles written by Profiler.command().
+    top: int, optional
+        Number of hot spots to return. Defaults to 20.
+
+    Returns
+    -------
+    Dictionary with the `directory`, the profile `files` in it, and `hot_spots` from summarize_pstats() or
+    summarize_stacks(), which is empty if there are no profiles.
+    """
+    output = {"directory": directory, "files": [], "hot_spots": []}
+    for summarize, extension in [(summarize_pstats, PROFILERS["cprofile"]), (summarize_stacks, PROFILERS["py-spy"])]:
+        paths = sorted(glob.glob(os.path.join(directory, f"*{extension}")))
+        # cProfile leaves an empty file if the process is killed before it exits
+        paths = [p for p in paths if os.path.getsize(p)]
+        if paths:
+            output.update(files=[os.path.basename(p) for p in paths], hot_spots=summarize(paths, top))
+            break
+    return output
+
+
+class Profiler:
+    """Wrap acquisition commands in a profiler and collect what it writes, one directory per measurement."""
+
+    def __init__(self, client: DockerClient, image: str, profiler: str = "cprofile", volume: str = PROFILE_VOLUME,
+                 run: Optional[str] = None, top: int = 20):
+        """
+        Parameters
+        ----------
+        client: DockerClient
+            DockerClient object to summarize profiles with.
+        image: str
+            Name of image containing the acquisition and database_metrics code.
+        profiler: str, optional
+            `cprofile` or `py-spy`, which must be installed in the image. Defaults to cprofile.
+        volume: str, optional
+            Docker volume to write profiles into, which is mounted at /profiles. Defaults to PROFILE_VOLUME.
+        run: str, optional
+            Directory in the volume for this run's profiles. Defaults to the current time and a random suffix, so
+            runs started in the same second, e.g. by parallel workers, don't share a directory.
+        top: int, optional
+            Number of hot spots to summarize. Defaults to 20.
+        """
+        if profiler not in PROFILERS:
+            raise ValueError(f"profiler must be one of {list(PROFILERS)}, not {profiler}")
+        self.client = client
+        self.image = image
+        self.profiler = profiler
+        self.volumes = {volume: {"bind": "/profiles", "mode": "rw"}}
+        # py-spy reads the profiled process's memory, which Docker only allows with SYS_PTRACE
+        self.options = {"cap_add": ["SYS_PTRACE"]} if profiler == "py-spy" else {}
+        self.run = run or f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.top = top
+        self.directory = None
+
+    @staticmethod
+    def new_instance(client: DockerClient, image: str, profiler: str = "cprofile", **kwargs) -> "Profiler":
+        """Create a Profiler writing to the default volume. See Profiler() for the arguments."""
+        return Profiler(client, image, profiler, **kwargs)
+
+    def start(self, name: str) -> str:
+        """
+        Send profiles of the commands built from now on to a new directory.
+
+        Parameters
+        ----------
+        name: str
+            Name of the measurement, e.g. `0-load` for loading the first dataset. Characters other than letters,
+            digits, `.`, `_`, and `-` are replaced.
+
+        Returns
+        -------
+        Path of the directory in the container.
+        """
+        self.directory = f"/profiles/{self.run}/{re.sub(r'[^A-Za-z0-9._-]', '_', name)}"
+        return self.directory
+
+    def command(self, module: str) -> str:
+        """
+        Build the shell command running `python3 -m <module>` under the profiler, to be followed by its arguments.
+
+        Each process writes a file of its own to the current directory, named with mktemp, so a command may run
+        several processes and a measurement several commands. The command needs a shell, e.g. `bash -c`.
+        """
+        if self.directory is None:
+            raise RuntimeError("call start() before building commands")
+        out = f"$(mktemp -p {self.directory} --suffix={PROFILERS[self.profiler]})"
+        if self.profiler == "py-spy":
+            profiled = f"py-spy record --format raw --output {out} -- python3 -m {module}"
+        else:
+            profiled = f"python3 -m cProfile -o {out} -m {module}"
+        return f"mkdir -p {self.directory} && {profiled}"
+
+    def collect(self, worker=None) -> dict:
+        """
+        Summarize the profiles of the current measurement, which isn't timed.
+
+        Parameters
+        ----------
+        worker: WorkerContainer, optional
+            Container to summarize in instead of a new one, which must have the profile volume mounted.
+
+        Returns
+        -------
+        Output of summarize_directory().
+        """
+        output = _run(self.client, self.image,
+                      ["python3", "-m", "delphi.operations.database_metrics.profiling", self.directory,
+                       "--top", str(self.top)],
+                      worker, volumes=self.volumes, remove=True)
+        # the summary is the last line, after anything the container logged
+        return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    """Define command line arguments."""
+    parser = argparse.ArgumentParser(description="Summarize the profiles of a measurement as JSON.")
+    parser.add_argument("directory", help="directory of .pstats or py-spy .txt files")
+    parser.add_argument("--top", type=int, default=20, help="number of hot spots (default: 20)")
+    return parser
+
+
+def main(args: argparse.Namespace) -> None:
+    """Run the command line interface."""
+    print(json.dumps(summarize_directory(args.directory, args.top)))
+
+
+if __name__ == "__main__":
+    main(get_argument_parser().parse_args())
@@ -0,0 +1,415 @@
+"""
+Render benchmark result files as a Markdown or HTML report with plots.
+
+Results are JSON files written by benchmark.write_json() from the output of measure_database() or
+measure_parallel(). Every trial and every container sample is turned into a pandas DataFrame in one pass, with
+the per-sample work done on whole numpy arrays, so results with millions of samples render quickly. The report
+has a summary table, plots of runtime per dataset, memory over time, table and database growth, ingestion rows
+per second, and query latency distributions, and, given a baseline, highlights regressions against it. Run
+from the command line with
+
+```
+python -m delphi.operations.database_metrics.report nightly.json --baseline last_release.json --out report.html
+```
+
+which exits with status 1 if there is a regression. Plots need matplotlib.
+"""
+import argparse
+import html
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from delphi.operations.database_metrics.store import flatten_results, iter_results
+
+KEYS = ["run", "dataset", "operation", "query"]
+TRIAL_COLUMNS = ["runtime", "ttfb", "peak_memory_mb", "peak_working_set_mb", "avg_cpu_cores", "size_loaded_mb",
+                 "rows_loaded", "final_table_rows", "db_size_mb"]
+SAMPLE_COLUMNS = ["memory_mb", "working_set_mb", "cpu_cores", "read_mb", "write_mb"]
+# statistics checked for regressions, and whether they regress by growing (1) or shrinking (-1)
+REGRESSION_STATS = {"runtime": 1, "ttfb": 1, "peak_working_set_mb": 1, "db_size_mb": 1, "rows_per_s": -1}
+PLOTS = ["runtime", "memory", "growth", "throughput", "latency"]
+
+
+def load_results(paths: List[str]) -> Dict[str, dict]:
+    """
+    Read result files, labelling each run by its file name without the extension.
+
+    Parameters
+    ----------
+    paths: list of str
+        JSON files written by benchmark.write_json().
+
+    Returns
+    -------
+    Dictionary of measure_database() outputs by label, in the order of `paths`. Repeated labels get a `#2`,
+    `#3`, ... suffix.
+    """
+    outputs = {}
+    for path in paths:
+        label = os.path.splitext(os.path.basename(path))[0]
+        unique, n = label, 1
+        while unique in outputs:
+            n += 1
+            unique = f"{label}#{n}"
+        with open(path) as f:
+            outputs[unique] = json.load(f)
+    return outputs
+
+
+def trials_frame(outputs: Dict[str, dict]) -> pd.DataFrame:
+    """
+    Collect every trial of every run into one table.
+
+    Parameters
+    ----------
+    outputs: dict
+        Output of load_results().
+
+    Returns
+    -------
+    DataFrame with a row per trial: `run`, `dataset`, `operation`, `query`, `trial`, `outlier`, the
+    TRIAL_COLUMNS, which are NaN where a result lacks them, and `rows_per_s`, rows loaded per second.
+    """
+    records = [(run, dataset, operation, query, trial, bool(m.get("outlier")),
+                *(m.get(c) for c in TRIAL_COLUMNS))
+               for run, output in outputs.items()
+               for dataset, operation, query, trial, m in flatten_results(output)]
+    frame = pd.DataFrame.from_records(records, columns=KEYS + ["trial", "outlier"] + TRIAL_COLUMNS)
+    frame[TRIAL_COLUMNS] = frame[TRIAL_COLUMNS].astype(float)
+    frame["rows_per_s"] = (frame["rows_loaded"] / frame["runtime"]).where(frame["operation"] == "load")
+    return frame
+
+
+def samples_frame(outputs: Dict[str, dict]) -> pd.DataFrame:
+    """
+    Collect the container samples of every measurement into one long table.
+
+    Each measurement contributes the samples of its reported trial, the median one if it was repeated. Samples
+    are concatenated as arrays and labelled with categorical codes, so the cost per sample is a few array
+    operations however many there are.
+
+    Parameters
+    ----------
+    outputs: dict
+        Output of load_results().
+
+    Returns
+    -------
+    DataFrame with a row per sample: categorical `run`, `dataset`, and `operation`, `time_s`, and the
+    SAMPLE_COLUMNS, which are NaN where a result lacks them.
+    """
+    labels, lengths = [], []
+    columns = {c: [] for c in ["time_s"] + SAMPLE_COLUMNS}
+    for run, output in outputs.items():
+        for dataset, operation, _, result in iter_results(output):
+            samples = result.get("samples") or {}
+            n = len(samples.get("time_s", []))
+            if not n:
+                continue
+            labels.append((run, dataset, operation))
+            lengths.append(n)
+            for c, arrays in columns.items():
+                arrays.append(np.asarray(samples[c], dtype=float) if c in samples else np.full(n, np.nan))
+    frame = pd.DataFrame({c: np.concatenate(arrays) if arrays else np.array([], dtype=float)
+                          for c, arrays in columns.items()})
+    index = np.repeat(np.arange(len(labels)), lengths)
+    for i, key in enumerate(KEYS[:3]):
+        codes, categories = pd.factorize(pd.Series([label[i] for label in labels], dtype=object))
+        frame.insert(i, key, pd.Categorical.from_codes(codes[index], categories))
+    return frame
+
+
+def downsample(samples: pd.DataFrame, max_points: int = 2000) -> pd.DataFrame:
+    """Keep every k-th sample of each measurement, so none has more than about `max_points` for plotting."""
+    groups = samples.groupby(KEYS[:3], observed=True, sort=False)
+    step = np.ceil(groups["time_s"].transform("size") / max_points).astype(int)
+    return samples[groups.cumcount() % step == 0]
+
+
+def summary_table(trials: pd.DataFrame) -> pd.DataFrame:
+    """
+    Summarize each run, dataset, and operation by the median over its trials, leaving outliers out.
+
+    Parameters
+    ----------
+    trials: DataFrame
+        Output of trials_frame().
+
+    Returns
+    -------
+    DataFrame indexed by run, dataset, and operation with median `runtime`, `rows_per_s`, `peak_working_set_mb`,
+    and `db_size_mb`, and the number of `trials`.
+    """
+    kept = trials[~trials["outlier"]]
+    groups = kept.groupby(KEYS[:3], sort=False)
+    table = groups[["runtime", "rows_per_s", "peak_working_set_mb", "db_size_mb"]].median()
+    table["trials"] = groups.size()
+    return table
+
+
+def compare_to_baseline(trials: pd.DataFrame, baseline: str, threshold: float = 0.05) -> pd.DataFrame:
+    """
+    Compare the median of each statistic in REGRESSION_STATS to the baseline run's, leaving outliers out.
+
+    Parameters
+    ----------
+    trials: DataFrame
+        Output of trials_frame().
+    baseline: str
+        Label of the run to compare to.
+    threshold: float, optional
+        Smallest relative change for the worse to call a regression. Defaults to 0.05.
+
+    Returns
+    -------
+    DataFrame with a row for every other run's dataset, operation, query, and statistic the baseline also has:
+    `run`, `dataset`, `operation`, `query`, `stat`, `value`, `baseline`, relative `change`, NaN if the
+    baseline is 0, and `regression`.
+    """
+    stats = list(REGRESSION_STATS)
+    medians = trials[~trials["outlier"]].groupby(KEYS, sort=False)[stats].median().reset_index()
+    long = medians.melt(id_vars=KEYS, value_vars=stats, var_name="stat", value_name="value").dropna(subset=["value"])
+    base = long[long["run"] == baseline].drop(columns="run").rename(columns={"value": "baseline"})
+    compared = long[long["run"] != baseline].merge(base, on=KEYS[1:] + ["stat"])
+    compared["change"] = ((compared["value"] - compared["baseline"]) / compared["baseline"].abs()).replace(
+        [np.inf, -np.inf], np.nan)
+    compared["regression"] = compared["change"] * compared["stat"].map(REGRESSION_STATS) > threshold
+    return compared.reset_index(drop=True)
+
+
+def _by_dataset(trials: pd.DataFrame, operation: str, column: str) -> pd.DataFrame:
+    """Median of `column` for `operation` with a row per dataset, in the order they ran, and a column per run."""
+    rows = trials[trials["operation"] == operation]
+    table = rows.pivot_table(index="dataset", columns="run", values=column, aggfunc="median")
+    return table.reindex(index=pd.unique(rows["dataset"]), columns=pd.unique(rows["run"]))
+
+
+def plot_runtime(trials: pd.DataFrame):
+    """Bar chart of median load and meta runtime per dataset, a group of bars per run."""
+    import matplotlib.pyplot as plt
+    fig, axes = plt.subplots(1, 2, figsize=(12, 4), squeeze=False)
+    for ax, operation in zip(axes[0], ["load", "meta"]):
+        _by_dataset(trials, operation, "runtime").plot.bar(ax=ax, rot=30)
+        ax.set(title=f"{operation} runtime", ylabel="seconds", xlabel="")
+    fig.tight_layout()
+    return fig
+
+
+def plot_memory(samples: pd.DataFrame, max_points: int = 2000):
+    """Working set of the database container over time during each load, a line per run and dataset."""
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(12, 4))
+    loads = downsample(samples[samples["operation"] == "load"], max_points)
+    column = "working_set_mb" if loads["working_set_mb"].notna().any() else "memory_mb"
+    for (run, dataset), group in loads.groupby(["run", "dataset"], observed=True, sort=False):
+        ax.plot(group["time_s"].to_numpy(), group[column].to_numpy(), label=f"{run} {dataset}", linewidth=1)
+    ax.set(title="database memory during loads", xlabel="seconds", ylabel=column.replace("_", " "))
+    if len(ax.lines) <= 12:
+        ax.legend(fontsize="small")
+    fig.tight_layout()
+    return fig
+
+
+def plot_growth(trials: pd.DataFrame):
+    """Covidcast rows and database size after each dataset's load, a line per run."""
+    import matplotlib.pyplot as plt
+    fig, axes = plt.subplots(1, 2, figsize=(12, 4), squeeze=False)
+    for ax, column, label in zip(axes[0], ["final_table_rows", "db_size_mb"], ["covidcast rows", "database MB"]):
+        _by_dataset(trials, "load", column).plot(ax=ax, marker="o", rot=30)
+        ax.set(title=f"{label} after load", ylabel=label, xlabel="")
+    fig.tight_layout()
+    return fig
+
+
+def plot_throughput(trials: pd.DataFrame):
+    """Bar chart of median rows loaded per second per dataset, a group of bars per run."""
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(12, 4))
+    _by_dataset(trials, "load", "rows_per_s").plot.bar(ax=ax, rot=30)
+    ax.set(title="ingestion throughput", ylabel="rows per second", xlabel="")
+    fig.tight_layout()
+    return fig
+
+
+def plot_latency(trials: pd.DataFrame):
+    """Box plots of the runtime of every trial of each query, over all datasets, a box per run."""
+    import matplotlib.pyplot as plt
+    queries = trials[trials["operation"].str.startswith("query")]
+    fig, ax = plt.subplots(figsize=(12, 4))
+    groups = list(queries.groupby(["operation", "run"], sort=False)["runtime"])
+    ax.boxplot([g.dropna().to_numpy() for _, g in groups])
+    ax.set_xticklabels([f"{op}\n{run}" for (op, run), _ in groups])
+    ax.set(title="query latency", ylabel="seconds")
+    ax.tick_params(axis="x", labelsize="small")
+    fig.tight_layout()
+    return fig
+
+
+def render_plots(trials: pd.DataFrame, samples: pd.DataFrame, directory: str) -> List[str]:
+    """
+    Save the report's plots as PNG files.
+
+    Plots without data, e.g. query latency for results without queries, are skipped.
+
+    Parameters
+    ----------
+    trials: DataFrame
+        Output of trials_frame().
+    samples: DataFrame
+        Output of samples_frame().
+    directory: str
+        Directory to save into, which is created if needed.
+
+    Returns
+    -------
+    Paths of the saved files, named after PLOTS.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    has = {"runtime": (trials["operation"].isin(["load", "meta"])).any(),
+           "memory": (samples["operation"] == "load").any(),
+           "growth": trials["final_table_rows"].notna().any(),
+           "throughput": trials["rows_per_s"].notna().any(),
+           "latency": trials["operation"].str.startswith("query").any()}
+    makers = {"runtime": lambda: plot_runtime(trials), "memory": lambda: plot_memory(samples),
+              "growth": lambda: plot_growth(trials), "throughput": lambda: plot_throughput(trials),
+              "latency": lambda: plot_latency(trials)}
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name in (p for p in PLOTS if has[p]):
+        fig = makers[name]()
+        paths.append(os.path.join(directory, f"{name}.png"))
+        fig.savefig(paths[-1], dpi=100)
+        plt.close(fig)
+    return paths
+
+
+def _cell(value) -> str:
+    if isinstance(value, (bool, np.bool_)):
+        return "yes" if value else ""
+    if isinstance(value, (float, np.floating)):
+        return "" if np.isnan(value) else f"{value:,.3f}"
+    return str(value)
+
+
+def _markdown_table(frame: pd.DataFrame, bold: Optional[pd.Series] = None) -> str:
+    columns = list(frame.columns)
+    lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    for i, row in enumerate(frame.itertuples(index=False)):
+        cells = [_cell(v) for v in row]
+        if bold is not None and bold.iloc[i]:
+            cells = [f"**{c}**" if c else c for c in cells]
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+def _html_table(frame: pd.DataFrame, bold: Optional[pd.Series] = None) -> str:
+    lines = ["<table>", "<tr>" + "".join(f"<th>{html.escape(str(c))}</th>" for c in frame.columns) + "</tr>"]
+    for i, row in enumerate(frame.itertuples(index=False)):
+        style = ' class="regression"' if bold is not None and bold.iloc[i] else ""
+        lines.append(f"<tr{style}>" + "".join(f"<td>{html.escape(_cell(v))}</td>" for v in row) + "</tr>")
+    lines.append("</table>")
+    return "\n".join(lines)
+
+
+def render_report(outputs: Dict[str, dict],
+                  path: str,
+                  baseline: Optional[str] = None,
+                  threshold: float = 0.05,
+                  plots: bool = True) -> pd.DataFrame:
+    """
+    Write a report of one or more runs.
+
+    Parameters
+    ----------
+    outputs: dict
+        Output of load_results().
+    path: str
+        File to write, as HTML if it ends in .html or .htm and otherwise as Markdown. Plots are saved next to it
+        in a directory named after it with a `_files` suffix.
+    baseline: str, optional
+        Label of the run to highlight regressions against. Defaults to None (no comparison).
+    threshold: float, optional
+        Smallest relative change for the worse to call a regression, see compare_to_baseline(). Defaults to
+        0.05.
+    plots: bool, optional
+        Whether to include plots, which need matplotlib. Defaults to True.
+
+    Returns
+    -------
+    Output of compare_to_baseline(), empty without a baseline.
+    """
+    as_html = path.endswith((".html", ".htm"))
+    table = _html_table if as_html else _markdown_table
+    trials = trials_frame(outputs)
+    sections = [("Summary", table(summary_table(trials).reset_index()))]
+
+    comparison = pd.DataFrame(columns=KEYS + ["stat", "value", "baseline", "change", "regression"])
+    if baseline is not None:
+        comparison = compare_to_baseline(trials, baseline, threshold)
+        regressions = int(comparison["regression"].sum())
+        shown = comparison.drop(columns="query").assign(change=comparison["change"].map(
+            lambda c: "" if np.isnan(c) else f"{c:+.1%}"))
+        text = f"{regressions} regression{'s' * (regressions != 1)} of more than {threshold:.0%} against {baseline}."
+        sections.append((f"Against {baseline}",
+                         (f"<p>{html.escape(text)}</p>\n" if as_html else text + "\n\n")
+                         + table(shown, comparison["regression"])))
+
+    if plots:
+        directory = os.path.splitext(path)[0] + "_files"
+        for plot in render_plots(trials, samples_frame(outputs), directory):
+            relative = os.path.relpath(plot, os.path.dirname(path) or ".")
+            name = os.path.splitext(os.path.basename(plot))[0]
+            image = f'<img src="{html.escape(relative)}" alt="{name}">' if as_html else f"![{name}]({relative})"
+            sections.append((name.capitalize(), image))
+
+    title = f"database_metrics report: {', '.join(outputs)}"
+    with open(path, "w") as f:
+        if as_html:
+            f.write(f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title>\n"
+                    "<style>table{border-collapse:collapse}td,th{border:1px solid #ccc;padding:2px 6px}"
+                    "tr.regression{background:#fdd;font-weight:bold}</style></head><body>\n"
+                    f"<h1>{html.escape(title)}</h1>\n")
+            f.write("\n".join(f"<h2>{html.escape(name)}</h2>\n{body}" for name, body in sections))
+            f.write("\n</body></html>\n")
+        else:
+            f.write(f"# {title}\n\n" + "\n\n".join(f"## {name}\n\n{body}" for name, body in sections) + "\n")
+    return comparison
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    """Define command line arguments."""
+    parser = argparse.ArgumentParser(description="Render database_metrics result files as a report.")
+    parser.add_argument("results", nargs="+", help="JSON result files written by benchmark.write_json()")
+    parser.add_argument("--baseline", help="result file to highlight regressions against")
+    parser.add_argument("--out", default="report.md", help="report to write, HTML if it ends in .html "
+                                                           "(default: %(default)s)")
+    parser.add_argument("--threshold", type=float, default=0.05,
+                        help="smallest relative change for the worse to flag (default: %(default)s)")
+    parser.add_argument("--no-plots", action="store_true", help="leave out plots, e.g. without matplotlib")
+    return parser
+
+
+def main(args: argparse.Namespace) -> int:
+    """
+    Run the command line interface.
+
+    Returns
+    -------
+    Exit status, which is 1 if there is a regression against the baseline.
+    """
+    outputs = load_results(([args.baseline] if args.baseline else []) + args.results)
+    baseline = next(iter(outputs)) if args.baseline else None
+    comparison = render_report(outputs, args.out, baseline, args.threshold, not args.no_plots)
+    print(f"wrote {args.out}")
+    return int(comparison["regression"].any())
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(get_argument_parser().parse_args()))
@@ -0,0 +1,321 @@
+"""Sample container resource usage on a background thread while an operation runs."""
+import array
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from docker.models.containers import Container
+
+
+def reduce_docker_stat(stat: dict) -> dict:
+    """
+    Reduce one entry of the Docker stats stream to the counters we sample.
+
+    Parameters
+    ----------
+    stat: dict
+        Dictionary yielded by container.stats(decode=True) or returned by container.stats(stream=False).
+
+    Returns
+    -------
+    Dictionary with memory usage and page cache in bytes, cumulative CPU time in nanoseconds, and cumulative
+    bytes read and written by block devices. The page cache is inactive file memory, which `docker stats`
+    subtracts from usage to report the working set.
+    """
+    memory = stat.get("memory_stats", {})
+    cache = memory.get("stats", {})
+    blkio = {"read": 0, "write": 0}
+    for entry in (stat.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []:
+        op = entry.get("op", "").lower()
+        if op in blkio:
+            blkio[op] += entry.get("value", 0)
+    return {"memory_usage": memory.get("usage", 0),
+            "memory_cache": cache.get("total_inactive_file", cache.get("inactive_file", 0)),
+            "cpu_usage_ns": stat.get("cpu_stats", {}).get("cpu_usage", {}).get("total_usage", 0),
+            "blkio_read_bytes": blkio["read"],
+            "blkio_write_bytes": blkio["write"]}
+
+
+def _read_keyed(path: Optional[str], key: str) -> int:
+    """Read `key value` lines from a cgroup stat file, e.g. memory.stat, and return one value (0 if missing)."""
+    if path is None:
+        return 0
+    with open(path) as f:
+        for line in f:
+            name, _, value = line.partition(" ")
+            if name == key:
+                return int(value)
+    return 0
+
+
+def _read_io(path: Optional[str], version: int) -> Dict[str, int]:
+    """Sum bytes read and written over all devices in blkio.throttle.io_service_bytes (v1) or io.stat (v2)."""
+    total = {"read": 0, "write": 0}
+    if path is None:
+        return total
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if version == 1:
+                if len(fields) == 3 and fields[1].lower() in total:
+                    total[fields[1].lower()] += int(fields[2])
+            else:
+                values = dict(field.split("=") for field in fields[1:])
+                total["read"] += int(values.get("rbytes", 0))
+                total["write"] += int(values.get("wbytes", 0))
+    return total
+
+
+class StatsStreamSource:
+    """
+    Read samples from the Docker stats stream.
+
+    The stream only updates about once per second, so each read blocks until the next update.
+    """
+
+    def __init__(self, container: Container):
+        self.stream = container.stats(decode=True)
+
+    def read(self) -> dict:
+        """Return the next sample from the stream."""
+        return reduce_docker_stat(next(self.stream))
+
+    def close(self):
+        """Stop reading the stream."""
+        self.stream.close()
+
+
+class CgroupSource:
+    """
+    Read samples directly from a container's cgroup files.
+
+    Reads are cheap and non-blocking, so this can sample much faster than the Docker stats stream.
+    It needs the host's cgroup hierarchy to be visible at `root`, e.g. by running the harness with
+    `-v /sys/fs/cgroup:/host/cgroup:ro`. Both cgroup v1 and v2 layouts are supported. Page cache and block I/O
+    are read as 0 if their files aren't there.
+    """
+
+    V2_PATHS = ["system.slice/docker-{id}.scope", "docker/{id}"]
+
+    def __init__(self, paths: dict):
+        self.paths = paths
+
+    @staticmethod
+    def find(container_id: str, root: str) -> Optional["CgroupSource"]:
+        """
+        Locate the cgroup files of a container.
+
+        Parameters
+        ----------
+        container_id: str
+            Full ID of the Docker container.
+        root: str
+            Mount point of the cgroup hierarchy.
+
+        Returns
+        -------
+        CgroupSource if the container's cgroup files were found, otherwise None.
+        """
+        if os.path.exists(os.path.join(root, "cgroup.controllers")):
+            for path in CgroupSource.V2_PATHS:
+                group = os.path.join(root, path.format(id=container_id))
+                if os.path.exists(group):
+                    return CgroupSource({"memory": os.path.join(group, "memory.current"),
+                                         "memory_stat": CgroupSource._optional(group, "memory.stat"),
+                                         "cpu": os.path.join(group, "cpu.stat"),
+                                         "io": CgroupSource._optional(group, "io.stat"),
+                                         "version": 2})
+            return None
+        memory = os.path.join(root, "memory", "docker", container_id)
+        cpu = os.path.join(root, "cpuacct", "docker", container_id, "cpuacct.usage")
+        if os.path.exists(os.path.join(memory, "memory.usage_in_bytes")) and os.path.exists(cpu):
+            return CgroupSource({"memory": os.path.join(memory, "memory.usage_in_bytes"),
+                                 "memory_stat": CgroupSource._optional(memory, "memory.stat"),
+                                 "cpu": cpu,
+                                 "io": CgroupSource._optional(os.path.join(root, "blkio", "docker", container_id),
+                                                              "blkio.throttle.io_service_bytes"),
+                                 "version": 1})
+        return None
+
+    @staticmethod
+    def _optional(directory: str, name: str) -> Optional[str]:
+        path = os.path.join(directory, name)
+        return path if os.path.exists(path) else None
+
+    def read(self) -> dict:
+        """Return the same counters as reduce_docker_stat()."""
+        version = self.paths["version"]
+        with open(self.paths["memory"]) as f:
+            memory_usage = int(f.read())
+        with open(self.paths["cpu"]) as f:
+            if version == 1:
+                cpu_usage_ns = int(f.read())
+            else:
+                cpu = dict(line.split() for line in f)
+                cpu_usage_ns = int(cpu["usage_usec"]) * 1000
+        io = _read_io(self.paths.get("io"), version)
+        return {"memory_usage": memory_usage,
+                "memory_cache": _read_keyed(self.paths.get("memory_stat"),
+                                            "total_inactive_file" if version == 1 else "inactive_file"),
+                "cpu_usage_ns": cpu_usage_ns,
+                "blkio_read_bytes": io["read"],
+                "blkio_write_bytes": io["write"]}
+
+    def close(self):
+        """Nothing to release."""
+
+
+class DatabaseSource:
+    """
+    Read database size, covidcast rows, and server status counters through a SqlProbe.
+
+    The probe is used from the sampler thread, so it needs its own connection rather than sharing one with
+    the probe measuring the operation.
+    """
+
+    STATUS = ["Innodb_buffer_pool_read_requests",
+              "Innodb_buffer_pool_reads",
+              "Innodb_buffer_pool_pages_dirty",
+              "Innodb_rows_inserted",
+              "Innodb_rows_updated",
+              "Innodb_rows_read",
+              "Innodb_data_read",
+              "Innodb_data_written",
+              "Innodb_os_log_written",
+              "Questions",
+              "Threads_running"]
+
+    def __init__(self, probe, status: Optional[List[str]] = None):
+        """
+        Parameters
+        ----------
+        probe: SqlProbe
+            Probe to read with.
+        status: list of str, optional
+            Numeric `SHOW GLOBAL STATUS` variables to record. Defaults to DatabaseSource.STATUS.
+        """
+        self.probe = probe
+        self.status = status or DatabaseSource.STATUS
+        self.errors = tuple(getattr(probe, "errors", ()))
+
+    def read(self) -> dict:
+        """Return the covidcast row count, database size in megabytes, and status counters."""
+        sample = {"rows": self.probe.covidcast_rows(), "db_size_mb": self.probe.db_size_mb()}
+        sample.update(self.probe.global_status(self.status))
+        return sample
+
+    def close(self):
+        """The probe is left open for later measurements."""
+
+
+def get_source(container: Container, cgroup_root: str = "/sys/fs/cgroup"):
+    """
+    Return the fastest available sample source for a container.
+
+    Parameters
+    ----------
+    container: Container
+        Docker Container object to sample.
+    cgroup_root: str, optional
+        Mount point of the host's cgroup hierarchy. Defaults to /sys/fs/cgroup.
+
+    Returns
+    -------
+    CgroupSource if the container's cgroup files are visible, otherwise StatsStreamSource.
+    """
+    return CgroupSource.find(container.id, cgroup_root) or StatsStreamSource(container)
+
+
+class SampleColumns:
+    """
+    Store samples as one compact array of doubles per counter instead of a list of dictionaries.
+
+    Columns are the keys of the first sample. A later sample missing a key, or with a None value, stores NaN,
+    and keys the first sample didn't have are dropped. An hour of samples every 0.1 seconds takes a few hundred
+    kilobytes per counter.
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self._length = 0
+
+    def append(self, sample: dict):
+        """Add one sample."""
+        if not self.columns:
+            self.columns = {key: array.array("d") for key in sample}
+        for key, column in self.columns.items():
+            value = sample.get(key)
+            column.append(math.nan if value is None else value)
+        self._length += 1
+
+    def __len__(self) -> int:
+        return self._length
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Return a copy of every column as a NumPy array."""
+        return {key: np.array(column) for key, column in self.columns.items()}
+
+
+class ContainerSampler:
+    """
+    Collect timestamped samples from a source on a background thread.
+
+    Each dictionary from the source's read(), plus a `time` key from time.perf_counter(), is appended to
+    SampleColumns as it is read, so memory use stays small however long the operation runs. If the source fails,
+    e.g. the container stops or the database connection drops, sampling ends early and the exception is recorded
+    as `error`, so a truncated series can be told apart from a short operation.
+    """
+
+    def __init__(self, source, interval: float = 0.1):
+        """
+        Parameters
+        ----------
+        source: CgroupSource or StatsStreamSource
+            Where to read samples from.
+        interval: float, optional
+            Seconds to wait between samples. Reads from a StatsStreamSource block for up to a second
+            on their own, so the effective interval is longer. Defaults to 0.1.
+        """
+        self.source = source
+        self.interval = interval
+        self.samples = SampleColumns()
+        self.error = None
+        # a source may add exceptions of its own, e.g. DatabaseSource those of its probe's connection
+        self._errors = (StopIteration, OSError, ValueError) + tuple(getattr(source, "errors", ()))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    sample = self.source.read()
+                except self._errors as e:
+                    self.error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+                    break
+                sample["time"] = time.perf_counter()
+                self.samples.append(sample)
+        finally:
+            # closed here since a blocking stats stream can't be closed from another thread
+            self.source.close()
+
+    def start(self):
+        """Take one sample synchronously, then keep sampling in the background."""
+        self._stop.clear()
+        sample = self.source.read()
+        sample["time"] = time.perf_counter()
+        self.samples.append(sample)
+        self._thread.start()
+
+    def stop(self) -> Dict[str, np.ndarray]:
+        """
+        Stop sampling and return all samples collected, as an array per counter plus `time`.
+
+        With a StatsStreamSource this waits for the pending read, which can take up to a second.
+        """
+        self._stop.set()
+        self._thread.join()
+        return self.samples.to_arrays()
@@ -0,0 +1,180 @@
+"""Measure how ingestion, metadata updates, and queries slow down as the covidcast table grows."""
+from typing import List, Optional
+
+import numpy as np
+from docker import DockerClient
+
+from delphi.operations.database_metrics.monitor import measure_database
+
+PRODUCTION_ROWS = [1e8, 5e8, 1e9]
+
+
+def fit_power_law(x: list, y: list) -> dict:
+    """
+    Fit y = coefficient * x ** exponent by least squares on a log-log scale.
+
+    Parameters
+    ----------
+    x: list of floats
+        Independent variable, e.g. table rows. Points where x or y isn't positive are ignored.
+    y: list of floats
+        Dependent variable, e.g. runtime.
+
+    Returns
+    -------
+    Dictionary with `coefficient`, `exponent`, `r2` on the log scale, and `points` used, or None for all three
+    if fewer than two usable points with distinct x remain.
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    keep = (x > 0) & (y > 0)
+    x, y = np.log(x[keep]), np.log(y[keep])
+    if len(np.unique(x)) < 2:
+        return {"coefficient": None, "exponent": None, "r2": None, "points": int(keep.sum())}
+    exponent, intercept = np.polyfit(x, y, 1)
+    residual = y - (intercept + exponent * x)
+    total = ((y - y.mean()) ** 2).sum()
+    r2 = 1 - (residual ** 2).sum() / total if total else 1.0
+    return {"coefficient": float(np.exp(intercept)), "exponent": float(exponent), "r2": float(r2),
+            "points": int(keep.sum())}
+
+
+def predict(fit: dict, x: float) -> Optional[float]:
+    """Evaluate a fit from fit_power_law() at `x`, or return None if the fit failed."""
+    if fit["exponent"] is None:
+        return None
+    return fit["coefficient"] * x ** fit["exponent"]
+
+
+def fit_scaling(output: dict,
+                production_rows: List[float] = None,
+                batch_rows: Optional[int] = None,
+                window_s: Optional[float] = None) -> dict:
+    """
+    Fit each operation's cost against the covidcast table size it ran at, and extrapolate.
+
+    Load time is fitted per row loaded, since datasets differ in size, so its exponent describes how ingestion
+    throughput falls as the table grows. Metadata updates and queries are fitted on runtime. An exponent near 0
+    means the cost doesn't depend on table size, 1 means it grows linearly, and above 1 faster than the table.
+
+    Parameters
+    ----------
+    output: dict
+        Output of measure_database() with `append_datasets`, so each dataset ran on a larger table.
+    production_rows: list of floats, optional
+        Table sizes to extrapolate to. Defaults to PRODUCTION_ROWS.
+    batch_rows: int, optional
+        Rows in a typical ingestion batch, for predicting how long one takes. Defaults to the median rows loaded
+        per dataset.
+    window_s: float, optional
+        Seconds available for ingesting one batch. If given, predictions note whether a batch still fits.
+
+    Returns
+    -------
+    Dictionary with a key for `load`, `meta`, and each query. Each value holds the fit from fit_power_law(),
+    the measured `rows` and `values`, and `predictions` at each production size. Load predictions hold rows per
+    second, seconds for `batch_rows`, and whether that fits `window_s`. Other predictions hold runtime.
+    """
+    production_rows = production_rows or PRODUCTION_ROWS
+    loads = output["load"]
+    if batch_rows is None:
+        batch_rows = int(np.median([r["rows_loaded"] for r in loads]))
+    report = {}
+
+    rows = [r["final_table_rows"] for r in loads]
+    per_row = [r["runtime"] / r["rows_loaded"] if r["rows_loaded"] else 0 for r in loads]
+    fit = fit_power_law(rows, per_row)
+    predictions = []
+    for size in production_rows:
+        seconds_per_row = predict(fit, size)
+        prediction = {"rows": size, "rows_per_s": None, "batch_s": None, "fits_window": None}
+        if seconds_per_row:
+            prediction.update({"rows_per_s": 1 / seconds_per_row, "batch_s": seconds_per_row * batch_rows})
+            if window_s is not None:
+                prediction["fits_window"] = prediction["batch_s"] <= window_s
+        predictions.append(prediction)
+    report["load"] = dict(fit, rows=rows, values=per_row, batch_rows=batch_rows, predictions=predictions)
+
+    operations = ["meta"] + sorted((k for k in output if k.startswith("query") and k != "queries"),
+                                   key=lambda k: (int(k[5:].split("_")[0]), k))
+    for operation in operations:
+        # a query whose runs all failed has no runtime to fit
+        results = [r for r in output[operation] if "runtime" in r]
+        rows = [r["final_table_rows"] for r in results]
+        runtimes = [r["runtime"] for r in results]
+        fit = fit_power_law(rows, runtimes)
+        report[operation] = dict(fit, rows=rows, values=runtimes,
+                                 predictions=[{"rows": size, "runtime": predict(fit, size)}
+                                              for size in production_rows])
+    return report
+
+
+def format_scaling(report: dict) -> str:
+    """
+    Format the output of fit_scaling() as text.
+
+    Parameters
+    ----------
+    report: dict
+        Output of fit_scaling().
+
+    Returns
+    -------
+    Multi-line string with each operation's scaling exponent, fit quality, and predictions.
+    """
+    def number(value, spec):
+        return "n/a" if value is None else format(value, spec)
+
+    lines = []
+    for operation, fit in report.items():
+        measured = "per row loaded" if operation == "load" else "runtime"
+        lines.append(f"{operation}: {measured} ~ rows^{number(fit['exponent'], '.2f')} "
+                     f"(r2 {number(fit['r2'], '.3f')}, {fit['points']} points, "
+                     f"{number(min(fit['rows'], default=None), ',')}-{number(max(fit['rows'], default=None), ',')} rows)")
+        for p in fit["predictions"]:
+            if operation == "load":
+                fits = {True: "fits window", False: "EXCEEDS WINDOW", None: ""}[p["fits_window"]]
+                lines.append(f"  at {p['rows']:,.0f} rows: {number(p['rows_per_s'], ',.0f')} rows/s, "
+                             f"{number(p['batch_s'], ',.1f')}s per {fit['batch_rows']:,} row batch {fits}".rstrip())
+            else:
+                lines.append(f"  at {p['rows']:,.0f} rows: {number(p['runtime'], ',.2f')}s")
+    return "\n".join(lines)
+
+
+def measure_scaling(source: str,
+                    file_patterns: List[str],
+                    client: DockerClient,
+                    queries: list = None,
+                    production_rows: List[float] = None,
+                    batch_rows: Optional[int] = None,
+                    window_s: Optional[float] = None,
+                    **kwargs) -> dict:
+    """
+    Load datasets one after another onto a growing table and fit how each operation scales.
+
+    Parameters
+    ----------
+    source: str
+        Data source of every dataset.
+    file_patterns: list of str
+        File patterns of the datasets to append, in order, e.g. one per month.
+    client: DockerClient
+        DockerClient object to access and execute python images.
+    queries: list of dictionaries, optional
+        Queries to time after each dataset is loaded.
+    production_rows: list of floats, optional
+        Table sizes to extrapolate to. Defaults to PRODUCTION_ROWS.
+    batch_rows: int, optional
+        Rows in a typical ingestion batch. Defaults to the median rows loaded per dataset.
+    window_s: float, optional
+        Seconds available for ingesting one batch.
+    kwargs:
+        Other arguments of measure_database(), except `append_datasets`.
+
+    Returns
+    -------
+    Output of measure_database() with the output of fit_scaling() under `scaling`.
+    """
+    datasets = [(source, pattern) for pattern in file_patterns]
+    output = measure_database(datasets, client, queries=queries, append_datasets=True, **kwargs)
+    output["scaling"] = fit_scaling(output, production_rows, batch_rows, window_s)
+    return output
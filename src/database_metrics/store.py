@@ -0,0 +1,427 @@
+"""
+Save the output of measure_database() to a local SQLite store and compare runs for regressions.
+
+Each run is keyed by the git SHA of the code being measured and a fingerprint of the host, and each of its
+measurements by dataset, operation, and query. Compare two runs from the command line with
+`python -m delphi.operations.database_metrics.store compare <baseline> <candidate> --db results.sqlite`.
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+from typing import List, Optional
+
+import numpy as np
+
+from delphi.operations.database_metrics.actions import dataset_label
+
+COMPARE_STATS = ["runtime", "peak_memory_mb", "size_loaded_mb"]
+RESULTS_DB = "database_metrics.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created TEXT NOT NULL,
+    git_sha TEXT NOT NULL,
+    host TEXT NOT NULL,
+    host_info TEXT NOT NULL,
+    settings TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    dataset TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    query TEXT NOT NULL,
+    trial INTEGER NOT NULL,
+    runtime REAL,
+    peak_memory_mb REAL,
+    size_loaded_mb REAL,
+    rows_loaded INTEGER,
+    final_table_rows INTEGER,
+    db_size_mb REAL,
+    outlier INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (run_id, dataset, operation, query, trial)
+);
+CREATE TABLE IF NOT EXISTS plans (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    dataset TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    query TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    rows_examined INTEGER,
+    plan TEXT NOT NULL,
+    PRIMARY KEY (run_id, dataset, operation, query)
+);
+"""
+
+
+def get_git_sha(path: str = ".") -> str:
+    """
+    Return the commit checked out at `path`, or `unknown` if it isn't a git repository.
+
+    Parameters
+    ----------
+    path: str, optional
+        Directory inside the repository whose code is being measured. Defaults to the working directory.
+
+    Returns
+    -------
+    Full SHA of HEAD.
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=path,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def get_host_info() -> dict:
+    """
+    Describe the hardware and OS of this host.
+
+    Returns
+    -------
+    Dictionary with the hostname, machine type, processor, CPU count, total memory in bytes (if known), and
+    OS release, plus `fingerprint`, a short hash of all of these.
+    """
+    try:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        memory = None
+    info = {"node": platform.node(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "memory": memory,
+            "release": platform.release()}
+    info["fingerprint"] = hashlib.sha256(json.dumps(info, sort_keys=True).encode()).hexdigest()[:12]
+    return info
+
+
+def connect(path: str = RESULTS_DB) -> sqlite3.Connection:
+    """
+    Open the result store at `path`, creating it if needed.
+
+    Parameters
+    ----------
+    path: str, optional
+        SQLite database file. Defaults to database_metrics.sqlite.
+
+    Returns
+    -------
+    sqlite3 Connection with rows returned as sqlite3.Row.
+    """
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def iter_results(output: dict) -> List[tuple]:
+    """
+    List every result in measure_database() output.
+
+    Parameters
+    ----------
+    output: dict
+        Output of measure_database().
+
+    Returns
+    -------
+    List of (dataset label, operation, query as JSON or "", result) tuples, by dataset in the order measured.
+    """
+    results = []
+    queries = output.get("queries") or []
+    for k, dataset in enumerate(output["datasets"]):
+        operations = [("load", ""), ("meta", "")]
+        suffixes = [f"_{mode}" for mode in output["cache_modes"]] if "cache_modes" in output else [""]
+        operations += [(f"query{i}{suffix}", json.dumps(q, sort_keys=True))
+                       for i, q in enumerate(queries) for suffix in suffixes]
+        operations += [("load_test", "")] if "load_test" in output else []
+        for operation, query in operations:
+            results.append((dataset_label(dataset), operation, query, output[operation][k]))
+    return results
+
+
+def flatten_results(output: dict) -> List[tuple]:
+    """
+    List every measured run in measure_database() output, expanding repeated measurements into their trials.
+
+    Parameters
+    ----------
+    output: dict
+        Output of measure_database().
+
+    Returns
+    -------
+    List of (dataset label, operation, query, trial index, metrics) tuples, as for iter_results().
+    """
+    return [(dataset, operation, query, trial, metrics)
+            for dataset, operation, query, result in iter_results(output)
+            for trial, metrics in enumerate(result.get("trials", [result]))]
+
+
+def save_run(connection: sqlite3.Connection,
+             output: dict,
+             git_sha: Optional[str] = None,
+             host_info: Optional[dict] = None) -> int:
+    """
+    Save the output of measure_database() as a new run.
+
+    Every trial of a repeated measurement is saved, so later comparisons can test for significance, along with
+    any query plans.
+
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+        Store opened with connect().
+    output: dict
+        Output of measure_database().
+    git_sha: str, optional
+        Commit of the acquisition code that was measured. Defaults to get_git_sha() of the working directory.
+    host_info: dict, optional
+        Description of the host. Defaults to get_host_info().
+
+    Returns
+    -------
+    ID of the new run.
+    """
+    git_sha = git_sha or get_git_sha()
+    host_info = host_info or get_host_info()
+    settings = {k: output.get(k) for k in ["datasets", "queries", "append_datasets", "cache_modes"]}
+    with connection:
+        cursor = connection.execute(
+            "INSERT INTO runs (created, git_sha, host, host_info, settings) VALUES (?, ?, ?, ?, ?)",
+            (datetime.datetime.now().isoformat(timespec="seconds"), git_sha, host_info["fingerprint"],
+             json.dumps(host_info), json.dumps(settings)))
+        run_id = cursor.lastrowid
+        connection.executemany(
+            "INSERT INTO measurements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(run_id, dataset, operation, query, trial,
+              m.get("runtime"), m.get("peak_memory_mb"), m.get("size_loaded_mb"), m.get("rows_loaded"),
+              m.get("final_table_rows"), m.get("db_size_mb"), int(bool(m.get("outlier"))))
+             for dataset, operation, query, trial, m in flatten_results(output)])
+        connection.executemany(
+            "INSERT INTO plans VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(run_id, dataset, operation, query, r["plan"]["fingerprint"], r["plan"]["rows_examined"],
+              json.dumps(r["plan"]))
+             for dataset, operation, query, r in iter_results(output) if "plan" in r])
+    return run_id
+
+
+def list_runs(connection: sqlite3.Connection) -> List[dict]:
+    """
+    List the saved runs, oldest first.
+
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+        Store opened with connect().
+
+    Returns
+    -------
+    List of dicts with the run ID, creation time, git SHA, host fingerprint, and number of measurements.
+    """
+    return [dict(r) for r in connection.execute(
+        "SELECT r.run_id, r.created, r.git_sha, r.host, count(m.run_id) measurements "
+        "FROM runs r LEFT JOIN measurements m USING (run_id) GROUP BY r.run_id ORDER BY r.run_id")]
+
+
+def resolve_run(connection: sqlite3.Connection, run: str) -> int:
+    """
+    Find a run by ID, by `latest`, or by the latest run of a git SHA prefix.
+
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+        Store opened with connect().
+    run: str
+        Run ID, `latest`, or a git SHA or prefix of one.
+
+    Returns
+    -------
+    Run ID.
+    """
+    if run.isdigit():
+        row = connection.execute("SELECT run_id FROM runs WHERE run_id = ?", (int(run),)).fetchone()
+    elif run == "latest":
+        row = connection.execute("SELECT max(run_id) run_id FROM runs").fetchone()
+    else:
+        row = connection.execute("SELECT max(run_id) run_id FROM runs WHERE git_sha LIKE ?",
+                                 (run + "%",)).fetchone()
+    if row is None or row["run_id"] is None:
+        raise ValueError(f"no run matches {run}")
+    return row["run_id"]
+
+
+def bootstrap_difference_ci(baseline: list,
+                            candidate: list,
+                            confidence: float = 0.95,
+                            resamples: int = 1000,
+                            seed: int = 0) -> tuple:
+    """
+    Estimate a confidence interval for median(candidate) - median(baseline) with the percentile bootstrap.
+
+    Parameters
+    ----------
+    baseline: list of floats
+        Trials of the baseline run.
+    candidate: list of floats
+        Trials of the candidate run.
+    confidence: float, optional
+        Coverage of the interval. Defaults to 0.95.
+    resamples: int, optional
+        Number of bootstrap resamples. Defaults to 1000.
+    seed: int, optional
+        Seed for the resampling. Defaults to 0.
+
+    Returns
+    -------
+    2-Tuple of the lower and upper bounds of the interval.
+    """
+    rng = np.random.default_rng(seed)
+    baseline, candidate = np.asarray(baseline, dtype=float), np.asarray(candidate, dtype=float)
+    a = np.median(rng.choice(baseline, size=(resamples, len(baseline))), axis=1)
+    b = np.median(rng.choice(candidate, size=(resamples, len(candidate))), axis=1)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(b - a, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+
+def compare_runs(connection: sqlite3.Connection,
+                 baseline: int,
+                 candidate: int,
+                 threshold: float = 0.05,
+                 confidence: float = 0.95) -> List[dict]:
+    """
+    Compare the measurements two runs have in common.
+
+    A statistic regressed if it grew by more than `threshold` of its baseline median and the bootstrap
+    confidence interval of the change in medians lies entirely above zero. This needs at least two trials
+    in each run, so record both runs with `repetitions` > 1; otherwise `significant` is always False.
+    Outlying trials are left out.
+
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+        Store opened with connect().
+    baseline: int
+        Run ID to compare against.
+    candidate: int
+        Run ID to check for regressions.
+    threshold: float, optional
+        Smallest relative increase worth reporting. Defaults to 0.05.
+    confidence: float, optional
+        Coverage of the bootstrap confidence intervals. Defaults to 0.95.
+
+    Returns
+    -------
+    List of dicts, one for each dataset, operation, query, and statistic in COMPARE_STATS, with baseline
+    and candidate medians, relative change, confidence interval of the change, `significant` and
+    `regression` flags, and `plan_changed`, whether the query plan differs (None if either run has no plan).
+    """
+    def trials(run_id: int) -> dict:
+        groups = {}
+        for row in connection.execute(
+                "SELECT * FROM measurements WHERE run_id = ? AND outlier = 0 ORDER BY trial", (run_id,)):
+            groups.setdefault((row["dataset"], row["operation"], row["query"]), []).append(row)
+        return groups
+
+    def plans(run_id: int) -> dict:
+        return {(row["dataset"], row["operation"], row["query"]): row["fingerprint"]
+                for row in connection.execute("SELECT * FROM plans WHERE run_id = ?", (run_id,))}
+
+    before, after = trials(baseline), trials(candidate)
+    plans_before, plans_after = plans(baseline), plans(candidate)
+    comparison = []
+    for key in [k for k in before if k in after]:
+        for stat in COMPARE_STATS:
+            a = [r[stat] for r in before[key] if r[stat] is not None]
+            b = [r[stat] for r in after[key] if r[stat] is not None]
+            if not a or not b:
+                continue
+            median_a, median_b = float(np.median(a)), float(np.median(b))
+            change = (median_b - median_a) / abs(median_a) if median_a else None
+            if len(a) > 1 and len(b) > 1:
+                ci_low, ci_high = bootstrap_difference_ci(a, b, confidence)
+            else:
+                ci_low, ci_high = None, None
+            significant = ci_low is not None and (ci_low > 0 or ci_high < 0)
+            plan_changed = None
+            if key in plans_before and key in plans_after:
+                plan_changed = plans_before[key] != plans_after[key]
+            comparison.append({"dataset": key[0], "operation": key[1], "query": key[2], "stat": stat,
+                               "baseline": median_a, "candidate": median_b, "change": change,
+                               "ci_low": ci_low, "ci_high": ci_high, "significant": significant,
+                               "regression": significant and ci_low > 0 and change is not None
+                               and change > threshold,
+                               "plan_changed": plan_changed})
+    return comparison
+
+
+def format_comparison(comparison: List[dict]) -> str:
+    """
+    Format the output of compare_runs() as a table, with regressions and plan changes marked.
+
+    Parameters
+    ----------
+    comparison: list of dicts
+        Output of compare_runs().
+
+    Returns
+    -------
+    Multi-line string.
+    """
+    lines = [f"   {'dataset':<30} {'operation':<10} {'stat':<15} {'baseline':>12} {'candidate':>12} {'change':>8}"]
+    for c in comparison:
+        mark = "!!" if c["regression"] else ("* " if c["significant"] else "  ")
+        change = f"{c['change']:+.1%}" if c["change"] is not None else "n/a"
+        lines.append(f"{mark} {c['dataset']:<30} {c['operation']:<10} {c['stat']:<15} "
+                     f"{c['baseline']:>12.3f} {c['candidate']:>12.3f} {change:>8}"
+                     f"{'  plan changed' if c.get('plan_changed') else ''}")
+    return "\n".join(lines)
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    """Define command line arguments."""
+    parser = argparse.ArgumentParser(description="Inspect and compare saved database_metrics runs.")
+    parser.add_argument("--db", default=RESULTS_DB, help="result store (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list saved runs")
+    compare = commands.add_parser("compare", help="compare a candidate run against a baseline")
+    compare.add_argument("baseline", help="run ID, git SHA prefix, or `latest`")
+    compare.add_argument("candidate", nargs="?", default="latest", help="defaults to `latest`")
+    compare.add_argument("--threshold", type=float, default=0.05,
+                         help="smallest relative increase to flag (default: %(default)s)")
+    compare.add_argument("--all", action="store_true", help="show unchanged statistics too")
+    return parser
+
+
+def main(args: argparse.Namespace) -> int:
+    """
+    Run the command line interface.
+
+    Returns
+    -------
+    Exit status, which is 1 if `compare` found a regression, so it can gate changes in CI.
+    """
+    connection = connect(args.db)
+    if args.command == "list":
+        for run in list_runs(connection):
+            print(f"{run['run_id']:>5} {run['created']} {run['git_sha'][:12]} {run['host']} "
+                  f"{run['measurements']} measurements")
+        return 0
+    baseline = resolve_run(connection, args.baseline)
+    candidate = resolve_run(connection, args.candidate)
+    comparison = compare_runs(connection, baseline, candidate, args.threshold)
+    print(f"baseline run {baseline}, candidate run {candidate} (!! regression, * significant change)")
+    print(format_comparison([c for c in comparison if args.all or c["significant"] or c["plan_changed"]]))
+    return int(any(c["regression"] for c in comparison))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(get_argument_parser().parse_args()))
@@ -0,0 +1,282 @@
+"""
+Sweep MariaDB server variables to find the configuration that ingests and answers queries fastest.
+
+The database image runs MariaDB's stock settings, which are very different from production's. A sweep takes a
+grid of server variables, starts a fresh database container with every combination, runs the same workload
+against each with measure_database(), and ranks the configurations by ingestion throughput and query p95s. For
+example
+
+```
+grid = {"innodb_buffer_pool_size": ["128M", "1G", "4G"],
+        "innodb_flush_log_at_trx_commit": [1, 2],
+        "innodb_log_file_size": ["48M", "512M"],
+        "bulk_insert_buffer_size": ["8M", "64M"]}
+output = measure_sweep(grid, datasets, docker.from_env(), queries=queries, mem_limit="8g")
+print(format_sweep(output["ranking"]))
+```
+"""
+import itertools
+import socket
+from typing import Dict, List, Optional
+
+import numpy as np
+from docker import DockerClient
+from docker.models.containers import Container
+
+from delphi.operations.database_metrics.db_actions import _run_sql
+from delphi.operations.database_metrics.parallel import Worker, get_cpusets
+from delphi.operations.database_metrics.parsers import parse_batch
+from delphi.operations.database_metrics.store import flatten_results
+
+
+def expand_grid(grid: Dict[str, list]) -> List[dict]:
+    """
+    List every combination of server variable values.
+
+    Parameters
+    ----------
+    grid: dict
+        Values to try for each server variable, e.g. {"innodb_flush_log_at_trx_commit": [1, 2]}. A single value
+        needn't be in a list.
+
+    Returns
+    -------
+    List of dictionaries of one value per variable, varying the last variable fastest.
+    """
+    names = list(grid)
+    values = [v if isinstance(v, list) else [v] for v in grid.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def config_name(config: dict) -> str:
+    """Name a configuration by its variables, e.g. `innodb_buffer_pool_size=1G,sync_binlog=0`, or `default`."""
+    return ",".join(f"{k}={v}" for k, v in config.items()) or "default"
+
+
+def server_options(config: dict) -> List[str]:
+    """Turn a configuration into mysqld options, which the MariaDB image passes on when given as its command."""
+    return [f"--{name}={value}" for name, value in config.items()]
+
+
+def get_variables(container: Container, names: List[str]) -> dict:
+    """
+    Read the values the server is actually running with, which MariaDB may have rounded or clamped.
+
+    Parameters
+    ----------
+    container: Container
+        Docker Container object where the MariaDB database is running.
+    names: list of str
+        Server variables to read.
+
+    Returns
+    -------
+    Dictionary of each variable's value as MariaDB reports it.
+
+    Raises
+    ------
+    db_actions.ExecError if the variables couldn't be read.
+    """
+    if not names:
+        return {}
+    quoted = ", ".join(f"'{name}'" for name in names)
+    rows = parse_batch(_run_sql(container, f"SHOW GLOBAL VARIABLES WHERE Variable_name IN ({quoted})"))
+    return {name: value for name, value in rows}
+
+
+def summarize_config(output: dict) -> dict:
+    """
+    Summarize one configuration's workload into the statistics it is ranked by.
+
+    Parameters
+    ----------
+    output: dict
+        Output of measure_database() for the configuration.
+
+    Returns
+    -------
+    Dictionary with `rows_per_s`, rows loaded per second over every load trial, `query_p95_s`, the p95 runtime of
+    each query over its trials, by dataset and operation, e.g. `usa-facts:2020* query0_cold`, or None without
+    queries, and the total `db_size_mb` after the last dataset.
+    """
+    loads = []
+    runtimes = {}
+    for dataset, operation, _, _, m in flatten_results(output):
+        if operation == "load":
+            loads.append(m)
+        elif operation.startswith("query") and "runtime" in m:
+            # queries differ by orders of magnitude, so each gets a p95 of its own rather than sharing one
+            runtimes.setdefault(f"{dataset} {operation}", []).append(m["runtime"])
+    load_s = sum(m["runtime"] for m in loads)
+    return {"rows_per_s": sum(m["rows_loaded"] for m in loads) / load_s if load_s else None,
+            "query_p95_s": {k: float(np.percentile(v, 95)) for k, v in runtimes.items()} or None,
+            "db_size_mb": output["meta"][-1]["db_size_mb"] if output["meta"] else None}
+
+
+def query_ratios(summaries: Dict[str, dict]) -> Dict[str, Optional[float]]:
+    """
+    Combine each configuration's query p95s into one number, relative to the best configuration for each query.
+
+    Each p95 is divided by the lowest p95 of that query in any configuration, and the ratios are combined by their
+    geometric mean, so every query counts the same however long it takes, and a configuration which is fastest for
+    every query scores 1. Only queries every configuration with queries has are compared.
+
+    Parameters
+    ----------
+    summaries: dict
+        Output of summarize_config() by configuration name.
+
+    Returns
+    -------
+    Geometric mean ratio by configuration name, or None for a configuration without queries.
+    """
+    p95s = {name: s["query_p95_s"] for name, s in summaries.items() if s["query_p95_s"]}
+    shared = set.intersection(*(set(p) for p in p95s.values())) if p95s else set()
+    best = {key: min(p[key] for p in p95s.values()) for key in shared}
+    ratios = {name: None for name in summaries}
+    if shared:
+        for name, p95 in p95s.items():
+            ratios[name] = float(np.exp(np.mean([np.log(p95[key] / best[key]) for key in sorted(shared)])))
+    return ratios
+
+
+def rank_configs(summaries: Dict[str, dict]) -> List[dict]:
+    """
+    Rank configurations by ingestion throughput and query p95s.
+
+    Each configuration is ranked on throughput and on its query_ratios(), with 1 the best, and ordered by the mean
+    of its two ranks, ties broken by throughput. A configuration missing a statistic, e.g. with no queries, ranks
+    last on it.
+
+    Parameters
+    ----------
+    summaries: dict
+        Output of summarize_config() by configuration name.
+
+    Returns
+    -------
+    List of the summaries, each with its `config` name, `query_p95_ratio` from query_ratios(), `throughput_rank`,
+    `p95_rank`, and `rank`, best first.
+    """
+    names = list(summaries)
+    p95_ratios = query_ratios(summaries)
+
+    def ranks(values, best_high):
+        def order(name):
+            value = values[name]
+            if value is None:
+                return 1, 0
+            return 0, -value if best_high else value
+        return {name: i + 1 for i, name in enumerate(sorted(names, key=order))}
+
+    throughput = ranks({name: s["rows_per_s"] for name, s in summaries.items()}, True)
+    p95 = ranks(p95_ratios, False)
+    ranking = sorted(names, key=lambda n: ((throughput[n] + p95[n]) / 2, throughput[n]))
+    return [dict(summaries[name], config=name, query_p95_ratio=p95_ratios[name], throughput_rank=throughput[name],
+                 p95_rank=p95[name], rank=i + 1)
+            for i, name in enumerate(ranking)]
+
+
+def format_sweep(ranking: List[dict]) -> str:
+    """
+    Format the output of rank_configs() as a table, best configuration first.
+
+    Parameters
+    ----------
+    ranking: list of dicts
+        Output of rank_configs().
+
+    Returns
+    -------
+    Multi-line string with each configuration's rank, throughput, query p95s relative to the best, and size.
+    """
+    def number(value, spec, suffix=""):
+        return "n/a" if value is None else format(value, spec) + suffix
+
+    lines = [f"{'rank':>4} {'rows/s':>12} {'p95 vs best':>12} {'size MB':>10}  config"]
+    for r in ranking:
+        lines.append(f"{r['rank']:>4} {number(r['rows_per_s'], ',.0f'):>12} "
+                     f"{number(r['query_p95_ratio'], '.2f', 'x'):>12} {number(r['db_size_mb'], ',.1f'):>10}  "
+                     f"{r['config']}")
+    return "\n".join(lines)
+
+
+def measure_sweep(grid: Dict[str, list],
+                  datasets: list,
+                  client: DockerClient,
+                  python_image_name: str = "delphi_python",
+                  queries: list = None,
+                  db_image: str = "delphi_database_epidata",
+                  web_image: str = "delphi_web_epidata",
+                  cpus: Optional[int] = None,
+                  mem_limit: str = None,
+                  prefix: str = "delphi_metrics_sweep",
+                  harness: str = None,
+                  **kwargs) -> dict:
+    """
+    Run the same workload against a database started with each combination of server variables.
+
+    Configurations run one after another on the same CPUs, each in a fresh database container on a private
+    network, with a web server if there are queries, as in parallel.measure_parallel(). A configuration MariaDB
+    won't start with, e.g. an unknown variable, is recorded with its `error` and left out of the ranking, so one
+    typo doesn't end a long sweep.
+
+    Parameters
+    ----------
+    grid: dict
+        Values to try for each server variable, see expand_grid().
+    datasets: list of tuples or dicts
+        Datasets to measure with every configuration, as for measure_database().
+    client: DockerClient
+        DockerClient object to start containers with.
+    python_image_name: str, optional
+        Name of Docker image containing the data loading and metadata updating code.
+    queries: list of dictionaries, optional
+        List of query parameters to test query runtimes on. Defaults to empty list.
+    db_image: str, optional
+        Image of the epidata database. Defaults to delphi_database_epidata.
+    web_image: str, optional
+        Image of the Epidata API web server, only started if there are queries. Defaults to delphi_web_epidata.
+    cpus: int, optional
+        Number of CPUs to pin the containers to, starting from the first. Defaults to all of the Docker host's.
+    mem_limit: str, optional
+        Memory limit of each database container, and of each python container, e.g. "8g", which should leave room
+        for the largest buffer pool. Defaults to None (unlimited).
+    prefix: str, optional
+        Prefix for the names of the networks and containers created. Defaults to delphi_metrics_sweep.
+    harness: str, optional
+        Name or ID of the container running this code, which joins each network to send queries. See
+        parallel.measure_parallel().
+    kwargs:
+        Other arguments of measure_database(), except `probe` and `status_probe`.
+
+    Returns
+    -------
+    Dictionary with `configs`, for each configuration by name its `config`, the `variables` the server ran with
+    from get_variables(), the output of summarize_config() under `summary`, and the output of measure_database()
+    under `output`, or the `error` if it failed; and the output of rank_configs() under `ranking`.
+    """
+    if "probe" in kwargs or "status_probe" in kwargs:
+        raise ValueError("probes connect to a single database and can't follow the sweep's databases")
+    total_cpus = client.info()["NCPU"]
+    cpuset = get_cpusets(total_cpus, 1, cpus or total_cpus)[0]
+    web_image = web_image if queries else None
+    harness = (harness or socket.gethostname()) if web_image is not None else None
+
+    configs = {}
+    for i, config in enumerate(expand_grid(grid)):
+        result = configs[config_name(config)] = {"config": config}
+        try:
+            worker = Worker.new_instance(client, f"{prefix}_{i}", db_image, web_image, cpuset, mem_limit, harness,
+                                         server_options(config))
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+            continue
+        try:
+            result["variables"] = get_variables(worker.db, list(config))
+            result["output"] = worker.measure(datasets, python_image_name, queries, **kwargs)
+        finally:
+            worker.remove(harness)
+        result["summary"] = summarize_config(result["output"])
+    summaries = {name: r["summary"] for name, r in configs.items() if "summary" in r}
+    return {"configs": configs, "ranking": rank_configs(summaries)}
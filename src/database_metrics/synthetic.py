@@ -0,0 +1,235 @@
+"""
+Generate synthetic covidcast CSVs in the receiving format, for reproducible benchmarks of any size.
+
+Files are written under `out` in the receiving format, one directory per issue, which csv_to_database loads with
+`--specific_issue_date`: `issue_<end_date>/<source>/<YYYYMMDD>_<geo_type>_<signal>.csv` holds the first issue
+of every day, and the Nth revision is issued N days later. Files in `receiving/` would be stamped with the day
+they are loaded instead, which is after the dates of the revisions.
+
+Numbers are written fixed-width with leading zeros, e.g. `000091.7155`, so whole files can be formatted as
+NumPy byte arrays instead of value by value; this writes several million rows per second per process.
+
+Generate from the command line with
+`python -m delphi.operations.database_metrics.synthetic --spec '{"geo_types": {"county": 3000}}' --out <dir>`.
+"""
+import argparse
+import datetime
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import numpy as np
+
+STATES = ["ak", "al", "ar", "az", "ca", "co", "ct", "dc", "de", "fl", "ga", "hi", "ia", "id", "il", "in", "ks",
+          "ky", "la", "ma", "md", "me", "mi", "mn", "mo", "ms", "mt", "nc", "nd", "ne", "nh", "nj", "nm", "nv",
+          "ny", "oh", "ok", "or", "pa", "pr", "ri", "sc", "sd", "tn", "tx", "ut", "va", "vt", "wa", "wi", "wv", "wy"]
+
+# first code and number of codes available for each geo type
+GEO_RANGES = {"county": (1001, 98999),
+              "msa": (10000, 89999),
+              "hrr": (1, 999),
+              "dma": (500, 500),
+              "hhs": (1, 10)}
+
+DEFAULT_SPEC = {"sources": ["synthetic"],
+                "signals": ["signal_a"],
+                "geo_types": {"county": 3000, "state": 52},
+                "start_date": "20200301",
+                "end_date": "20200331",
+                "issues": 1,
+                "seed": 0}
+
+HEADER = b"geo_id,val,se,sample_size\n"
+VALUE_DIGITS = 6
+DECIMALS = 4
+SAMPLE_SIZE_DIGITS = 4
+
+
+def get_spec(spec: dict = None) -> dict:
+    """
+    Fill in a dataset spec with defaults.
+
+    Parameters
+    ----------
+    spec: dict, optional
+        Any of the keys of DEFAULT_SPEC: `sources` and `signals`, lists of names; `geo_types`, a dict of geo type
+        to number of locations; `start_date` and `end_date`, inclusive YYYYMMDD strings; `issues`, the number of
+        issues of each day including the first; and `seed`. Other keys such as `type` are ignored.
+
+    Returns
+    -------
+    Complete spec.
+    """
+    return dict(DEFAULT_SPEC, **{k: v for k, v in (spec or {}).items() if k in DEFAULT_SPEC})
+
+
+def get_geo_ids(geo_type: str, count: int) -> np.ndarray:
+    """
+    Return `count` valid geo IDs of a geo type.
+
+    Parameters
+    ----------
+    geo_type: str
+        One of county, msa, hrr, dma, hhs, state, or nation.
+    count: int
+        Number of locations.
+
+    Returns
+    -------
+    Array of geo ID strings.
+    """
+    if geo_type in GEO_RANGES:
+        first, available = GEO_RANGES[geo_type]
+    elif geo_type in ("state", "nation"):
+        first, available = 0, len(STATES) if geo_type == "state" else 1
+    else:
+        raise ValueError(f"unknown geo type {geo_type}")
+    if count > available:
+        raise ValueError(f"at most {available} {geo_type} locations are available")
+    if geo_type == "nation":
+        return np.array(["us"])
+    if geo_type == "state":
+        return np.array(STATES[:count])
+    width = 5 if geo_type in ("county", "msa") else 0
+    return np.char.zfill(np.arange(first, first + count).astype(str), width)
+
+
+def _dates(start: str, end: str) -> List[datetime.date]:
+    first = datetime.datetime.strptime(start, "%Y%m%d").date()
+    last = datetime.datetime.strptime(end, "%Y%m%d").date()
+    return [first + datetime.timedelta(days=d) for d in range((last - first).days + 1)]
+
+
+def format_fixed(values: np.ndarray, digits: int, decimals: int) -> np.ndarray:
+    """
+    Format non-negative numbers as fixed-width ASCII.
+
+    Parameters
+    ----------
+    values: np.ndarray
+        Numbers to format. They are clipped to what fits in the width.
+    digits: int
+        Digits before the decimal point, padded with leading zeros.
+    decimals: int
+        Digits after the decimal point. If 0, no decimal point is written.
+
+    Returns
+    -------
+    uint8 array with one row of characters per value.
+    """
+    scaled = np.clip(np.round(values * 10 ** decimals), 0, 10 ** (digits + decimals) - 1).astype(np.int64)
+    powers = 10 ** np.arange(digits + decimals - 1, -1, -1, dtype=np.int64)
+    chars = ((scaled[:, None] // powers) % 10 + ord("0")).astype(np.uint8)
+    if decimals:
+        chars = np.insert(chars, digits, ord("."), axis=1)
+    return chars
+
+
+class CsvTemplate:
+    """
+    Bytes of a CSV file with a fixed geo_id column, whose fixed-width value columns are filled in per file.
+
+    Since geo IDs are the same in every file of a geo type, the position of every value character is computed
+    once, and writing a file is a single scatter into the template.
+    """
+
+    WIDTH = 2 * (VALUE_DIGITS + 1 + DECIMALS) + SAMPLE_SIZE_DIGITS + 2
+
+    def __init__(self, geo_ids: np.ndarray):
+        prefixes = [g.encode() + b"," for g in geo_ids.tolist()]
+        rows = b"".join(p + b" " * self.WIDTH + b"\n" for p in prefixes)
+        self.buffer = np.frombuffer(rows, dtype=np.uint8).copy()
+        lengths = np.array([len(p) for p in prefixes]) + self.WIDTH + 1
+        starts = np.cumsum(lengths) - self.WIDTH - 1
+        self.positions = starts[:, None] + np.arange(self.WIDTH)
+
+    def write(self, path: str, val: np.ndarray, se: np.ndarray, sample_size: np.ndarray) -> None:
+        """Write a file with the given values, one per geo ID."""
+        comma = np.full((len(val), 1), ord(","), dtype=np.uint8)
+        self.buffer[self.positions] = np.hstack([format_fixed(val, VALUE_DIGITS, DECIMALS), comma,
+                                                 format_fixed(se, VALUE_DIGITS, DECIMALS), comma,
+                                                 format_fixed(sample_size, SAMPLE_SIZE_DIGITS, 0)])
+        with open(path, "wb") as f:
+            f.write(HEADER)
+            self.buffer.tofile(f)
+
+
+def _write_signal(job: tuple) -> int:
+    """Write every issue of every day of one source, signal, and geo type. Returns the number of rows."""
+    out, source, signal, geo_type, count, dates, issues, seed = job
+    rng = np.random.default_rng(seed)
+    template = CsvTemplate(get_geo_ids(geo_type, count))
+    # one level per location, a smooth trend over days, and noise per day and issue
+    level = rng.gamma(2.0, 50.0, size=count)
+    trend = np.exp(np.cumsum(rng.normal(0, 0.05, size=len(dates))))
+    val = level[None, :] * trend[:, None] * rng.lognormal(0, 0.1, size=(len(dates), count))
+    sample_size = rng.integers(10, 5000, size=(len(dates), count))
+    rows = 0
+    for issue in range(issues):
+        if issue:
+            val = val * rng.lognormal(0, 0.05, size=val.shape)
+        directory = os.path.join(out, f"issue_{dates[-1] + datetime.timedelta(days=issue):%Y%m%d}", source)
+        os.makedirs(directory, exist_ok=True)
+        se = val / np.sqrt(sample_size)
+        for d, date in enumerate(dates):
+            template.write(os.path.join(directory, f"{date:%Y%m%d}_{geo_type}_{signal}.csv"),
+                           val[d], se[d], sample_size[d])
+            rows += count
+    return rows
+
+
+def generate(spec: dict, out: str, workers: int = None) -> int:
+    """
+    Write the covidcast CSVs described by a spec.
+
+    Each source, signal, and geo type is generated in its own process from a seed derived from the spec's
+    seed, so the output only depends on the spec.
+
+    Parameters
+    ----------
+    spec: dict
+        Dataset spec, see get_spec().
+    out: str
+        Directory to write the `issue_*/` directories into.
+    workers: int, optional
+        Number of processes. Defaults to the number of CPUs.
+
+    Returns
+    -------
+    Number of rows written, counting every issue.
+    """
+    spec = get_spec(spec)
+    dates = _dates(spec["start_date"], spec["end_date"])
+    jobs = []
+    for source in spec["sources"]:
+        for signal in spec["signals"]:
+            for geo_type, count in sorted(spec["geo_types"].items()):
+                get_geo_ids(geo_type, count)  # fail before starting any work
+                jobs.append((out, source, signal, geo_type, count, dates, spec["issues"],
+                             [spec["seed"], len(jobs)]))
+    with ProcessPoolExecutor(workers) as executor:
+        return sum(executor.map(_write_signal, jobs))
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    """Define command line arguments."""
+    parser = argparse.ArgumentParser(description="Generate synthetic covidcast CSVs.")
+    parser.add_argument("--spec", default="{}", help="dataset spec as JSON, or a path to a JSON file")
+    parser.add_argument("--out", required=True, help="directory to write issue_*/ into")
+    parser.add_argument("--workers", type=int, help="number of processes (default: number of CPUs)")
+    return parser
+
+
+def main(args: argparse.Namespace) -> None:
+    """Run the command line interface."""
+    if os.path.exists(args.spec):
+        with open(args.spec) as f:
+            spec = json.load(f)
+    else:
+        spec = json.loads(args.spec)
+    print(f"wrote {generate(spec, args.out, args.workers):,} rows to {args.out}")
+
+
+if __name__ == "__main__":
+    main(get_argument_parser().parse_args())
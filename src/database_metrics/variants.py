@@ -0,0 +1,226 @@
+"""
+Compare schema and index variants of the epidata database on the same workload.
+
+A variant is a DDL migration script, e.g. adding an index, partitioning covidcast, or changing a column type,
+applied to the schema of the database image. Each variant gets a fresh database container, so variants can't
+affect each other, and the same datasets and queries are measured against each with measure_database(). A variant
+without a script measures the schema as it is, and is the natural baseline. For example
+
+```
+variants = [{"name": "baseline"},
+            {"name": "geo_index", "sql": "CREATE INDEX by_geo ON covidcast (geo_type, geo_value)"},
+            {"name": "partitioned", "path": "migrations/partition_by_time_value.sql"}]
+output = measure_variants(variants, datasets, docker.from_env(), queries=queries)
+print(format_variants(output["comparison"]))
+```
+"""
+import socket
+import time
+from typing import List, Optional
+
+from docker import DockerClient
+from docker.models.containers import Container
+
+from delphi.operations.database_metrics.actions import dataset_label
+from delphi.operations.database_metrics.db_actions import _run_sql
+from delphi.operations.database_metrics.parallel import Worker, get_cpusets
+
+COMPARE_METRICS = ["load_s", "meta_s", "db_size_mb"]
+
+
+def load_variant(variant: dict) -> dict:
+    """
+    Check a variant and read its script.
+
+    Parameters
+    ----------
+    variant: dict
+        Variant with a `name` and at most one of `sql`, the migration script, or `path`, a file holding it.
+
+    Returns
+    -------
+    Dictionary with the `name` and `sql`, which is empty for a variant without a script.
+    """
+    if not variant.get("name"):
+        raise ValueError(f"variant {variant} has no name")
+    if "sql" in variant and "path" in variant:
+        raise ValueError(f"variant {variant['name']} has both sql and path")
+    sql = variant.get("sql", "")
+    if "path" in variant:
+        with open(variant["path"]) as f:
+            sql = f.read()
+    return {"name": variant["name"], "sql": sql}
+
+
+def apply_variant(container: Container, sql: str) -> float:
+    """
+    Run a migration script against the epidata database.
+
+    Parameters
+    ----------
+    container: Container
+        Docker Container object where the MariaDB database is running.
+    sql: str
+        Script of one or more statements, run in the epidata database.
+
+    Returns
+    -------
+    Seconds the migration took.
+
+    Raises
+    ------
+    db_actions.ExecError if the migration failed.
+    """
+    start = time.perf_counter()
+    _run_sql(container, f"USE epidata; {sql}")
+    return time.perf_counter() - start
+
+
+def compare_variants(outputs: dict, baseline: Optional[str] = None) -> List[dict]:
+    """
+    Line up the load time, metadata update time, on-disk size, and query latencies of each variant.
+
+    Parameters
+    ----------
+    outputs: dict
+        Output of measure_database() for each variant, by name, in the order they ran.
+    baseline: str, optional
+        Variant to compare the others to. Defaults to the first.
+
+    Returns
+    -------
+    List of dictionaries, one per dataset and metric, with the `dataset`, `metric`, one of COMPARE_METRICS or the
+    operation of a query with an `_s` suffix, `values` by variant, which are None where every run of a query
+    failed, and `ratios` of each value to the baseline's, which are None where either is missing or the baseline's
+    value is 0.
+    """
+    names = list(outputs)
+    baseline = baseline or names[0]
+    first = outputs[names[0]]
+    queries = sorted((k for k in first if k.startswith("query") and k != "queries"),
+                     key=lambda k: (int(k[5:].split("_")[0]), k))
+
+    def metric(output, k, name):
+        if name == "load_s":
+            return output["load"][k]["runtime"]
+        if name == "meta_s":
+            return output["meta"][k]["runtime"]
+        if name == "db_size_mb":
+            return output["meta"][k]["db_size_mb"]
+        return output[name[:-2]][k].get("runtime")
+
+    rows = []
+    for k, dataset in enumerate(first["datasets"]):
+        for name in COMPARE_METRICS + [f"{q}_s" for q in queries]:
+            values = {v: metric(outputs[v], k, name) for v in names}
+            base = values[baseline]
+            rows.append({"dataset": dataset_label(dataset), "metric": name, "values": values,
+                         "ratios": {v: value / base if base and value is not None else None
+                                    for v, value in values.items()}})
+    return rows
+
+
+def format_variants(comparison: List[dict]) -> str:
+    """
+    Format the output of compare_variants() as a table with a column per variant.
+
+    Parameters
+    ----------
+    comparison: list of dicts
+        Output of compare_variants().
+
+    Returns
+    -------
+    Multi-line string with each dataset and metric's values, followed by the ratio to the baseline in brackets.
+    """
+    if not comparison:
+        return ""
+    names = list(comparison[0]["values"])
+    width = max(18, *(len(n) + 2 for n in names))
+    lines = [f"{'dataset':<30} {'metric':<18}" + "".join(f"{n:>{width}}" for n in names)]
+    for row in comparison:
+        cells = []
+        for name in names:
+            ratio = row["ratios"][name]
+            value = row["values"][name]
+            cells.append(("n/a" if value is None else f"{value:.3f}") + ("" if ratio is None else f" [{ratio:.2f}x]"))
+        lines.append(f"{row['dataset']:<30} {row['metric']:<18}" + "".join(f"{c:>{width}}" for c in cells))
+    return "\n".join(lines)
+
+
+def measure_variants(variants: List[dict],
+                     datasets: list,
+                     client: DockerClient,
+                     python_image_name: str = "delphi_python",
+                     queries: list = None,
+                     db_image: str = "delphi_database_epidata",
+                     web_image: str = "delphi_web_epidata",
+                     cpus: Optional[int] = None,
+                     mem_limit: str = None,
+                     prefix: str = "delphi_metrics_variant",
+                     harness: str = None,
+                     baseline: Optional[str] = None,
+                     **kwargs) -> dict:
+    """
+    Measure the same datasets and queries against each schema variant, each in a fresh database container.
+
+    Variants run one after another on the same CPUs, so they don't compete with each other. Each gets a private
+    network with a new database container, and a web server if there are queries, as in
+    parallel.measure_parallel(); its migration is applied before the first dataset is loaded.
+
+    Parameters
+    ----------
+    variants: list of dicts
+        Schema variants, see load_variant().
+    datasets: list of tuples or dicts
+        Datasets to measure against every variant, as for measure_database().
+    client: DockerClient
+        DockerClient object to start containers with.
+    python_image_name: str, optional
+        Name of Docker image containing the data loading and metadata updating code.
+    queries: list of dictionaries, optional
+        List of query parameters to test query runtimes on. Defaults to empty list.
+    db_image: str, optional
+        Image of the epidata database the variants are applied to. Defaults to delphi_database_epidata.
+    web_image: str, optional
+        Image of the Epidata API web server, only started if there are queries. Defaults to delphi_web_epidata.
+    cpus: int, optional
+        Number of CPUs to pin the containers to, starting from the first. Defaults to all of the Docker host's.
+    mem_limit: str, optional
+        Memory limit of each database container, and of each python container, e.g. "4g". Defaults to None
+        (unlimited).
+    prefix: str, optional
+        Prefix for the names of the networks and containers created. Defaults to delphi_metrics_variant.
+    harness: str, optional
+        Name or ID of the container running this code, which joins each network to send queries. See
+        parallel.measure_parallel().
+    baseline: str, optional
+        Name of the variant to compare the others to. Defaults to the first.
+    kwargs:
+        Other arguments of measure_database(), except `probe` and `status_probe`.
+
+    Returns
+    -------
+    Dictionary with the output of measure_database() for each variant by name under `variants`, each with the
+    variant's `migration_s` and `sql`, and the output of compare_variants() under `comparison`.
+    """
+    if "probe" in kwargs or "status_probe" in kwargs:
+        raise ValueError("probes connect to a single database and can't follow the variants' databases")
+    variants = [load_variant(v) for v in variants]
+    if len({v["name"] for v in variants}) != len(variants):
+        raise ValueError("variant names must be unique")
+    total_cpus = client.info()["NCPU"]
+    cpuset = get_cpusets(total_cpus, 1, cpus or total_cpus)[0]
+    web_image = web_image if queries else None
+    harness = (harness or socket.gethostname()) if web_image is not None else None
+
+    outputs = {}
+    for i, variant in enumerate(variants):
+        worker = Worker.new_instance(client, f"{prefix}_{i}", db_image, web_image, cpuset, mem_limit, harness)
+        try:
+            migration_s = apply_variant(worker.db, variant["sql"]) if variant["sql"].strip() else 0.0
+            outputs[variant["name"]] = worker.measure(datasets, python_image_name, queries, **kwargs)
+        finally:
+            worker.remove(harness)
+        outputs[variant["name"]].update(migration_s=migration_s, sql=variant["sql"])
+    return {"variants": outputs, "comparison": compare_variants(outputs, baseline)}
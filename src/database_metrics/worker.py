@@ -0,0 +1,146 @@
+"""
+Run acquisition commands in one long-lived python container instead of starting a container per operation.
+
+Starting a delphi_python container adds container startup to every measurement of actions.load_data() and
+actions.update_meta(), which dominates short ingestion batches. A WorkerContainer is started once and runs each
+command with exec_run, and the overhead it avoids is measured once and reported separately.
+"""
+import time
+from typing import List, Optional
+
+from docker import DockerClient
+from docker.errors import ContainerError
+from docker.models.containers import Container
+
+# modules imported by the operations, to time how long importing them takes
+IMPORTS = ["delphi.epidata.acquisition.covidcast.csv_to_database",
+           "delphi.epidata.acquisition.covidcast.covidcast_meta_cache_updater"]
+
+
+def _import_command(modules: List[str]) -> list:
+    return ["python3", "-c", "import " + ", ".join(modules)]
+
+
+def _timed(run) -> float:
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+
+class WorkerContainer:
+    """A python container kept running with `sleep infinity`, which runs commands with exec_run."""
+
+    def __init__(self, container: Container, overhead: Optional[dict] = None):
+        self.container = container
+        self.overhead = overhead or {}
+
+    @staticmethod
+    def new_instance(client: DockerClient,
+                     image: str,
+                     network: str = "delphi-net",
+                     resources: dict = None,
+                     volumes: dict = None) -> "WorkerContainer":
+        """
+        Start a worker container and measure the overhead it saves.
+
+        Parameters
+        ----------
+        client: DockerClient
+            DockerClient object to start the container with.
+        image: str
+            Name of image containing the acquisition code.
+        network: str, optional
+            Docker network to run the container on. Defaults to delphi-net.
+        resources: dict, optional
+            Extra keyword arguments of containers.run() limiting the container's resources, e.g. cpuset_cpus.
+            Commands run with exec_run share these limits.
+        volumes: dict, optional
+            Volumes to mount, as for containers.run(), e.g. the synthetic dataset volume.
+
+        Returns
+        -------
+        WorkerContainer whose `overhead` is described in measure_overhead().
+        """
+        start = time.perf_counter()
+        container = client.containers.run(image=client.images.get(image), command=["sleep", "infinity"],
+                                          detach=True, network=network, volumes=volumes, **(resources or {}))
+        worker = WorkerContainer(container)
+        worker.run(["true"])
+        startup_s = time.perf_counter() - start
+        worker.overhead = worker.measure_overhead()
+        worker.overhead["startup_s"] = startup_s - worker.overhead["exec_s"]
+        return worker
+
+    def run(self, command) -> bytes:
+        """
+        Run a command in the worker and return its output.
+
+        Parameters
+        ----------
+        command: str or list
+            Command, as for exec_run().
+
+        Returns
+        -------
+        Bytestring of the command's combined STDOUT and STDERR.
+
+        Raises
+        ------
+        ContainerError if the command exits with a non-zero status, as containers.run() does.
+        """
+        result = self.container.exec_run(command)
+        if result.exit_code != 0:
+            raise ContainerError(self.container, result.exit_code, command, self.container.image, result.output)
+        return result.output
+
+    def measure_overhead(self) -> dict:
+        """
+        Time what a command run in a fresh python process pays before doing any work.
+
+        Returns
+        -------
+        Dictionary with `exec_s`, seconds to exec a command which does nothing, `python_s`, seconds more to start
+        the Python interpreter, and `import_s`, seconds more to import the acquisition modules in IMPORTS. The
+        last two are still part of every measured operation, as in production, where each batch is a new
+        process.
+        """
+        exec_s = _timed(lambda: self.run(["true"]))
+        python_s = _timed(lambda: self.run(["python3", "-c", "pass"]))
+        import_s = _timed(lambda: self.run(_import_command(IMPORTS)))
+        return {"exec_s": exec_s, "python_s": python_s - exec_s, "import_s": import_s - python_s}
+
+    def remove(self):
+        """Stop and remove the container."""
+        self.container.remove(force=True)
+
+
+def measure_startup(client: DockerClient,
+                    image: str,
+                    network: str = "delphi-net",
+                    resources: dict = None) -> dict:
+    """
+    Time the overhead of running an operation in a fresh container, as actions.load_data() does without a worker.
+
+    Parameters
+    ----------
+    client: DockerClient
+        DockerClient object to start containers with.
+    image: str
+        Name of image containing the acquisition code.
+    network: str, optional
+        Docker network to run the containers on. Defaults to delphi-net.
+    resources: dict, optional
+        Extra keyword arguments of containers.run(), as for the measured operations.
+
+    Returns
+    -------
+    Dictionary with `startup_s`, seconds to run a container which does nothing, and `import_s`, seconds more
+    to start Python and import the acquisition modules in it.
+    """
+    def run(command):
+        return client.containers.run(image=client.images.get(image), command=command, network=network,
+                                     remove=True, **(resources or {}))
+
+    startup_s = _timed(lambda: run(["true"]))
+    import_s = _timed(lambda: run(_import_command(IMPORTS)))
+    return {"startup_s": startup_s, "import_s": import_s - startup_s}
@@ -65,6 +65,13 @@ class mailgun:
   key = '{SECRET_MAILGUN_AUTH_KEY}'
 
 
+class offsite:
+
+  endpoint = '{SECRET_OFFSITE_ENDPOINT}'
+  bucket = '{SECRET_OFFSITE_BUCKET}'
+  keys = ('{SECRET_OFFSITE_ACCESS_KEY}', '{SECRET_OFFSITE_SECRET_KEY}')
+
+
 class apache:
 
   keys_dir = '{SECRET_APACHE_KEYS_DIR}'
@@ -0,0 +1,108 @@
+"""Tests for benchmark.py"""
+import csv
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.benchmark'
+
+OUTPUT = {"datasets": [("a", "b")],
+          "queries": [{"q": 1}],
+          "cache_modes": ["cold", "hot"],
+          "load": [{"runtime": 2.0, "rows_loaded": 10}],
+          "meta": [{"runtime": 1.0}],
+          "query0_cold": [{"runtime": 0.5, "cache_mode": "cold",
+                           "trials": [{"runtime": 0.5, "outlier": False}, {"runtime": 0.9, "outlier": True}]}],
+          "query0_hot": [{"runtime": 0.1, "cache_mode": "hot", "read_bytes": 0}]}
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, name, text):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_load_spec(self):
+        path = self._write("spec.json", json.dumps({"datasets": [["a", "b"], {"type": "synthetic"}],
+                                                    "repetitions": 3, "concurrency": 2, "mem_limit": "4g"}))
+        spec = load_spec(path)
+        self.assertEqual(spec["datasets"], [("a", "b"), {"type": "synthetic"}])
+        self.assertEqual(spec["repetitions"], 3)
+        path = self._write("spec.yaml", "datasets:\n  - [a, b]\ncache_mode: cold\n")
+        self.assertEqual(load_spec(path)["cache_mode"], "cold")
+        with self.assertRaisesRegex(ValueError, "repetiions"):
+            load_spec(self._write("typo.json", json.dumps({"datasets": [["a", "b"]], "repetiions": 3})))
+        with self.assertRaisesRegex(ValueError, "client"):
+            load_spec(self._write("client.json", json.dumps({"datasets": [["a", "b"]], "client": 1})))
+        with self.assertRaises(ValueError):
+            load_spec(self._write("empty.json", "{}"))
+        # measure_parallel() arguments are only accepted in parallel, and the arguments it sets per worker never
+        with self.assertRaisesRegex(ValueError, "mem_limit"):
+            load_spec(self._write("serial.json", json.dumps({"datasets": [["a", "b"]], "mem_limit": "4g"})))
+        self.assertEqual(load_spec(self._write("serial.json", json.dumps(
+            {"datasets": [["a", "b"]], "network": "net", "queries": [{}]})))["network"], "net")
+        with self.assertRaisesRegex(ValueError, r"\['api_url', 'network'\]"):
+            load_spec(self._write("parallel.json", json.dumps(
+                {"datasets": [["a", "b"]], "concurrency": 2, "network": "net", "api_url": "http://x"})))
+
+    @patch("delphi.operations.database_metrics.benchmark.parallel.measure_parallel")
+    @patch("delphi.operations.database_metrics.benchmark.monitor.measure_database")
+    def test_run_spec(self, mock_measure, mock_parallel):
+        client, progress = MagicMock(), MagicMock()
+        run_spec({"datasets": [("a", "b")], "cache_mode": "warm", "repetitions": 2, "output": {}}, client, progress)
+        mock_measure.assert_called_once_with([("a", "b")], client, progress=progress, cache_modes=["warm"],
+                                             repetitions=2)
+        run_spec({"datasets": [("a", "b")], "concurrency": 3}, client)
+        mock_parallel.assert_called_once_with([("a", "b")], client, workers=3, progress=None)
+
+    def test_write_csv(self):
+        path = os.path.join(self.tmp.name, "out.csv")
+        write_csv(OUTPUT, path)
+        with open(path) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(list(rows[0]), CSV_COLUMNS)
+        self.assertEqual([r["operation"] for r in rows], ["load", "meta", "query0_cold", "query0_cold", "query0_hot"])
+        self.assertEqual([r["cache_mode"] for r in rows], ["", "", "cold", "cold", "hot"])
+        self.assertEqual([r["outlier"] for r in rows], ["0", "0", "0", "1", "0"])
+        self.assertEqual(rows[0]["rows_loaded"], "10")
+
+    def test_write_json(self):
+        path = os.path.join(self.tmp.name, "out.json")
+        write_json(dict(OUTPUT, load=[{"runtime": np.float64(2.0), "samples": {"time_s": np.array([0.0, 0.5])}}]),
+                   path)
+        with open(path) as f:
+            self.assertEqual(json.load(f)["load"], [{"runtime": 2.0, "samples": {"time_s": [0.0, 0.5]}}])
+
+    @patch("delphi.operations.database_metrics.benchmark.docker.from_env")
+    @patch("delphi.operations.database_metrics.benchmark.run_spec")
+    def test_main(self, mock_run, mock_docker):
+        mock_run.return_value = OUTPUT
+        path = self._write("spec.json", json.dumps({"datasets": [["a", "b"]],
+                                                    "output": {"csv": os.path.join(self.tmp.name, "out.csv")}}))
+        out = os.path.join(self.tmp.name, "out.json")
+        main(get_argument_parser().parse_args([path, "--json", out, "--git-sha", "abc", "--quiet"]))
+        self.assertEqual(mock_run.call_args[0][0]["git_sha"], "abc")
+        self.assertIsNone(mock_run.call_args[0][2])
+        self.assertTrue(os.path.exists(out))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, "out.csv")))
+
+    @patch("sys.stderr", new_callable=io.StringIO)
+    def test_print_progress(self, mock_stderr):
+        print_progress("a:b", "query0", {"runtime": 0.5, "response": {"ttfb": 0.1, "rows": 1200, "bytes": 5000,
+                                                                       "status": 200, "error": None}})
+        self.assertEqual(mock_stderr.getvalue(),
+                         "a:b query0: 0.500s (first byte 0.100s, 1,200 rows, 5,000 bytes, 200)\n")
+        print_progress("a:b", "query1", {"failed_trials": [{"error": "HTTP 500"}, {"error": "incomplete"}]})
+        self.assertTrue(mock_stderr.getvalue().endswith("a:b query1: every run failed (HTTP 500, incomplete)\n"))
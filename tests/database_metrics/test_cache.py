@@ -0,0 +1,51 @@
+"""Tests for cache.py"""
+import unittest
+from unittest.mock import MagicMock, patch
+
+from docker.errors import APIError
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.cache'
+
+
+class TestCache(unittest.TestCase):
+
+    @patch("delphi.operations.database_metrics.cache.wait_for_database")
+    @patch("delphi.operations.database_metrics.cache._run_sql")
+    def test_drop_buffer_pool(self, mock_sql, mock_wait):
+        container = MagicMock()
+        container.exec_run.return_value = MagicMock(exit_code=0, output=(None, None))
+        drop_buffer_pool(container)
+        self.assertIn("innodb_buffer_pool_dump_at_shutdown = OFF", mock_sql.call_args[0][1])
+        self.assertEqual(container.exec_run.call_args[0][0], ["rm", "-f", "/var/lib/mysql/ib_buffer_pool"])
+        container.restart.assert_called_once()
+        mock_wait.assert_called_once()
+        container.exec_run.return_value = MagicMock(exit_code=1, output=(None, b"rm: Permission denied\n"))
+        with self.assertRaisesRegex(RuntimeError, "rm exited with 1"):
+            drop_buffer_pool(container)
+
+    def test_drop_os_cache(self):
+        client = MagicMock()
+        self.assertTrue(drop_os_cache(client, MagicMock()))
+        self.assertTrue(client.containers.run.call_args[1]["privileged"])
+        client.containers.run.side_effect = APIError("privileged containers aren't allowed")
+        self.assertFalse(drop_os_cache(client, MagicMock()))
+
+    @patch("delphi.operations.database_metrics.cache.drop_os_cache")
+    @patch("delphi.operations.database_metrics.cache.drop_buffer_pool")
+    @patch("delphi.operations.database_metrics.cache._clear_cache")
+    def test_prepare_cache(self, mock_clear, mock_drop_pool, mock_drop_os):
+        mock_drop_os.return_value = False
+        run = MagicMock()
+        self.assertEqual(prepare_cache(MagicMock(), "container", "cold", run),
+                         {"cache_mode": "cold", "os_cache_dropped": False})
+        run.assert_not_called()
+        mock_drop_pool.assert_called_once_with("container")
+        self.assertEqual(prepare_cache(MagicMock(), "container", "warm", run), {"cache_mode": "warm"})
+        self.assertEqual(run.call_count, 1)
+        mock_clear.assert_called_once_with("container")
+        self.assertEqual(prepare_cache(MagicMock(), "container", "hot", run), {"cache_mode": "hot"})
+        self.assertEqual(run.call_count, 2)
+        mock_clear.assert_called_once()
+        with self.assertRaises(ValueError):
+            prepare_cache(MagicMock(), "container", "lukewarm", run)
@@ -0,0 +1,85 @@
+"""Tests for db_actions.py"""
+import unittest
+from unittest.mock import MagicMock
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.db_actions'
+
+
+class TestDbActions(unittest.TestCase):
+
+    def test_wait_for_database(self):
+        mock_container = MagicMock()
+        mock_container.exec_run.side_effect = [MagicMock(exit_code=1), MagicMock(exit_code=0)]
+        wait_for_database(mock_container, poll_s=0)
+        self.assertEqual(mock_container.exec_run.call_count, 2)
+        mock_container.exec_run.side_effect = None
+        mock_container.exec_run.return_value = MagicMock(exit_code=1)
+        with self.assertRaises(TimeoutError):
+            wait_for_database(mock_container, timeout_s=0, poll_s=0)
+
+    def test_run_sql(self):
+        mock_container = MagicMock()
+        mock_container.exec_run.return_value = MagicMock(exit_code=0, output=(b"1\n", None))
+        self.assertEqual(_run_sql(mock_container, "SELECT 1"), b"1\n")
+        command = mock_container.exec_run.call_args[0][0]
+        self.assertEqual(command[:2], ["mysql", "-uroot"])
+        self.assertIn("--skip-column-names", command)
+        mock_container.exec_run.return_value = MagicMock(exit_code=1, output=(None, b"ERROR 1146 (42S02)\n"))
+        with self.assertRaisesRegex(ExecError, "ERROR 1146"):
+            _clear_db(mock_container)
+        with self.assertRaises(ExecError):
+            _clear_cache(mock_container)
+
+    def test_exec_probe(self):
+        mock_container = MagicMock()
+        mock_container.exec_run.side_effect = [
+            MagicMock(exit_code=0, output=(b'epidata\t7.5\nmysql\t2.0\n', b'mysql: Deprecated program name\n')),
+            MagicMock(exit_code=0, output=(b'1604\n', None)),
+            MagicMock(exit_code=0, output=(b'epidata\t7.5\nmysql\t2.0\n', None))]
+        probe = ExecProbe(mock_container)
+        self.assertEqual(probe.db_size_mb(), 7.5)
+        self.assertEqual(probe.covidcast_rows(), 1604)
+        self.assertEqual(probe.db_sizes_mb(), {"epidata": 7.5, "mysql": 2.0})
+        command = mock_container.exec_run.call_args[0][0]
+        self.assertIn("--batch", command)
+        self.assertIn("--skip-column-names", command)
+        self.assertTrue(mock_container.exec_run.call_args[1]["demux"])
+
+    def test_exec_probe_error(self):
+        mock_container = MagicMock()
+        mock_container.exec_run.return_value = MagicMock(
+            exit_code=1, output=(None, b"ERROR 2002 (HY000): Can't connect to local server\n"))
+        with self.assertRaisesRegex(ExecError, "mysql exited with 1: ERROR 2002"):
+            ExecProbe(mock_container).covidcast_rows()
+
+    def test_sql_probe(self):
+        mock_connection = MagicMock()
+        cursor = mock_connection.cursor.return_value
+        cursor.fetchall.side_effect = [[(12.5,)], [(1000,)], [(1234,)]]
+        probe = SqlProbe(mock_connection)
+        self.assertEqual(probe.db_size_mb(), 12.5)
+        self.assertEqual(probe.covidcast_rows(), 1000)
+        self.assertIn("information_schema", cursor.execute.call_args[0][0])
+        probe.exact_rows = True
+        self.assertEqual(probe.covidcast_rows(), 1234)
+        self.assertIn("count(*)", cursor.execute.call_args[0][0])
+        mock_connection.ping.assert_called_with(reconnect=True)
+        self.assertEqual(cursor.close.call_count, 3)
+
+    def test_sql_probe_empty(self):
+        mock_connection = MagicMock()
+        mock_connection.cursor.return_value.fetchall.return_value = [(None,)]
+        probe = SqlProbe(mock_connection)
+        self.assertEqual(probe.db_size_mb(), 0)
+        self.assertEqual(probe.covidcast_rows(), 0)
+
+    def test_global_status(self):
+        mock_connection = MagicMock()
+        cursor = mock_connection.cursor.return_value
+        cursor.fetchall.return_value = [("Innodb_buffer_pool_reads", "12"), ("Questions", "5")]
+        status = SqlProbe(mock_connection).global_status(["Innodb_buffer_pool_reads", "Questions"])
+        self.assertDictEqual(status, {"Innodb_buffer_pool_reads": 12, "Questions": 5})
+        sql, params = cursor.execute.call_args[0]
+        self.assertIn("IN (%s, %s)", sql)
+        self.assertEqual(params, ("Innodb_buffer_pool_reads", "Questions"))
@@ -0,0 +1,115 @@
+"""Tests for epidata.py"""
+import asyncio
+import json
+import unittest
+
+from aiohttp import web
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.epidata'
+
+ROWS = [{"geo_value": "pa", "signal": 'a{b}[c]"\\', "value": 1.5}, {"geo_value": "ny", "signal": "", "value": None}]
+BODY = json.dumps({"epidata": ROWS, "result": 1, "message": "success"}).encode()
+
+
+def count(body: bytes, chunk_size: int) -> RowCounter:
+    counter = RowCounter()
+    for i in range(0, len(body), chunk_size):
+        counter.feed(body[i:i + chunk_size])
+    return counter
+
+
+async def serve(handler, run):
+    """Serve `handler` on a local port and await `run(url)`."""
+    app = web.Application()
+    app.router.add_get("/api", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        return await run(f"http://127.0.0.1:{port}/api")
+    finally:
+        await runner.cleanup()
+
+
+class TestEpidata(unittest.TestCase):
+
+    def test_row_counter(self):
+        for chunk_size in [1, 2, 3, 7, len(BODY)]:
+            counter = count(BODY, chunk_size)
+            self.assertEqual(counter.rows, 2)
+            self.assertEqual(counter.bytes, len(BODY))
+            self.assertTrue(counter.complete)
+        self.assertEqual(count(json.dumps(ROWS * 3).encode(), 5).rows, 6)
+        self.assertEqual(count(b'{"epidata": [], "result": -2}', 4).rows, 0)
+        self.assertFalse(count(BODY[:-5], 4).complete)
+        self.assertFalse(count(b"", 4).complete)
+
+    def test_fetch(self):
+        async def handler(request):
+            response = web.StreamResponse()
+            await response.prepare(request)
+            for i in range(0, len(BODY), 10):
+                await response.write(BODY[i:i + 10])
+            return response
+
+        async def run(url):
+            async with EpidataClient.new_instance(url, pool_size=2, chunk_size=16) as client:
+                return await asyncio.gather(client.fetch({"q": 1}), client.fetch({"q": 2}))
+
+        for record in asyncio.run(serve(handler, run)):
+            self.assertEqual(record["status"], 200)
+            self.assertEqual(record["bytes"], len(BODY))
+            self.assertEqual(record["rows"], 2)
+            self.assertTrue(record["complete"])
+            self.assertIsNone(record["error"])
+            self.assertLessEqual(record["ttfb"], record["total"])
+
+    def test_fetch_limits(self):
+        async def handler(request):
+            if request.query["q"] == "slow":
+                await asyncio.sleep(0.5)
+            return web.Response(body=BODY)
+
+        async def run(url):
+            async with EpidataClient.new_instance(url, read_timeout_s=0.1, max_bytes=10, chunk_size=4) as client:
+                return await client.fetch({"q": "slow"}), await client.fetch({"q": "big"})
+
+        slow, big = asyncio.run(serve(handler, run))
+        self.assertIn("Timeout", slow["error"])
+        self.assertIsNone(slow["status"])
+        self.assertEqual(big["error"], "max_bytes")
+        self.assertLess(big["bytes"], len(BODY))
+        self.assertFalse(big["complete"])
+
+    def test_blocking_client(self):
+        async def handler(request):
+            if request.query["q"] == "missing":
+                return web.Response(status=404, body=b'{"message": "not found"}')
+            return web.Response(body=BODY)
+
+        def fetch_all(url):
+            client = BlockingClient.new_instance(url, pool_size=1)
+            try:
+                return [client.fetch({"q": q}) for q in ["a", "b", "missing"]]
+            finally:
+                client.close()
+
+        async def run(url):
+            # the client runs its own event loop, so it is used from another thread than the server's
+            return await asyncio.get_running_loop().run_in_executor(None, fetch_all, url)
+
+        first, second, missing = asyncio.run(serve(handler, run))
+        self.assertEqual([first["rows"], second["rows"]], [2, 2])
+        self.assertIsNone(failure(first))
+        self.assertEqual(failure(missing), "HTTP 404")
+
+    def test_failure(self):
+        ok = {"status": 200, "complete": True, "error": None}
+        self.assertIsNone(failure(ok))
+        self.assertEqual(failure(dict(ok, status=None, error="ServerTimeoutError")), "ServerTimeoutError")
+        self.assertEqual(failure(dict(ok, complete=False, error="max_bytes")), "max_bytes")
+        self.assertEqual(failure(dict(ok, status=500)), "HTTP 500")
+        self.assertEqual(failure(dict(ok, complete=False)), "incomplete")
@@ -0,0 +1,82 @@
+"""Tests for loadgen.py"""
+import asyncio
+import unittest
+from unittest.mock import patch
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.loadgen'
+
+
+class FakeClient:
+    """Stands in for epidata.EpidataClient."""
+
+    async def fetch(self, params):
+        await asyncio.sleep(0.001)
+        record = {"status": 200, "ttfb": 0.001, "total": 0.001, "bytes": 10, "rows": 1, "complete": True,
+                  "error": None}
+        if params["signal"] == "bad":
+            record.update(status=None, ttfb=None, bytes=0, rows=0, complete=False, error="TimeoutError")
+        return record
+
+
+def record(query, latency, **kwargs):
+    return dict({"query": query, "latency": latency, "status": 200, "ttfb": latency / 2, "bytes": 5, "rows": 1,
+                 "complete": True, "error": None}, **kwargs)
+
+
+class TestLoadgen(unittest.TestCase):
+
+    def test_ramp_fraction(self):
+        self.assertEqual(ramp_fraction(5, 0), 1.0)
+        self.assertEqual(ramp_fraction(5, 10), 0.5)
+        self.assertEqual(ramp_fraction(15, 10), 1.0)
+
+    def test_summarize_load(self):
+        records = [record(0, 0.1), record(0, 0.3),
+                   record(1, 9.0, status=None, bytes=0, rows=0, complete=False, error="TimeoutError"),
+                   record(1, 0.2, complete=False)]
+        summary = summarize_load(records, 2, 2)
+        self.assertEqual(summary["query0"]["count"], 2)
+        self.assertEqual(summary["query0"]["throughput"], 1)
+        self.assertAlmostEqual(summary["query0"]["latency_p50"], 0.2)
+        self.assertAlmostEqual(summary["query0"]["ttfb_p50"], 0.1)
+        self.assertEqual(summary["query0"]["bytes"], 10)
+        self.assertEqual(summary["query0"]["rows"], 2)
+        # a truncated body is an error, as for single queries
+        self.assertEqual(summary["query1"]["errors"], 2)
+        self.assertIsNone(summary["query1"]["latency_p99"])
+        self.assertEqual(summary["all"]["count"], 4)
+
+    def test_run_load_closed_loop(self):
+        queries = [{"signal": "good"}, {"signal": "bad"}]
+        records = asyncio.run(run_load(queries, weights=[1, 0], clients=3, duration_s=0.1,
+                                       ramp_s=0.05, client=FakeClient()))
+        self.assertGreater(len(records), 3)
+        self.assertTrue(all(r["query"] == 0 and r["status"] == 200 for r in records))
+        self.assertEqual(records, sorted(records, key=lambda r: r["start"]))
+
+    def test_run_load_open_loop(self):
+        queries = [{"signal": "good"}, {"signal": "bad"}]
+        records = asyncio.run(run_load(queries, clients=5, duration_s=0.2, rate=200, seed=1,
+                                       client=FakeClient()))
+        self.assertGreater(len(records), 10)
+        self.assertEqual({r["query"] for r in records}, {0, 1})
+        self.assertTrue(all(r["error"] == "TimeoutError" for r in records if r["query"] == 1))
+
+    @patch("delphi.operations.database_metrics.loadgen.EpidataClient.new_instance")
+    def test_run_load_default_client(self, mock_client):
+        mock_client.return_value.__aenter__.return_value = FakeClient()
+        records = asyncio.run(run_load([{"signal": "good"}], clients=4, duration_s=0.02, timeout_s=5, url="url"))
+        self.assertGreater(len(records), 0)
+        mock_client.assert_called_once_with("url", pool_size=4, timeout_s=5)
+        mock_client.return_value.__aexit__.assert_called_once()
+
+    def test_run_load_invalid(self):
+        for kwargs in [{"rate": 0}, {"rate": -5}, {"clients": 0}, {"duration_s": 0}]:
+            with self.assertRaises(ValueError):
+                asyncio.run(run_load([{"signal": "good"}], client=FakeClient(), **kwargs))
+
+    def test_generate_load(self):
+        output = generate_load([{"signal": "good"}], clients=2, duration_s=0.05, client=FakeClient())
+        self.assertGreater(output["query0"]["count"], 0)
+        self.assertNotIn("client", output["settings"])
@@ -2,7 +2,7 @@
 import unittest
 from unittest.mock import patch, MagicMock
 
-from delphi.operations.database_metrics import monitor
+from delphi.operations.database_metrics import monitor, store
 
 # py3tester coverage target
 __test_target__ = 'delphi.operations.database_metrics.monitor'
@@ -10,10 +10,11 @@ __test_target__ = 'delphi.operations.database_metrics.monitor'
 
 class TestMonitor(unittest.TestCase):
 
+    @patch("delphi.operations.database_metrics.monitor.get_query_metrics")
     @patch("delphi.operations.database_metrics.monitor._clear_db")
     @patch("delphi.operations.database_metrics.monitor.parse_metrics")
     @patch("delphi.operations.database_metrics.monitor.get_metrics")
-    def test_measure_database(self, mock_metrics, mock_parser, mock_clear):
+    def test_measure_database(self, mock_metrics, mock_parser, mock_clear, mock_query_metrics):
         mock_client = MagicMock()
         mock_client.containers.get.return_value = None
         mock_metrics.return_value = None
@@ -48,3 +49,221 @@ class TestMonitor(unittest.TestCase):
         output = monitor.measure_database(test_datasets, mock_client, "container", "image", test_queries)
         self.assertDictEqual(output, expected)
         self.assertEqual(mock_clear.call_count, 2)
+
+    @patch("delphi.operations.database_metrics.monitor.parse_metrics")
+    @patch("delphi.operations.database_metrics.monitor.capture_metrics")
+    def test_measure_load(self, mock_capture, mock_parser):
+        mock_capture.return_value = ("metrics", {"all": "summary"})
+        mock_parser.return_value = {"runtime": 1}
+        output = monitor.measure_load(MagicMock(), ["q0"], clients=4)
+        self.assertDictEqual(output, {"runtime": 1, "load_test": {"all": "summary"}})
+        mock_parser.assert_called_once_with("metrics")
+        run = mock_capture.call_args[0][0]
+        self.assertEqual(run.keywords, {"clients": 4})
+
+    @patch("delphi.operations.database_metrics.db_actions._get_covidcast_rows")
+    @patch("delphi.operations.database_metrics.db_actions._get_epidata_db_size")
+    @patch("delphi.operations.database_metrics.monitor.get_source")
+    def test_capture_metrics(self, mock_source, mock_size, mock_rows):
+        mock_source.return_value.read.return_value = {"memory_usage": 1, "cpu_usage_ns": 0}
+        mock_size.return_value = MagicMock(exit_code=0, output=(b'epidata\t7.5\n', None))
+        mock_rows.return_value = MagicMock(exit_code=0, output=(b'10\n', None))
+        metrics, result = monitor.capture_metrics(lambda: "done", MagicMock(), False, 0.01)
+        self.assertEqual(result, "done")
+        self.assertEqual(metrics[:4], (7.5, 7.5, 10, 10))
+        self.assertGreaterEqual(len(metrics[5]["time"]), 1)
+
+    @patch("delphi.operations.database_metrics.monitor.parse_metrics")
+    def test_measure_trials(self, mock_parser):
+        mock_parser.side_effect = lambda m: {"runtime": m, "peak_memory_mb": 1, "size_loaded_mb": 0,
+                                             "rows_loaded": 0}
+        measure = MagicMock(side_effect=[9, 1, 2, 3])
+        reset = MagicMock()
+        output = monitor.measure_trials(measure, warmup=1, repetitions=3, reset=reset)
+        self.assertEqual([t["runtime"] for t in output["trials"]], [1, 2, 3])
+        self.assertEqual(output["runtime"], 2)
+        self.assertEqual(reset.call_count, 3)
+        self.assertDictEqual(monitor.measure_trials(MagicMock(return_value=4)), mock_parser(4))
+        for warmup, repetitions in [(0, 0), (-1, 1)]:
+            with self.assertRaises(ValueError):
+                monitor.measure_trials(measure, warmup, repetitions)
+
+    def test_measure_database_checks_arguments(self):
+        client = MagicMock()
+        with self.assertRaisesRegex(ValueError, "repetitions"):
+            monitor.measure_database([("a", "b")], client, repetitions=0)
+        with self.assertRaisesRegex(ValueError, "warmup"):
+            monitor.measure_database([("a", "b")], client, warmup=-1)
+        with self.assertRaisesRegex(ValueError, "query_plans"):
+            monitor.measure_database([("a", "b")], client, queries=[{}], query_plans="explain")
+        with self.assertRaisesRegex(ValueError, "cache_modes"):
+            monitor.measure_database([("a", "b")], client, queries=[{}], cache_modes=["cold", "lukewarm"])
+        with self.assertRaisesRegex(ValueError, "load test"):
+            monitor.measure_database([("a", "b")], client, load_test={"duration_s": 10})
+        client.containers.get.assert_not_called()
+
+    @patch("delphi.operations.database_metrics.monitor.parse_metrics")
+    def test_measure_trials_failed_queries(self, mock_parser):
+        ok = {"status": 200, "ttfb": 0.1, "complete": True, "error": None}
+        mock_parser.side_effect = lambda m: {"runtime": m[0], "peak_memory_mb": 1, "size_loaded_mb": 0,
+                                             "rows_loaded": 0, "response": m[1]}
+        measure = MagicMock(side_effect=[(1, ok), (9, dict(ok, error="ClientOSError", status=None)), (3, ok),
+                                         (8, dict(ok, status=500)), (2, dict(ok, complete=False))])
+        output = monitor.measure_trials(measure, repetitions=5)
+        self.assertEqual([t["runtime"] for t in output["trials"]], [1, 3])
+        self.assertEqual([t["error"] for t in output["failed_trials"]], ["ClientOSError", "HTTP 500", "incomplete"])
+        self.assertNotIn("failed_trials", monitor.measure_trials(MagicMock(return_value=(1, ok))))
+        output = monitor.measure_trials(MagicMock(return_value=(1, dict(ok, error="max_bytes"))), repetitions=2)
+        self.assertEqual(list(output), ["failed_trials"])
+        self.assertEqual(len(output["failed_trials"]), 2)
+
+    @patch("delphi.operations.database_metrics.monitor.get_query_metrics")
+    @patch("delphi.operations.database_metrics.monitor._clear_db")
+    @patch("delphi.operations.database_metrics.monitor.parse_metrics")
+    @patch("delphi.operations.database_metrics.monitor.get_metrics")
+    def test_measure_database_failed_query(self, mock_metrics, mock_parser, mock_clear, mock_query_metrics):
+        mock_metrics.return_value = {"runtime": 1}
+        mock_query_metrics.return_value = {"runtime": 1, "response": {"status": 500, "complete": True, "error": None}}
+        mock_parser.side_effect = dict
+        output = monitor.measure_database([("a", "b"), ("c", "d")], MagicMock(), queries=[{"q": 1}])
+        self.assertEqual(len(output["load"]), 2)
+        self.assertEqual([list(r) for r in output["query0"]], [["failed_trials"], ["failed_trials"]])
+        connection = store.connect(":memory:")
+        run_id = store.save_run(connection, output, "abc", {"fingerprint": "host"})
+        runtimes = [r[0] for r in connection.execute(
+            "SELECT runtime FROM measurements WHERE run_id = ? AND operation = 'query0'", (run_id,))]
+        self.assertEqual(runtimes, [None, None])
+
+    @patch("delphi.operations.database_metrics.monitor.get_source")
+    def test_capture_metrics_probe(self, mock_source):
+        mock_source.return_value.read.return_value = {"memory_usage": 1, "cpu_usage_ns": 0}
+        probe = MagicMock()
+        probe.db_size_mb.side_effect = [1.0, 2.0]
+        probe.covidcast_rows.side_effect = [10, 30]
+        metrics, _ = monitor.capture_metrics(lambda: None, MagicMock(), False, 0.01, probe=probe)
+        self.assertEqual(metrics[:4], (1.0, 2.0, 10, 30))
+
+    @patch("delphi.operations.database_metrics.monitor.DatabaseSource")
+    @patch("delphi.operations.database_metrics.monitor.ContainerSampler")
+    @patch("delphi.operations.database_metrics.monitor.get_source")
+    def test_capture_metrics_stops_sampling(self, mock_source, mock_sampler, mock_db_source):
+        def run():
+            raise RuntimeError("load failed")
+
+        with self.assertRaisesRegex(RuntimeError, "load failed"):
+            monitor.capture_metrics(run, MagicMock(), False, probe=MagicMock(), status_probe=MagicMock())
+        self.assertEqual(mock_sampler.return_value.stop.call_count, 2)
+
+    @patch("delphi.operations.database_metrics.monitor.get_source")
+    def test_capture_metrics_status_probe(self, mock_source):
+        mock_source.return_value.read.return_value = {"memory_usage": 1, "cpu_usage_ns": 0}
+        probe = MagicMock()
+        probe.db_size_mb.return_value = 1.0
+        probe.covidcast_rows.return_value = 10
+        status_probe = MagicMock()
+        status_probe.covidcast_rows.return_value = 5
+        status_probe.db_size_mb.return_value = 1.5
+        status_probe.global_status.return_value = {"Questions": 1}
+        metrics, _ = monitor.capture_metrics(lambda: None, MagicMock(), False, 0.01, probe=probe,
+                                             status_probe=status_probe, status_interval=0.01)
+        self.assertGreaterEqual(len(metrics[6]["time"]), 1)
+        self.assertEqual(metrics[6]["rows"][0], 5)
+
+    @patch("delphi.operations.database_metrics.monitor.load_synthetic")
+    @patch("delphi.operations.database_metrics.monitor.generate_synthetic")
+    @patch("delphi.operations.database_metrics.monitor._clear_db")
+    @patch("delphi.operations.database_metrics.monitor.parse_metrics")
+    @patch("delphi.operations.database_metrics.monitor.get_metrics")
+    def test_measure_database_synthetic(self, mock_metrics, mock_parser, mock_clear, mock_generate, mock_load):
+        mock_metrics.side_effect = lambda func, **kwargs: func()
+        spec = {"type": "synthetic", "geo_types": {"state": 5}}
+        monitor.measure_database([spec], MagicMock(), "container", "image", synthetic_volume="vol")
+        self.assertEqual(mock_generate.call_args[0][2:], (spec, "vol"))
+        self.assertEqual(mock_load.call_args[1]["volume"], "vol")
+
+    @patch("delphi.operations.database_metrics.monitor.get_query_metrics")
+    @patch("delphi.operations.database_metrics.monitor.capture_plan")
+    @patch("delphi.operations.database_metrics.monitor._clear_db")
+    @patch("delphi.operations.database_metrics.monitor.parse_metrics")
+    @patch("delphi.operations.database_metrics.monitor.get_metrics")
+    def test_measure_database_plans(self, mock_metrics, mock_parser, mock_clear, mock_plan, mock_query_metrics):
+        mock_parser.side_effect = lambda metrics: {"runtime": 1}
+        mock_plan.return_value = {"fingerprint": "abc"}
+        output = monitor.measure_database([("a", "b")], MagicMock(), queries=[{"q": 1}], query_plans="translate")
+        self.assertEqual(output["query0"][0]["plan"], {"fingerprint": "abc"})
+        self.assertIsNone(mock_plan.call_args[0][2])
+        monitor.measure_database([("a", "b")], MagicMock(), queries=[{"q": 1}], query_plans="log")
+        self.assertIsNotNone(mock_plan.call_args[0][2])
+
+    @patch("delphi.operations.database_metrics.monitor.get_query_metrics")
+    @patch("delphi.operations.database_metrics.monitor.prepare_cache")
+    @patch("delphi.operations.database_metrics.monitor._clear_db")
+    @patch("delphi.operations.database_metrics.monitor.parse_metrics")
+    @patch("delphi.operations.database_metrics.monitor.get_metrics")
+    def test_measure_database_cache_modes(self, mock_metrics, mock_parser, mock_clear, mock_prepare, mock_query_metrics):
+        mock_parser.side_effect = lambda metrics: {"runtime": 1}
+        mock_prepare.side_effect = lambda client, container, mode, run: {"cache_mode": mode}
+        output = monitor.measure_database([("a", "b")], MagicMock(), queries=[{"q": 1}],
+                                          cache_modes=["cold", "hot"])
+        self.assertNotIn("query0", output)
+        self.assertEqual(output["query0_cold"], [{"runtime": 1, "cache_mode": "cold"}])
+        self.assertEqual(output["query0_hot"], [{"runtime": 1, "cache_mode": "hot"}])
+        self.assertEqual(output["cache_modes"], ["cold", "hot"])
+        self.assertEqual([c[0][2] for c in mock_prepare.call_args_list], ["cold", "hot"])
+        self.assertFalse(mock_query_metrics.call_args[1]["clear_cache"])
+
+    @patch("delphi.operations.database_metrics.monitor.get_query_metrics")
+    @patch("delphi.operations.database_metrics.monitor._clear_db")
+    @patch("delphi.operations.database_metrics.monitor.parse_metrics")
+    @patch("delphi.operations.database_metrics.monitor.get_metrics")
+    def test_measure_database_progress(self, mock_metrics, mock_parser, mock_clear, mock_query_metrics):
+        mock_parser.side_effect = lambda metrics: {"runtime": 1}
+        progress = MagicMock()
+        monitor.measure_database([("a", "b")], MagicMock(), queries=[{"q": 1}], progress=progress)
+        self.assertEqual([c[0][:2] for c in progress.call_args_list],
+                         [("a:b", "load"), ("a:b", "meta"), ("a:b", "query0")])
+        self.assertEqual(progress.call_args[0][2], {"runtime": 1})
+
+    @patch("delphi.operations.database_metrics.monitor.capture_metrics")
+    def test_get_query_metrics(self, mock_capture):
+        response = {"status": 200, "ttfb": 0.1, "total": 0.5, "bytes": 10, "rows": 1, "complete": True, "error": None}
+        mock_capture.return_value = ((1, 1, 5, 5, 0.6, {}, {}), response)
+        query = MagicMock()
+        metrics = monitor.get_query_metrics(query, "container", False)
+        self.assertEqual(metrics, (1, 1, 5, 5, 0.6, {}, {}, response))
+        self.assertIs(mock_capture.call_args[0][0], query)
+
+    @patch("delphi.operations.database_metrics.monitor.load_data")
+    @patch("delphi.operations.database_metrics.monitor.WorkerContainer.new_instance")
+    @patch("delphi.operations.database_metrics.monitor._clear_db")
+    @patch("delphi.operations.database_metrics.monitor.parse_metrics")
+    @patch("delphi.operations.database_metrics.monitor.get_metrics")
+    def test_measure_database_warm_worker(self, mock_metrics, mock_parser, mock_clear, mock_worker, mock_load):
+        mock_metrics.side_effect = lambda func, **kwargs: func()
+        mock_parser.side_effect = lambda metrics: {"runtime": 1}
+        worker = mock_worker.return_value
+        worker.overhead = {"startup_s": 2.0}
+        output = monitor.measure_database([("a", "b")], MagicMock(), warm_worker=True)
+        self.assertIs(mock_load.call_args[1]["worker"], worker)
+        self.assertEqual(output["container_overhead"], {"startup_s": 2.0})
+        worker.remove.assert_called_once()
+
+    @patch("delphi.operations.database_metrics.monitor.update_meta")
+    @patch("delphi.operations.database_metrics.monitor.load_data")
+    @patch("delphi.operations.database_metrics.monitor.Profiler.new_instance")
+    @patch("delphi.operations.database_metrics.monitor._clear_db")
+    @patch("delphi.operations.database_metrics.monitor.parse_metrics")
+    @patch("delphi.operations.database_metrics.monitor.get_metrics")
+    def test_measure_database_profile(self, mock_metrics, mock_parser, mock_clear, mock_profiler, mock_load,
+                                      mock_meta):
+        mock_metrics.side_effect = lambda func, **kwargs: func()
+        mock_parser.side_effect = lambda metrics: {"runtime": 1}
+        profiler = mock_profiler.return_value
+        profiler.collect.side_effect = lambda worker: {"directory": profiler.start.call_args[0][0]}
+        output = monitor.measure_database([("a", "b"), ("c", "d")], MagicMock(), profile="py-spy", profile_top=5)
+        self.assertEqual(mock_profiler.call_args[0][2], "py-spy")
+        self.assertEqual(mock_profiler.call_args[1], {"top": 5})
+        self.assertIs(mock_load.call_args[1]["profiler"], profiler)
+        self.assertIs(mock_meta.call_args[1]["profiler"], profiler)
+        self.assertEqual([r["profile"]["directory"] for r in output["load"] + output["meta"]],
+                         ["0-load", "1-load", "0-meta", "1-meta"])
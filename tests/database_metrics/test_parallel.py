@@ -0,0 +1,89 @@
+"""Tests for parallel.py"""
+import unittest
+from unittest.mock import MagicMock, patch
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.parallel'
+
+
+class TestParallel(unittest.TestCase):
+
+    def test_get_cpusets(self):
+        self.assertEqual(get_cpusets(8, 2), ["0-3", "4-7"])
+        self.assertEqual(get_cpusets(8, 3, 2), ["0-1", "2-3", "4-5"])
+        with self.assertRaises(ValueError):
+            get_cpusets(2, 3)
+        with self.assertRaises(ValueError):
+            get_cpusets(8, 2, 5)
+
+    def test_merge_outputs(self):
+        datasets = [("a", "1"), ("a", "2")]
+        outputs = [{"datasets": [d], "queries": ["q"], "append_datasets": False,
+                    "load": [i], "meta": [i], "query0": [i]} for i, d in enumerate(datasets)]
+        self.assertDictEqual(merge_outputs(outputs, datasets),
+                             {"datasets": datasets, "queries": ["q"], "append_datasets": False,
+                              "load": [0, 1], "meta": [0, 1], "query0": [0, 1]})
+
+    def test_merge_outputs_cache_modes(self):
+        datasets = [("a", "1"), ("a", "2")]
+        outputs = [{"datasets": [d], "queries": [{"q": 1}], "append_datasets": False, "cache_modes": ["cold", "hot"],
+                    "load": [{"runtime": i}], "meta": [{"runtime": i}], "query0_cold": [{"runtime": i}],
+                    "query0_hot": [{"runtime": i}]} for i, d in enumerate(datasets)]
+        merged = merge_outputs(outputs, datasets)
+        self.assertEqual(merged["cache_modes"], ["cold", "hot"])
+        self.assertEqual(merged["query0_hot"], [{"runtime": 0}, {"runtime": 1}])
+        connection = store.connect(":memory:")
+        run_id = store.save_run(connection, merged, "abc", {"fingerprint": "host"})
+        rows = connection.execute("SELECT count(*) FROM measurements WHERE run_id = ?", (run_id,)).fetchone()[0]
+        self.assertEqual(rows, 8)
+
+    def test_merge_outputs_overhead(self):
+        datasets = [("a", "1"), ("a", "2")]
+        outputs = [{"datasets": [d], "queries": None, "append_datasets": False, "load": [i], "meta": [i],
+                    "container_overhead": {"startup_s": i}} for i, d in enumerate(datasets)]
+        merged = merge_outputs(outputs, datasets)
+        self.assertEqual(merged["container_overhead"],
+                         {dataset_label(datasets[0]): {"startup_s": 0}, dataset_label(datasets[1]): {"startup_s": 1}})
+
+    @patch("delphi.operations.database_metrics.parallel.wait_for_database")
+    def test_worker(self, mock_wait):
+        mock_client = MagicMock()
+        worker = Worker.new_instance(mock_client, "w0", "db_image", "web_image", "0-1", "2g", "harness")
+        network = mock_client.networks.create.return_value
+        network.connect.assert_any_call(mock_client.containers.create.return_value, aliases=[DB_ALIAS])
+        network.connect.assert_any_call(mock_client.containers.create.return_value, aliases=[WEB_ALIAS])
+        network.connect.assert_any_call("harness")
+        self.assertEqual(mock_client.containers.create.call_args_list[0][1]["mem_limit"], "2g")
+        self.assertIsNone(mock_client.containers.create.call_args_list[0][1]["command"])
+        self.assertEqual(worker.resources, {"cpuset_cpus": "0-1", "mem_limit": "2g"})
+        worker.remove("harness")
+        network.disconnect.assert_called_once_with("harness", force=True)
+        network.remove.assert_called_once()
+
+    @patch("delphi.operations.database_metrics.parallel.wait_for_database")
+    def test_worker_cleans_up(self, mock_wait):
+        mock_client = MagicMock()
+        mock_wait.side_effect = TimeoutError()
+        with self.assertRaises(TimeoutError):
+            Worker.new_instance(mock_client, "w0", "db_image", None, "0-1")
+        mock_client.containers.create.return_value.remove.assert_called_once_with(force=True)
+        mock_client.networks.create.return_value.remove.assert_called_once()
+
+    @patch("delphi.operations.database_metrics.parallel.measure_database")
+    @patch("delphi.operations.database_metrics.parallel.wait_for_database")
+    def test_measure_parallel(self, mock_wait, mock_measure):
+        mock_client = MagicMock()
+        mock_client.info.return_value = {"NCPU": 4}
+        mock_measure.side_effect = lambda datasets, *args, **kwargs: {
+            "datasets": datasets, "queries": None, "append_datasets": False,
+            "load": [datasets[0][1]], "meta": [datasets[0][1]]}
+        datasets = [("a", "1"), ("a", "2"), ("a", "3")]
+        output = measure_parallel(datasets, mock_client, workers=2)
+        self.assertEqual(output["load"], ["1", "2", "3"])
+        self.assertEqual(mock_client.networks.create.call_count, 2)
+        cpusets = {c[1]["container_resources"]["cpuset_cpus"] for c in mock_measure.call_args_list}
+        self.assertTrue(cpusets <= {"0-1", "2-3"})
+        with self.assertRaises(ValueError):
+            measure_parallel(datasets, mock_client, append_datasets=True)
+        with self.assertRaises(ValueError):
+            measure_parallel([], mock_client)
@@ -8,26 +8,127 @@ __test_target__ = 'delphi.operations.database_metrics.parsers'
 class TestParser(unittest.TestCase):
 
     def test_parse_db_size(self):
-        test_query_result = b'db\tsize_mb\nepidata\t7.79687500\ninformation_schema\t0.18750000\n'
+        test_query_result = b'covid\t1.5\nepidata\t7.79687500\ninformation_schema\t0.18750000\n'
         self.assertEqual(parse_db_size(test_query_result), 7.796875)
+        self.assertEqual(parse_db_size(test_query_result, "covid"), 1.5)
+        self.assertDictEqual(parse_db_sizes(test_query_result),
+                             {"covid": 1.5, "epidata": 7.796875, "information_schema": 0.1875})
+        with self.assertRaises(ValueError):
+            parse_db_size(b'information_schema\t0.18750000\n')
 
     def test_parse_db_rows(self):
-        test_query_result = b'count(*)\n1604\n'
-        self.assertEqual(parse_row_count(test_query_result), 1604)
+        self.assertEqual(parse_row_count(b'1604\n'), 1604)
+        with self.assertRaises(ValueError):
+            parse_row_count(b'ERROR 1146 (42S02): Table doesn\'t exist\n')
+
+    def test_parse_batch(self):
+        self.assertEqual(parse_batch(b'a\t1\tNULL\nb\t2\t\\x\n'), [["a", "1", "NULL"], ["b", "2", "\\x"]])
+        self.assertEqual(parse_batch(b''), [])
+
+    def test_samples(self):
+        test_samples = {"time": [10.0, 10.5, 11.0],
+                        "memory_usage": [1024 * 1024, 3 * 1024 * 1024, 2 * 1024 * 1024],
+                        "memory_cache": [0, 1024 * 1024, 1024 * 1024],
+                        "cpu_usage_ns": [0, 1e9, 1.25e9],
+                        "blkio_read_bytes": [1024 * 1024, 2 * 1024 * 1024, 3 * 1024 * 1024],
+                        "blkio_write_bytes": [0, 0, 1024 * 1024]}
+        series = parse_samples(test_samples)
+        self.assertTrue(all(isinstance(v, np.ndarray) for v in series.values()))
+        self.assertDictEqual(
+            {k: v.tolist() for k, v in series.items()},
+            {"time_s": [0, 0.5, 1.0],
+             "memory_mb": [1, 3, 2],
+             "working_set_mb": [1, 2, 1],
+             "cpu_cores": [0, 2.0, 0.5],
+             "read_mb": [0, 1, 2],
+             "write_mb": [0, 0, 1]}
+        )
+        self.assertDictEqual(
+            summarize_samples(test_samples),
+            {"peak_memory_mb": 3, "peak_working_set_mb": 2, "avg_cpu_cores": 1.25,
+             "read_bytes": 2 * 1024 * 1024, "written_bytes": 1024 * 1024}
+        )
 
     def test_metrics(self):
+        test_samples = {"time": [0, 1], "memory_usage": [3, 4], "cpu_usage_ns": [0, 0]}
         test_metrics = (100.5,
                         120,
                         10,
                         25,
                         1,
-                        [{"memory_stats": {"usage": 3}}, {"memory_stats": {"usage": 4}}])
+                        test_samples)
+        output = parse_metrics(test_metrics)
+        self.assertEqual(output.pop("samples")["memory_mb"].tolist(), parse_samples(test_samples)["memory_mb"].tolist())
         self.assertDictEqual(
-            parse_metrics(test_metrics),
+            output,
             {"final_table_rows": 25,
              "rows_loaded": 15,
              "db_size_mb": 120,
              "size_loaded_mb": 19.5,
              "runtime": 1,
-             "peak_memory_mb": 4/1024/1024}
+             "peak_memory_mb": 4/1024/1024,
+             "peak_working_set_mb": 4/1024/1024,
+             "avg_cpu_cores": 0,
+             "read_bytes": 0,
+             "written_bytes": 0}
         )
+
+    def test_metrics_response(self):
+        test_samples = {"time": [0, 1], "memory_usage": [3, 4], "cpu_usage_ns": [0, 0]}
+        response = {"status": 200, "ttfb": 0.25, "total": 0.5, "bytes": 10, "rows": 1, "complete": True,
+                    "error": None}
+        output = parse_metrics((1, 1, 5, 5, 0.6, test_samples, {}, response))
+        self.assertEqual(output["ttfb"], 0.25)
+        self.assertEqual(output["response"], response)
+        self.assertNotIn("ttfb", parse_metrics((1, 1, 5, 5, 0.6, test_samples, {})))
+
+    def test_metrics_sampling_errors(self):
+        test_samples = {"time": [0, 1], "memory_usage": [3, 4], "cpu_usage_ns": [0, 0]}
+        db_samples = {"time": [0.5], "rows": [10], "error": "OperationalError: Lost connection"}
+        output = parse_metrics((1, 1, 5, 5, 0.6, dict(test_samples, error="StopIteration"), db_samples))
+        self.assertEqual(output["samples_error"], "StopIteration")
+        self.assertEqual(output["db_samples_error"], "OperationalError: Lost connection")
+        self.assertEqual(output["db_samples"]["rows"], [10])
+        self.assertNotIn("samples_error", parse_metrics((1, 1, 5, 5, 0.6, test_samples, {})))
+
+    def test_bootstrap_ci(self):
+        low, high = bootstrap_ci([1, 2, 3, 4, 5, 6, 7, 8, 9])
+        self.assertLessEqual(low, 5)
+        self.assertGreaterEqual(high, 5)
+        self.assertEqual(bootstrap_ci([2, 2, 2]), (2, 2))
+        self.assertEqual(bootstrap_ci([1, 5, 9], seed=3), bootstrap_ci([1, 5, 9], seed=3))
+
+    def test_summarize_trials(self):
+        trials = [{"runtime": r, "peak_memory_mb": 10, "size_loaded_mb": 1, "rows_loaded": 5, "samples": r}
+                  for r in [1.0, 1.2, 0.9, 1.1, 5.0]]
+        output = summarize_trials(trials)
+        self.assertEqual(output["runtime"], 1.1)
+        self.assertEqual(output["samples"], 1.1)
+        self.assertEqual(output["outliers"], [4])
+        self.assertEqual([t["outlier"] for t in output["trials"]], [False, False, False, False, True])
+        self.assertAlmostEqual(output["stats"]["runtime"]["median"], 1.1)
+        self.assertAlmostEqual(output["stats"]["runtime"]["iqr"], 0.2)
+        self.assertEqual(output["stats"]["peak_memory_mb"]["ci_low"], 10)
+        self.assertNotIn("outlier", output)
+
+    def test_parse_db_samples(self):
+        test_samples = {"time": [10.0, 12.0], "rows": [0, 200], "db_size_mb": [1, 3],
+                        "Innodb_rows_inserted": [100, 300], "Innodb_buffer_pool_read_requests": [50, 150],
+                        "Innodb_buffer_pool_reads": [5, 15]}
+        series = parse_db_samples(test_samples, 9.0)
+        self.assertEqual(series["time_s"], [1.0, 3.0])
+        self.assertEqual(series["rows"], [0, 200])
+        self.assertEqual(series["rows_per_s"], [None, 100])
+        self.assertEqual(series["buffer_pool_hit_rate"], [None, 0.9])
+        self.assertEqual(series["Innodb_rows_inserted"], [100, 300])
+
+    def test_to_timeseries(self):
+        result = {"samples": {"time_s": [0, 1.0, 2.0], "memory_mb": [1, 2, 3], "cpu_cores": [0, 1, 1]},
+                  "db_samples": {"time_s": [0.1, 1.9], "rows": [0, 10], "rows_per_s": [None, 5]}}
+        frame = to_timeseries(result)
+        self.assertEqual(list(frame.columns), ["time_s", "metric", "value"])
+        memory = frame[frame.metric == "memory_mb"]
+        self.assertEqual(list(memory.time_s), [0.1, 1.9])
+        self.assertEqual(list(memory.value), [1, 3])
+        self.assertEqual(len(frame[frame.metric == "rows_per_s"]), 1)
+        self.assertEqual(len(to_timeseries({"samples": result["samples"]})), 6)
@@ -0,0 +1,69 @@
+"""Tests for plans.py"""
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.plans'
+
+PLAN = {"query_block": {"select_id": 1,
+                        "table": {"table_name": "t", "access_type": "range", "key": "by_time",
+                                  "possible_keys": ["by_time"], "rows": 100, "r_rows": 80}}}
+
+
+class TestPlans(unittest.TestCase):
+
+    def test_query_to_sql(self):
+        sql = query_to_sql({"source": "covidcast", "data_source": "usa-facts", "signal": "a,b", "time_type": "day",
+                            "geo_type": "county", "time_values": "20200301-20200501,20200601", "geo_value": "*"})
+        self.assertIn("t.`source` = 'usa-facts'", sql)
+        self.assertIn("t.`signal` IN ('a', 'b')", sql)
+        self.assertIn("((t.`time_value` BETWEEN 20200301 AND 20200501) OR t.`time_value` = 20200601)", sql)
+        self.assertIn("t.`is_latest_issue` IS TRUE", sql)
+        self.assertNotIn("geo_value` IN", sql)
+        sql = query_to_sql({"data_source": "x'y", "signal": "a", "time_type": "day", "geo_type": "state",
+                            "time_values": "20200301", "geo_value": "pa", "as_of": 20200401})
+        self.assertIn("'x\\'y'", sql)
+        self.assertIn("t.`geo_value` IN ('pa')", sql)
+        self.assertIn("`issue` <= 20200401", sql)
+        self.assertNotIn("is_latest_issue", sql)
+
+    @patch("delphi.operations.database_metrics.plans._run_sql")
+    def test_capture_sql(self, mock_run_sql):
+        mock_run_sql.return_value = b"SELECT 1 FROM covidcast\n"
+        run = MagicMock()
+        self.assertEqual(capture_sql(MagicMock(), run), ["SELECT 1 FROM covidcast"])
+        run.assert_called_once()
+        self.assertIn("general_log = 0", mock_run_sql.call_args_list[1][0][1])
+
+    @patch("delphi.operations.database_metrics.plans._run_sql")
+    def test_explain(self, mock_run_sql):
+        mock_run_sql.return_value = json.dumps(PLAN, indent=2).encode()
+        self.assertDictEqual(explain(MagicMock(), "SELECT 1", analyze=True), PLAN)
+        self.assertTrue(mock_run_sql.call_args[0][1].startswith("ANALYZE FORMAT=JSON SELECT 1"))
+
+    def test_summarize_plan(self):
+        summary = summarize_plan(PLAN)
+        self.assertEqual(summary["rows_examined"], 80)
+        self.assertTrue(summary["uses_index"])
+        self.assertEqual(summary["tables"][0]["key"], "by_time")
+        full_scan = {"query_block": {"table": {"table_name": "t", "access_type": "ALL", "rows": 100}}}
+        other = summarize_plan(full_scan)
+        self.assertFalse(other["uses_index"])
+        self.assertEqual(other["rows_examined"], 100)
+        self.assertNotEqual(other["fingerprint"], summary["fingerprint"])
+
+    @patch("delphi.operations.database_metrics.plans.explain")
+    @patch("delphi.operations.database_metrics.plans.capture_sql")
+    def test_capture_plan(self, mock_capture, mock_explain):
+        mock_explain.return_value = PLAN
+        params = {"data_source": "a", "signal": "b", "time_type": "day", "geo_type": "state",
+                  "time_values": "20200301"}
+        plan = capture_plan(MagicMock(), params)
+        self.assertEqual(plan["statements"][0]["sql"], query_to_sql(params))
+        self.assertEqual(plan["rows_examined"], 80)
+        mock_capture.assert_not_called()
+        mock_capture.return_value = ["SELECT 1", "SELECT 2"]
+        plan = capture_plan(MagicMock(), params, run=MagicMock())
+        self.assertEqual([s["sql"] for s in plan["statements"]], ["SELECT 1", "SELECT 2"])
+        self.assertEqual(plan["rows_examined"], 160)
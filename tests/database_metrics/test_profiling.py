@@ -0,0 +1,88 @@
+"""Tests for profiling.py"""
+import cProfile
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.profiling'
+
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_summarize_pstats(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i in range(2):
+                profile = cProfile.Profile()
+                profile.runcall(busy, 100000)
+                paths.append(os.path.join(tmp, f"{i}.pstats"))
+                profile.dump_stats(paths[-1])
+            hot_spots = summarize_pstats(paths, top=3)
+            busy_calls = [h for h in summarize_pstats(paths) if h["function"].endswith("(busy)")]
+        self.assertEqual(len(hot_spots), 3)
+        self.assertEqual(sorted(hot_spots[0]), ["calls", "cumulative_fraction", "cumulative_s", "function",
+                                                "self_fraction", "self_s"])
+        self.assertGreaterEqual(hot_spots[0]["self_s"], hot_spots[1]["self_s"])
+        self.assertEqual(busy_calls[0]["calls"], 2)
+        self.assertGreater(busy_calls[0]["cumulative_fraction"], 0.9)
+
+    def test_summarize_stacks(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "0.txt")
+            with open(path, "w") as f:
+                f.write("main (a.py:1);load (a.py:5);parse (b.py:9) 6\n"
+                        "main (a.py:1);load (a.py:5);insert (c.py:3) 3\n"
+                        "main (a.py:1) 1\n")
+            hot_spots = summarize_stacks([path, path], top=2)
+        self.assertEqual([h["function"] for h in hot_spots], ["parse (b.py:9)", "insert (c.py:3)"])
+        self.assertEqual(hot_spots[0]["self_samples"], 12)
+        self.assertAlmostEqual(hot_spots[0]["self_fraction"], 0.6)
+        self.assertAlmostEqual(hot_spots[1]["cumulative_fraction"], 0.3)
+
+    def test_summarize_directory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertEqual(summarize_directory(tmp), {"directory": tmp, "files": [], "hot_spots": []})
+            open(os.path.join(tmp, "empty.pstats"), "w").close()
+            profile = cProfile.Profile()
+            profile.runcall(busy, 10)
+            profile.dump_stats(os.path.join(tmp, "run.pstats"))
+            with open(os.path.join(tmp, "run.txt"), "w") as f:
+                f.write("main (a.py:1) 1\n")
+            output = summarize_directory(tmp)
+        self.assertEqual(output["files"], ["run.pstats"])
+        self.assertTrue(any(h["function"].endswith("(busy)") for h in output["hot_spots"]))
+
+    def test_profiler(self):
+        client = MagicMock()
+        with self.assertRaises(ValueError):
+            Profiler(client, "image", "perf")
+        profiler = Profiler.new_instance(client, "image", run="run1", top=5)
+        with self.assertRaises(RuntimeError):
+            profiler.command("module")
+        self.assertEqual(profiler.start("0-usa-facts:2020*"), "/profiles/run1/0-usa-facts_2020_")
+        self.assertEqual(profiler.command("module"),
+                         "mkdir -p /profiles/run1/0-usa-facts_2020_ && python3 -m cProfile -o "
+                         "$(mktemp -p /profiles/run1/0-usa-facts_2020_ --suffix=.pstats) -m module")
+        self.assertEqual(profiler.options, {})
+
+        summary = {"directory": profiler.directory, "files": ["a.pstats"], "hot_spots": []}
+        client.containers.run.return_value = b"a warning\n" + json.dumps(summary).encode() + b"\n"
+        self.assertEqual(profiler.collect(), summary)
+        kwargs = client.containers.run.call_args[1]
+        self.assertEqual(kwargs["command"][-3:], [profiler.directory, "--top", "5"])
+        self.assertEqual(kwargs["volumes"], {"delphi_metrics_profiles": {"bind": "/profiles", "mode": "rw"}})
+
+        py_spy = Profiler(client, "image", "py-spy", run="run1")
+        py_spy.start("1-meta")
+        self.assertIn("py-spy record --format raw --output $(mktemp -p /profiles/run1/1-meta --suffix=.txt) "
+                      "-- python3 -m module", py_spy.command("module"))
+        self.assertEqual(py_spy.options, {"cap_add": ["SYS_PTRACE"]})
+        # profilers created in the same second, e.g. by parallel workers, write to different directories
+        self.assertNotEqual(Profiler(client, "image").run, Profiler(client, "image").run)
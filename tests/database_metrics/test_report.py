@@ -0,0 +1,103 @@
+"""Tests for report.py"""
+import importlib.util
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.report'
+
+
+def result(runtime, rows=1000, samples=3, **kwargs):
+    time_s = list(np.arange(samples) * 0.1)
+    return dict({"runtime": runtime, "rows_loaded": rows, "final_table_rows": rows, "db_size_mb": 10.0,
+                 "peak_working_set_mb": 100.0,
+                 "samples": {"time_s": time_s, "memory_mb": [200.0] * samples, "working_set_mb": [100.0] * samples,
+                             "cpu_cores": [1.0] * samples, "read_mb": [0.0] * samples, "write_mb": [0.0] * samples}},
+                **kwargs)
+
+
+def output(scale):
+    trials = [result(t * scale) for t in [1.0, 1.1, 0.9]]
+    return {"datasets": [["src", "a"], ["src", "b"]], "queries": [{"q": 1}], "append_datasets": False,
+            "load": [result(10 * scale, samples=5), result(20 * scale, samples=7)],
+            "meta": [result(1.0, rows=0), result(1.0, rows=0)],
+            "query0": [dict(trials[0], trials=trials), result(0.5 * scale)]}
+
+
+class TestReport(unittest.TestCase):
+
+    def test_load_results(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, "run.json"), os.path.join(tmp, "sub", "run.json")]
+            os.mkdir(os.path.join(tmp, "sub"))
+            for path in paths:
+                with open(path, "w") as f:
+                    json.dump(output(1), f)
+            self.assertEqual(list(load_results(paths)), ["run", "run#2"])
+
+    def test_trials_frame(self):
+        trials = trials_frame({"base": output(1), "new": output(2)})
+        self.assertEqual(len(trials), 2 * (2 + 2 + 3 + 1))
+        self.assertEqual(list(trials["dataset"].unique()), ["src:a", "src:b"])
+        loads = trials[trials["operation"] == "load"]
+        self.assertEqual(loads["rows_per_s"].tolist(), [100, 50, 50, 25])
+        self.assertTrue(trials[trials["operation"] == "meta"]["rows_per_s"].isna().all())
+        self.assertTrue(trials["ttfb"].isna().all())
+
+    def test_samples_frame(self):
+        samples = samples_frame({"base": output(1), "new": output(2)})
+        self.assertEqual(len(samples), 2 * (5 + 7 + 3 + 3 + 3 + 3))
+        self.assertEqual(str(samples["run"].dtype), "category")
+        first = samples[(samples["run"] == "new") & (samples["dataset"] == "src:b") & (samples["operation"] == "load")]
+        self.assertEqual(len(first), 7)
+        self.assertAlmostEqual(first["time_s"].max(), 0.6)
+        self.assertEqual(len(downsample(samples, max_points=2)), 2 * 6 * 2)
+        self.assertEqual(len(samples_frame({"empty": dict(output(1), load=[{}, {}], meta=[{}, {}],
+                                                          query0=[{}, {}])})), 0)
+
+    def test_summary_and_comparison(self):
+        trials = trials_frame({"base": output(1), "new": output(2)})
+        summary = summary_table(trials)
+        self.assertEqual(summary.loc[("new", "src:a", "query0"), "trials"], 3)
+        self.assertAlmostEqual(summary.loc[("new", "src:a", "query0"), "runtime"], 2.0)
+        comparison = compare_to_baseline(trials, "base", threshold=0.1)
+        self.assertEqual(set(comparison["run"]), {"new"})
+        load = comparison[(comparison["operation"] == "load") & (comparison["dataset"] == "src:a")]
+        self.assertEqual(dict(zip(load["stat"], load["change"])),
+                         {"runtime": 1.0, "peak_working_set_mb": 0.0, "db_size_mb": 0.0, "rows_per_s": -0.5})
+        self.assertEqual(dict(zip(load["stat"], load["regression"])),
+                         {"runtime": True, "peak_working_set_mb": False, "db_size_mb": False, "rows_per_s": True})
+        self.assertFalse(comparison[comparison["operation"] == "meta"]["regression"].any())
+
+    def test_render_report(self):
+        outputs = {"base": output(1), "new": output(2)}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "report.md")
+            comparison = render_report(outputs, path, "base", plots=False)
+            with open(path) as f:
+                text = f.read()
+            self.assertTrue(comparison["regression"].any())
+            self.assertIn("## Summary", text)
+            self.assertIn("against base.", text)
+            self.assertIn("| **new** | **src:a** | **load** | **runtime** |", text)
+            path = os.path.join(tmp, "report.html")
+            render_report(outputs, path, plots=False)
+            with open(path) as f:
+                text = f.read()
+            self.assertIn("<h2>Summary</h2>", text)
+            self.assertNotIn("class=\"regression\"", text)
+
+    @unittest.skipUnless(importlib.util.find_spec("matplotlib"), "plots need matplotlib")
+    def test_render_plots(self):
+        outputs = {"base": output(1), "new": output(2)}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "report.html")
+            render_report(outputs, path, "base")
+            self.assertEqual(sorted(os.listdir(os.path.join(tmp, "report_files"))),
+                             sorted(f"{p}.png" for p in PLOTS))
+            with open(path) as f:
+                self.assertIn('<img src="report_files/latency.png"', f.read())
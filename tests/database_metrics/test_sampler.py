@@ -0,0 +1,128 @@
+"""Tests for sampler.py"""
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.sampler'
+
+
+class TestSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, path, text):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(text)
+
+    def test_reduce_docker_stat(self):
+        test_stat = {"memory_stats": {"usage": 100, "stats": {"total_inactive_file": 40, "cache": 60}},
+                     "cpu_stats": {"cpu_usage": {"total_usage": 2000}},
+                     "blkio_stats": {"io_service_bytes_recursive": [{"major": 8, "op": "Read", "value": 10},
+                                                                     {"major": 8, "op": "Write", "value": 20},
+                                                                     {"major": 8, "op": "Total", "value": 30},
+                                                                     {"major": 9, "op": "read", "value": 5}]},
+                     "networks": {}}
+        self.assertDictEqual(reduce_docker_stat(test_stat),
+                             {"memory_usage": 100, "memory_cache": 40, "cpu_usage_ns": 2000,
+                              "blkio_read_bytes": 15, "blkio_write_bytes": 20})
+        self.assertDictEqual(reduce_docker_stat({"blkio_stats": {"io_service_bytes_recursive": None}}),
+                             {"memory_usage": 0, "memory_cache": 0, "cpu_usage_ns": 0,
+                              "blkio_read_bytes": 0, "blkio_write_bytes": 0})
+
+    def test_cgroup_v1(self):
+        self._write("memory/docker/abc/memory.usage_in_bytes", "4096\n")
+        self._write("cpuacct/docker/abc/cpuacct.usage", "123456\n")
+        source = CgroupSource.find("abc", self.root)
+        self.assertDictEqual(source.read(), {"memory_usage": 4096, "memory_cache": 0, "cpu_usage_ns": 123456,
+                                             "blkio_read_bytes": 0, "blkio_write_bytes": 0})
+        self._write("memory/docker/abc/memory.stat", "cache 2048\ntotal_inactive_file 1024\n")
+        self._write("blkio/docker/abc/blkio.throttle.io_service_bytes",
+                    "8:0 Read 100\n8:0 Write 200\n8:0 Total 300\n8:16 Read 1\nTotal 301\n")
+        source = CgroupSource.find("abc", self.root)
+        self.assertDictEqual(source.read(), {"memory_usage": 4096, "memory_cache": 1024, "cpu_usage_ns": 123456,
+                                             "blkio_read_bytes": 101, "blkio_write_bytes": 200})
+        self.assertIsNone(CgroupSource.find("def", self.root))
+
+    def test_cgroup_v2(self):
+        self._write("cgroup.controllers", "cpu memory\n")
+        self._write("system.slice/docker-abc.scope/memory.current", "8192\n")
+        self._write("system.slice/docker-abc.scope/cpu.stat", "usage_usec 50\nuser_usec 30\n")
+        self._write("system.slice/docker-abc.scope/memory.stat", "file 4096\ninactive_file 2048\n")
+        self._write("system.slice/docker-abc.scope/io.stat",
+                    "8:0 rbytes=100 wbytes=200 rios=1 wios=2\n8:16 rbytes=1 wbytes=0 rios=1 wios=0\n")
+        source = CgroupSource.find("abc", self.root)
+        self.assertDictEqual(source.read(), {"memory_usage": 8192, "memory_cache": 2048, "cpu_usage_ns": 50000,
+                                             "blkio_read_bytes": 101, "blkio_write_bytes": 200})
+        self.assertIsNone(CgroupSource.find("def", self.root))
+
+    def test_get_source(self):
+        mock_container = MagicMock()
+        mock_container.id = "abc"
+        self.assertIsInstance(get_source(mock_container, self.root), StatsStreamSource)
+        self._write("memory/docker/abc/memory.usage_in_bytes", "4096\n")
+        self._write("cpuacct/docker/abc/cpuacct.usage", "123456\n")
+        self.assertIsInstance(get_source(mock_container, self.root), CgroupSource)
+
+    def test_container_sampler(self):
+        mock_source = MagicMock()
+        mock_source.read.side_effect = lambda: {"memory_usage": 1, "cpu_usage_ns": 0}
+        sampler = ContainerSampler(mock_source, interval=0.001)
+        sampler.start()
+        while len(sampler.samples) < 3:
+            pass
+        samples = sampler.stop()
+        self.assertGreaterEqual(len(samples["time"]), 3)
+        self.assertEqual(sorted(samples), ["cpu_usage_ns", "memory_usage", "time"])
+        self.assertTrue((samples["time"][1:] >= samples["time"][:-1]).all())
+        mock_source.close.assert_called_once()
+
+    def test_container_sampler_stream_ends(self):
+        mock_source = MagicMock()
+        mock_source.read.side_effect = [{"memory_usage": 1, "cpu_usage_ns": 0}, StopIteration()]
+        sampler = ContainerSampler(mock_source, interval=0)
+        sampler.start()
+        self.assertEqual(len(sampler.stop()["time"]), 1)
+        self.assertEqual(sampler.error, "StopIteration")
+
+    def test_container_sampler_database_error(self):
+        class ConnectionLost(Exception):
+            pass
+
+        mock_probe = MagicMock(errors=(ConnectionLost,))
+        mock_probe.global_status.side_effect = [{}, ConnectionLost("Lost connection to MySQL server")]
+        sampler = ContainerSampler(DatabaseSource(mock_probe, ["Questions"]), interval=0)
+        sampler.start()
+        self.assertEqual(len(sampler.stop()["time"]), 1)
+        self.assertEqual(sampler.error, "ConnectionLost: Lost connection to MySQL server")
+
+    def test_sample_columns(self):
+        columns = SampleColumns()
+        columns.append({"a": 1, "b": 2})
+        columns.append({"a": 3, "b": None, "c": 4})
+        columns.append({"a": 5})
+        self.assertEqual(len(columns), 3)
+        arrays = columns.to_arrays()
+        self.assertEqual(sorted(arrays), ["a", "b"])
+        self.assertEqual(arrays["a"].tolist(), [1, 3, 5])
+        self.assertEqual(arrays["b"][0], 2)
+        self.assertTrue(all(v != v for v in arrays["b"][1:]))
+
+    def test_database_source(self):
+        mock_probe = MagicMock()
+        mock_probe.covidcast_rows.return_value = 10
+        mock_probe.db_size_mb.return_value = 2.5
+        mock_probe.global_status.return_value = {"Questions": 3}
+        source = DatabaseSource(mock_probe, ["Questions"])
+        self.assertDictEqual(source.read(), {"rows": 10, "db_size_mb": 2.5, "Questions": 3})
+        mock_probe.global_status.assert_called_once_with(["Questions"])
+        source.close()
+        mock_probe.close.assert_not_called()
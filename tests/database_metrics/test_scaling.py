@@ -0,0 +1,52 @@
+"""Tests for scaling.py"""
+import unittest
+from unittest.mock import MagicMock, patch
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.scaling'
+
+
+def make_output():
+    rows = [1000, 2000, 4000, 8000]
+    return {"datasets": [("s", str(i)) for i in range(4)],
+            "load": [{"final_table_rows": r, "rows_loaded": 1000, "runtime": 1e-3 * r ** 0.5 * 1000} for r in rows],
+            "meta": [{"final_table_rows": r, "runtime": 2e-3 * r} for r in rows],
+            "query0": [{"final_table_rows": r, "runtime": 0.5} for r in rows],
+            "queries": [{}]}
+
+
+class TestScaling(unittest.TestCase):
+
+    def test_fit_power_law(self):
+        fit = fit_power_law([1, 10, 100], [3, 30, 300])
+        self.assertAlmostEqual(fit["exponent"], 1)
+        self.assertAlmostEqual(fit["coefficient"], 3)
+        self.assertAlmostEqual(fit["r2"], 1)
+        self.assertAlmostEqual(predict(fit, 1000), 3000)
+        fit = fit_power_law([0, 10, 10], [1, 2, 3])
+        self.assertIsNone(fit["exponent"])
+        self.assertIsNone(predict(fit, 10))
+
+    def test_fit_scaling(self):
+        report = fit_scaling(make_output(), production_rows=[16000], window_s=2)
+        self.assertEqual(sorted(report), ["load", "meta", "query0"])
+        self.assertAlmostEqual(report["load"]["exponent"], 0.5)
+        self.assertAlmostEqual(report["meta"]["exponent"], 1)
+        self.assertAlmostEqual(report["query0"]["exponent"], 0)
+        load = report["load"]["predictions"][0]
+        self.assertAlmostEqual(load["batch_s"], 1e-3 * 16000 ** 0.5 * 1000)
+        self.assertAlmostEqual(load["rows_per_s"], 1000 / load["batch_s"])
+        self.assertTrue(load["fits_window"] is False)
+        self.assertAlmostEqual(report["meta"]["predictions"][0]["runtime"], 32)
+        text = format_scaling(report)
+        self.assertIn("load: per row loaded ~ rows^0.50", text)
+        self.assertIn("EXCEEDS WINDOW", text)
+
+    @patch("delphi.operations.database_metrics.scaling.measure_database")
+    def test_measure_scaling(self, mock_measure):
+        mock_measure.return_value = make_output()
+        output = measure_scaling("usa-facts", ["202003*", "202004*"], MagicMock(), clear_cache=False)
+        datasets = mock_measure.call_args[0][0]
+        self.assertEqual(datasets, [("usa-facts", "202003*"), ("usa-facts", "202004*")])
+        self.assertTrue(mock_measure.call_args[1]["append_datasets"])
+        self.assertIn("scaling", output)
@@ -0,0 +1,94 @@
+"""Tests for store.py"""
+import unittest
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.store'
+
+HOST = {"fingerprint": "abc123"}
+
+
+def make_output(runtimes, size=1.0):
+    def result(runtime):
+        return {"runtime": runtime, "peak_memory_mb": 10, "size_loaded_mb": size, "rows_loaded": 5,
+                "final_table_rows": 5, "db_size_mb": 2}
+
+    def trials(values):
+        return {"trials": [dict(result(r), outlier=False) for r in values]} if len(values) > 1 else result(values[0])
+
+    return {"datasets": [("usa-facts", "2020*")], "queries": [{"signal": "a"}], "append_datasets": False,
+            "load": [trials(runtimes)], "meta": [trials(runtimes)], "query0": [trials(runtimes)]}
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = connect(":memory:")
+
+    def test_get_host_info(self):
+        info = get_host_info()
+        self.assertEqual(len(info["fingerprint"]), 12)
+        self.assertEqual(get_host_info()["fingerprint"], info["fingerprint"])
+
+    def test_save_and_list_runs(self):
+        run_id = save_run(self.connection, make_output([1, 2, 3]), "deadbeef", HOST)
+        save_run(self.connection, make_output([1]), "cafef00d", HOST)
+        runs = list_runs(self.connection)
+        self.assertEqual([r["measurements"] for r in runs], [9, 3])
+        self.assertEqual(runs[0]["host"], "abc123")
+        keys = {(r["dataset"], r["operation"], r["query"]) for r in
+                self.connection.execute("SELECT * FROM measurements WHERE run_id = ?", (run_id,))}
+        self.assertIn(("usa-facts:2020*", "query0", '{"signal": "a"}'), keys)
+
+    def test_iter_and_flatten_results(self):
+        output = dict(make_output([1, 2]), cache_modes=["cold"], query0_cold=make_output([3])["query0"])
+        self.assertEqual([r[1] for r in iter_results(output)], ["load", "meta", "query0_cold"])
+        flat = flatten_results(output)
+        self.assertEqual([(r[1], r[3]) for r in flat], [("load", 0), ("load", 1), ("meta", 0), ("meta", 1),
+                                                         ("query0_cold", 0)])
+        self.assertEqual(flat[-1][2], '{"signal": "a"}')
+
+    def test_synthetic_dataset_label(self):
+        output = make_output([1])
+        output["datasets"] = [{"type": "synthetic", "name": "small"}]
+        save_run(self.connection, output, "a", HOST)
+        datasets = {r["dataset"] for r in self.connection.execute("SELECT dataset FROM measurements")}
+        self.assertEqual(datasets, {"small"})
+
+    def test_resolve_run(self):
+        save_run(self.connection, make_output([1]), "deadbeef", HOST)
+        save_run(self.connection, make_output([1]), "deadbeef", HOST)
+        self.assertEqual(resolve_run(self.connection, "1"), 1)
+        self.assertEqual(resolve_run(self.connection, "latest"), 2)
+        self.assertEqual(resolve_run(self.connection, "dead"), 2)
+        with self.assertRaises(ValueError):
+            resolve_run(self.connection, "feed")
+
+    def test_compare_runs(self):
+        baseline = save_run(self.connection, make_output([1.0, 1.01, 0.99, 1.0]), "a", HOST)
+        candidate = save_run(self.connection, make_output([1.5, 1.52, 1.49, 1.5], size=1.0), "b", HOST)
+        comparison = compare_runs(self.connection, baseline, candidate)
+        runtime = [c for c in comparison if c["stat"] == "runtime"]
+        self.assertEqual(len(runtime), 3)
+        self.assertTrue(all(c["regression"] for c in runtime))
+        self.assertAlmostEqual(runtime[0]["change"], 0.5)
+        size = [c for c in comparison if c["stat"] == "size_loaded_mb"]
+        self.assertFalse(any(c["significant"] for c in size))
+        self.assertIn("!!", format_comparison(comparison))
+
+    def test_compare_single_trials(self):
+        baseline = save_run(self.connection, make_output([1.0]), "a", HOST)
+        candidate = save_run(self.connection, make_output([2.0]), "b", HOST)
+        comparison = compare_runs(self.connection, baseline, candidate)
+        self.assertFalse(any(c["significant"] for c in comparison))
+        self.assertIsNone(comparison[0]["ci_low"])
+
+    def test_compare_plans(self):
+        before = make_output([1.0, 1.0])
+        before["query0"][0]["plan"] = {"fingerprint": "aaa", "rows_examined": 10}
+        after = make_output([1.0, 1.0])
+        after["query0"][0]["plan"] = {"fingerprint": "bbb", "rows_examined": 1000}
+        comparison = compare_runs(self.connection, save_run(self.connection, before, "a", HOST),
+                                  save_run(self.connection, after, "b", HOST))
+        changed = {c["operation"]: c["plan_changed"] for c in comparison}
+        self.assertEqual(changed, {"load": None, "meta": None, "query0": True})
+        self.assertIn("plan changed", format_comparison(comparison))
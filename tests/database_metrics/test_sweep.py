@@ -0,0 +1,105 @@
+"""Tests for sweep.py"""
+import unittest
+from unittest.mock import MagicMock, patch
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.sweep'
+
+
+def fake_output(load_s, query_s):
+    return {"datasets": [("a", "1")], "queries": [{}],
+            "load": [{"runtime": load_s, "rows_loaded": 1000}], "meta": [{"runtime": 1, "db_size_mb": 50.0}],
+            "query0": [{"runtime": query_s[0], "trials": [{"runtime": q} for q in query_s]}]}
+
+
+class TestSweep(unittest.TestCase):
+
+    def test_expand_grid(self):
+        grid = {"innodb_buffer_pool_size": ["128M", "1G"], "innodb_flush_log_at_trx_commit": [1, 2],
+                "sync_binlog": 0}
+        configs = expand_grid(grid)
+        self.assertEqual(len(configs), 4)
+        self.assertEqual(configs[1], {"innodb_buffer_pool_size": "128M", "innodb_flush_log_at_trx_commit": 2,
+                                      "sync_binlog": 0})
+        self.assertEqual(expand_grid({}), [{}])
+        self.assertEqual(config_name(configs[1]),
+                         "innodb_buffer_pool_size=128M,innodb_flush_log_at_trx_commit=2,sync_binlog=0")
+        self.assertEqual(config_name({}), "default")
+        self.assertEqual(server_options({"innodb_buffer_pool_size": "1G"}), ["--innodb_buffer_pool_size=1G"])
+
+    def test_get_variables(self):
+        container = MagicMock()
+        container.exec_run.return_value = MagicMock(
+            exit_code=0, output=(b"innodb_buffer_pool_size\t1073741824\n", None))
+        self.assertEqual(get_variables(container, ["innodb_buffer_pool_size"]),
+                         {"innodb_buffer_pool_size": "1073741824"})
+        self.assertIn("IN ('innodb_buffer_pool_size')", container.exec_run.call_args[0][0][-1])
+        self.assertEqual(get_variables(container, []), {})
+        container.exec_run.return_value = MagicMock(exit_code=1, output=(None, b"ERROR\n"))
+        with self.assertRaises(RuntimeError):
+            get_variables(container, ["x"])
+
+    def test_summarize_config(self):
+        summary = summarize_config(fake_output(4.0, [float(i) for i in range(1, 21)]))
+        self.assertEqual(summary["rows_per_s"], 250)
+        self.assertEqual(list(summary["query_p95_s"]), ["a:1 query0"])
+        self.assertAlmostEqual(summary["query_p95_s"]["a:1 query0"], 19.05)
+        self.assertEqual(summary["db_size_mb"], 50.0)
+        # each query and cache mode gets its own p95, rather than a slow query's trials setting everyone's
+        output = dict(fake_output(4.0, [1.0, 2.0]), queries=[{}, {}], cache_modes=["cold"],
+                      query0_cold=[{"runtime": 1, "trials": [{"runtime": 1}, {"runtime": 2}]}],
+                      query1_cold=[{"runtime": 100, "trials": [{"runtime": 100}, {"runtime": 100}]}])
+        self.assertEqual(summarize_config(output)["query_p95_s"], {"a:1 query0_cold": 1.95, "a:1 query1_cold": 100})
+        # a query whose runs all failed has no p95
+        output["query1_cold"] = [{"failed_trials": [{"error": "HTTP 500"}]}]
+        self.assertEqual(summarize_config(output)["query_p95_s"], {"a:1 query0_cold": 1.95})
+        summary = summarize_config(dict(fake_output(0, [1]), queries=None))
+        self.assertIsNone(summary["rows_per_s"])
+        self.assertIsNone(summary["query_p95_s"])
+
+    def test_query_ratios(self):
+        ratios = query_ratios({"a": {"query_p95_s": {"q0": 1.0, "q1": 40.0}},
+                               "b": {"query_p95_s": {"q0": 4.0, "q1": 10.0, "q2": 1.0}},
+                               "c": {"query_p95_s": None}})
+        # q2 isn't shared, and a is 4x slower on q1 where b is 4x slower on q0
+        self.assertAlmostEqual(ratios["a"], 2.0)
+        self.assertAlmostEqual(ratios["b"], 2.0)
+        self.assertIsNone(ratios["c"])
+
+    def test_rank_configs(self):
+        ranking = rank_configs({"slow": {"rows_per_s": 100, "query_p95_s": {"q0": 2.0, "q1": 20.0}, "db_size_mb": 1.0},
+                                "fast_load": {"rows_per_s": 300, "query_p95_s": {"q0": 1.5, "q1": 15.0},
+                                              "db_size_mb": 1.0},
+                                "fast_query": {"rows_per_s": 200, "query_p95_s": {"q0": 0.5, "q1": 10.0},
+                                               "db_size_mb": 1.0},
+                                "no_queries": {"rows_per_s": 400, "query_p95_s": None, "db_size_mb": None}})
+        self.assertEqual([r["config"] for r in ranking], ["fast_load", "fast_query", "no_queries", "slow"])
+        self.assertEqual([(r["throughput_rank"], r["p95_rank"]) for r in ranking],
+                         [(2, 2), (3, 1), (1, 4), (4, 3)])
+        self.assertEqual([r["rank"] for r in ranking], [1, 2, 3, 4])
+        self.assertEqual(ranking[1]["query_p95_ratio"], 1.0)
+        lines = format_sweep(ranking).splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertIn("1.00x", lines[2])
+        self.assertIn("n/a", lines[3])
+
+    @patch("delphi.operations.database_metrics.sweep.get_variables")
+    @patch("delphi.operations.database_metrics.sweep.Worker.new_instance")
+    def test_measure_sweep(self, mock_worker, mock_variables):
+        client = MagicMock()
+        client.info.return_value = {"NCPU": 4}
+        worker = MagicMock()
+        worker.measure.side_effect = [fake_output(10, [1]), fake_output(5, [2])]
+        mock_worker.side_effect = [worker, RuntimeError("unknown variable"), worker]
+        mock_variables.side_effect = lambda container, names: {n: "x" for n in names}
+        output = measure_sweep({"innodb_flush_log_at_trx_commit": [1, 0, 2]}, [("a", "1")], client)
+        self.assertEqual(mock_worker.call_args[0][7], ["--innodb_flush_log_at_trx_commit=2"])
+        self.assertEqual(mock_worker.call_args[0][4], "0-3")
+        configs = output["configs"]
+        self.assertEqual(configs["innodb_flush_log_at_trx_commit=0"]["error"], "RuntimeError: unknown variable")
+        self.assertEqual(configs["innodb_flush_log_at_trx_commit=1"]["variables"],
+                         {"innodb_flush_log_at_trx_commit": "x"})
+        # tied on mean rank, so the faster loading configuration wins
+        self.assertEqual([r["config"] for r in output["ranking"]],
+                         ["innodb_flush_log_at_trx_commit=2", "innodb_flush_log_at_trx_commit=1"])
+        self.assertEqual(worker.remove.call_count, 2)
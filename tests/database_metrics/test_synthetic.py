@@ -0,0 +1,57 @@
+"""Tests for synthetic.py"""
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.synthetic'
+
+
+class TestSynthetic(unittest.TestCase):
+
+    def test_get_geo_ids(self):
+        self.assertEqual(list(get_geo_ids("county", 2)), ["01001", "01002"])
+        self.assertEqual(list(get_geo_ids("hrr", 3)), ["1", "2", "3"])
+        self.assertEqual(list(get_geo_ids("state", 2)), ["ak", "al"])
+        self.assertEqual(list(get_geo_ids("nation", 1)), ["us"])
+        with self.assertRaises(ValueError):
+            get_geo_ids("hhs", 11)
+        with self.assertRaises(ValueError):
+            get_geo_ids("zip", 1)
+
+    def test_format_fixed(self):
+        chars = format_fixed(np.array([1.23456, 0, 1e9]), 3, 2)
+        self.assertEqual([row.tobytes() for row in chars], [b"001.23", b"000.00", b"999.99"])
+        self.assertEqual(format_fixed(np.array([42]), 4, 0).tobytes(), b"0042")
+
+    def test_csv_template(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "a.csv")
+            template = CsvTemplate(np.array(["1", "22"]))
+            template.write(path, np.array([1.5, 2.25]), np.array([0.1, 0.2]), np.array([10, 20]))
+            with open(path) as f:
+                self.assertEqual(f.read(), "geo_id,val,se,sample_size\n"
+                                           "1,000001.5000,000000.1000,0010\n"
+                                           "22,000002.2500,000000.2000,0020\n")
+
+    def test_generate(self):
+        spec = {"type": "synthetic", "signals": ["a", "b"], "geo_types": {"county": 5, "state": 3},
+                "start_date": "20200301", "end_date": "20200302", "issues": 2, "seed": 7}
+        with tempfile.TemporaryDirectory() as tmp:
+            rows = generate(spec, os.path.join(tmp, "one"), workers=2)
+            generate(spec, os.path.join(tmp, "two"), workers=1)
+            self.assertEqual(rows, 2 * 2 * (5 + 3) * 2)
+            self.assertEqual(sorted(os.listdir(os.path.join(tmp, "one"))), ["issue_20200302", "issue_20200303"])
+            first = os.path.join(tmp, "one", "issue_20200302", "synthetic")
+            self.assertEqual(len(os.listdir(first)), 8)
+            revised = os.path.join(tmp, "one", "issue_20200303", "synthetic", "20200301_county_a.csv")
+            frame = pd.read_csv(revised, dtype={"geo_id": str})
+            self.assertEqual(list(frame.geo_id), ["01001", "01002", "01003", "01004", "01005"])
+            self.assertTrue((frame.val > 0).all())
+            for name in os.listdir(first):
+                with open(os.path.join(first, name), "rb") as f, \
+                        open(os.path.join(tmp, "two", "issue_20200302", "synthetic", name), "rb") as g:
+                    self.assertEqual(f.read(), g.read())
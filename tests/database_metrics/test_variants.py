@@ -0,0 +1,78 @@
+"""Tests for variants.py"""
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.variants'
+
+
+def fake_output(scale):
+    return {"datasets": [("a", "1")], "queries": [{}],
+            "load": [{"runtime": 10 * scale}], "meta": [{"runtime": 2 * scale, "db_size_mb": 100 * scale}],
+            "query0": [{"runtime": 0.5 * scale}]}
+
+
+class TestVariants(unittest.TestCase):
+
+    def test_load_variant(self):
+        self.assertEqual(load_variant({"name": "base"}), {"name": "base", "sql": ""})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "index.sql")
+            with open(path, "w") as f:
+                f.write("CREATE INDEX i ON covidcast (geo_value);")
+            self.assertEqual(load_variant({"name": "index", "path": path})["sql"],
+                             "CREATE INDEX i ON covidcast (geo_value);")
+        with self.assertRaises(ValueError):
+            load_variant({"sql": "SELECT 1"})
+        with self.assertRaises(ValueError):
+            load_variant({"name": "both", "sql": "SELECT 1", "path": "x.sql"})
+
+    def test_apply_variant(self):
+        container = MagicMock()
+        container.exec_run.return_value = MagicMock(exit_code=0, output=(None, None))
+        self.assertGreaterEqual(apply_variant(container, "ALTER TABLE covidcast ENGINE=Aria"), 0)
+        self.assertEqual(container.exec_run.call_args[0][0][-1], "USE epidata; ALTER TABLE covidcast ENGINE=Aria")
+        container.exec_run.return_value = MagicMock(exit_code=1, output=(None, b"ERROR 1064 (42000): syntax\n"))
+        with self.assertRaisesRegex(RuntimeError, "ERROR 1064"):
+            apply_variant(container, "ALTER")
+
+    def test_compare_variants(self):
+        comparison = compare_variants({"base": fake_output(1), "index": fake_output(2)})
+        self.assertEqual([row["metric"] for row in comparison], ["load_s", "meta_s", "db_size_mb", "query0_s"])
+        self.assertEqual(comparison[2]["values"], {"base": 100, "index": 200})
+        self.assertEqual(comparison[0]["ratios"], {"base": 1.0, "index": 2.0})
+        self.assertEqual(compare_variants({"base": fake_output(1), "index": fake_output(2)}, "index")[3]["ratios"],
+                         {"base": 0.5, "index": 1.0})
+        table = format_variants(comparison).splitlines()
+        self.assertEqual(len(table), 5)
+        self.assertIn("20.000 [2.00x]", table[1])
+        self.assertEqual(format_variants([]), "")
+        failed = dict(fake_output(2), query0=[{"failed_trials": [{"error": "HTTP 500"}]}])
+        comparison = compare_variants({"base": fake_output(1), "index": failed})
+        self.assertEqual(comparison[3]["values"]["index"], None)
+        self.assertEqual(comparison[3]["ratios"]["index"], None)
+        self.assertIn("n/a", format_variants(comparison).splitlines()[4])
+
+    @patch("delphi.operations.database_metrics.variants.apply_variant")
+    @patch("delphi.operations.database_metrics.variants.Worker.new_instance")
+    def test_measure_variants(self, mock_worker, mock_apply):
+        client = MagicMock()
+        client.info.return_value = {"NCPU": 8}
+        worker = mock_worker.return_value
+        worker.measure.side_effect = [fake_output(1), fake_output(3)]
+        mock_apply.return_value = 1.5
+        variants = [{"name": "base"}, {"name": "index", "sql": "CREATE INDEX i ON covidcast (geo_value)"}]
+        output = measure_variants(variants, [("a", "1")], client, cpus=4, repetitions=3)
+        self.assertEqual([c[0][1] for c in mock_worker.call_args_list], ["delphi_metrics_variant_0",
+                                                                        "delphi_metrics_variant_1"])
+        self.assertEqual(mock_worker.call_args[0][4], "0-3")
+        mock_apply.assert_called_once_with(worker.db, "CREATE INDEX i ON covidcast (geo_value)")
+        self.assertEqual(worker.measure.call_args[1], {"repetitions": 3})
+        self.assertEqual(worker.remove.call_count, 2)
+        self.assertEqual(output["variants"]["base"]["migration_s"], 0.0)
+        self.assertEqual(output["variants"]["index"]["migration_s"], 1.5)
+        self.assertEqual(output["comparison"][0]["ratios"]["index"], 3.0)
+        with self.assertRaises(ValueError):
+            measure_variants([{"name": "a"}, {"name": "a"}], [], client)
@@ -0,0 +1,43 @@
+"""Tests for worker.py"""
+import unittest
+from unittest.mock import MagicMock
+
+from docker.errors import ContainerError
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.database_metrics.worker'
+
+
+class TestWorker(unittest.TestCase):
+
+    def test_new_instance(self):
+        client = MagicMock()
+        container = client.containers.run.return_value
+        container.exec_run.return_value = MagicMock(exit_code=0, output=b"")
+        worker = WorkerContainer.new_instance(client, "image", "net", {"cpuset_cpus": "0"}, {"vol": {}})
+        kwargs = client.containers.run.call_args[1]
+        self.assertEqual(kwargs["command"], ["sleep", "infinity"])
+        self.assertTrue(kwargs["detach"])
+        self.assertEqual(kwargs["cpuset_cpus"], "0")
+        self.assertEqual(kwargs["volumes"], {"vol": {}})
+        self.assertEqual(sorted(worker.overhead), ["exec_s", "import_s", "python_s", "startup_s"])
+        self.assertIn("import delphi.epidata.acquisition.covidcast.csv_to_database",
+                      container.exec_run.call_args[0][0][2])
+
+    def test_run(self):
+        container = MagicMock()
+        container.exec_run.return_value = MagicMock(exit_code=0, output=b"done")
+        worker = WorkerContainer(container)
+        self.assertEqual(worker.run("echo done"), b"done")
+        container.exec_run.return_value = MagicMock(exit_code=2, output=b"failed")
+        with self.assertRaises(ContainerError):
+            worker.run("false")
+        worker.remove()
+        container.remove.assert_called_once_with(force=True)
+
+    def test_measure_startup(self):
+        client = MagicMock()
+        overhead = measure_startup(client, "image")
+        self.assertEqual(sorted(overhead), ["import_s", "startup_s"])
+        self.assertEqual(client.containers.run.call_args_list[0][1]["command"], ["true"])
+        self.assertTrue(client.containers.run.call_args[1]["remove"])
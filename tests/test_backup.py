@@ -0,0 +1,183 @@
+"""Unit tests for backup.py."""
+
+# standard library
+import argparse
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.backup'
+
+
+class UnitTests(unittest.TestCase):
+  """Basic unit tests."""
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.config = load_config()
+    self.config['dest'] = self.tmp.name
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def _args(self, **kwargs):
+    args = dict(config=None, stages=None, tag=None, dry_run=False, benchmark=False)
+    args.update(kwargs)
+    return MagicMock(**args)
+
+  def test_get_argument_parser(self):
+    """An ArgumentParser should be returned."""
+    self.assertIsInstance(get_argument_parser(), argparse.ArgumentParser)
+
+  def test_validate_args(self):
+    """Arguments should be validated."""
+
+    with self.subTest(name='unknown stage'):
+      with self.assertRaises(InvalidArgsException):
+        validate_args(self._args(stages='archive,compress'))
+
+    with self.subTest(name='bad tag'):
+      with self.assertRaises(InvalidArgsException):
+        validate_args(self._args(tag='yesterday'))
+
+    with self.subTest(name='dry run and benchmark'):
+      with self.assertRaises(InvalidArgsException):
+        validate_args(self._args(dry_run=True, benchmark=True))
+
+    with self.subTest(name='benchmark never ships'):
+      config, stages, tag, dry_run, benchmark = validate_args(self._args(benchmark=True))
+      self.assertNotIn('ship', stages)
+      self.assertEqual(len(tag), 15)
+
+  def test_load_config(self):
+    """Top-level keys of the config file replace the defaults."""
+    path = os.path.join(self.tmp.name, 'config.json')
+    with open(path, 'w') as f:
+      json.dump({'databases': ['epidata'], 'verify_workers': 8}, f)
+    config = load_config(path)
+    self.assertEqual(config['databases'], ['epidata'])
+    self.assertEqual(config['verify_workers'], 8)
+    self.assertEqual(config['retention'], DEFAULT_CONFIG['retention'])
+
+  def test_get_destination(self):
+    """Build destinations from their config."""
+    destination = get_destination({'type': 'local', 'path': '/mnt/usb'})
+    self.assertIsInstance(destination, LocalDestination)
+    with self.assertRaises(ValueError):
+      get_destination({'type': 'ftp'})
+
+  def test_plan(self):
+    """The plan describes every stage without running anything."""
+    lines = Backup.new_instance(self.config).plan('20210301_020000')
+    self.assertEqual(
+        [line[:-1] for line in lines if not line.startswith(' ')],
+        [stage.name for stage in STAGES])
+    text = '\n'.join(lines)
+    self.assertIn('--exclude flu_data', text)
+    self.assertIn('--ignore-table=epidata.covidcast_legacy', text)
+    self.assertIn('--password=***', text)
+    self.assertEqual(os.listdir(self.tmp.name), [])
+
+  def test_stage_is_abstract(self):
+    """A stage must implement both plan and run."""
+
+    class PlanOnly(Stage):
+      def plan(self, state):
+        return []
+
+    with self.assertRaises(TypeError):
+      Stage()
+    with self.assertRaises(TypeError):
+      PlanOnly()
+
+  def test_new_instance_selects_stages(self):
+    """Only the named stages are run, in plan order."""
+    backup = Backup.new_instance(self.config, ['verify', 'archive'])
+    self.assertEqual([s.name for s in backup.stages], ['archive', 'verify'])
+
+  @patch('delphi.operations.backup.lower_priority')
+  def test_run(self, mock_priority):
+    """Run each stage with shared state and time it."""
+    first, second = MagicMock(), MagicMock()
+    first.name, second.name = 'first', 'second'
+    first.run.return_value = 10
+    second.run.return_value = None
+    timings = Backup(self.config, [first, second]).run('20210301_020000')
+    self.assertEqual([t['stage'] for t in timings], ['first', 'second'])
+    self.assertEqual([t['bytes'] for t in timings], [10, None])
+    self.assertIs(first.run.call_args[0][0], second.run.call_args[0][0])
+    mock_priority.assert_called_once_with(19, IONICE_BEST_EFFORT, 7)
+    self.assertIn('first', format_timings(timings))
+
+  @patch('delphi.operations.backup.lower_priority')
+  def test_run_archive_bundle_verify(self, mock_priority):
+    """Archive a directory, bundle it, and verify the result."""
+    source = os.path.join(self.tmp.name, 'source')
+    os.makedirs(os.path.join(source, 'data'))
+    with open(os.path.join(source, 'data', 'file.txt'), 'w') as f:
+      f.write('hello')
+    self.config['dest'] = os.path.join(self.tmp.name, 'out')
+    os.mkdir(self.config['dest'])
+    self.config['directories'] = [
+      {'label': 'data', 'path': source, 'name': 'data', 'exclude': []},
+    ]
+    backup = Backup.new_instance(self.config, ['archive', 'bundle', 'verify'])
+    timings = backup.run('20210301_020000')
+    self.assertEqual(len(timings), 3)
+    manifest_path = os.path.join(self.config['dest'], 'backup_20210301_020000.manifest.json')
+    with open(manifest_path) as f:
+      manifest = json.load(f)
+    self.assertEqual(manifest['members'][0]['name'], 'backup_20210301_020000_data.tgz')
+    self.assertEqual([t['stage'] for t in manifest['stages']], ['archive', 'bundle', 'verify'])
+    self.assertIn('verified', manifest)
+    self.assertEqual(
+        sorted(os.listdir(self.config['dest'])),
+        ['backup_20210301_020000.manifest.json', 'backup_20210301_020000.tar'])
+
+  @patch('delphi.operations.backup.lower_priority')
+  def test_run_removes_partial_files(self, mock_priority):
+    """A run which fails before verification deletes the files it wrote."""
+    source = os.path.join(self.tmp.name, 'source')
+    os.makedirs(os.path.join(source, 'data'))
+    self.config['dest'] = os.path.join(self.tmp.name, 'out')
+    os.mkdir(self.config['dest'])
+    self.config['directories'] = [
+      {'label': 'data', 'path': source, 'name': 'data', 'exclude': []},
+    ]
+    previous = os.path.join(self.config['dest'], 'backup_20210228_020000.tar')
+    open(previous, 'w').close()
+    with patch('delphi.operations.backup.verify_archive', return_value=['checksum mismatch']):
+      with self.assertRaises(VerificationException):
+        Backup.new_instance(self.config, ['archive', 'bundle', 'verify']).run('20210301_020000')
+    self.assertEqual(os.listdir(self.config['dest']), ['backup_20210228_020000.tar'])
+
+  @patch('delphi.operations.backup.lower_priority')
+  def test_run_keeps_verified_archive(self, mock_priority):
+    """A verified archive is kept even if a later stage fails."""
+    verify_stage = MagicMock()
+    verify_stage.name = 'verify'
+
+    def verify(state):
+      open(state.create('backup_%s.tar' % state.tag), 'w').close()
+      state.verified = True
+
+    verify_stage.run.side_effect = verify
+    ship = MagicMock()
+    ship.name = 'ship'
+    ship.run.side_effect = OSError('offsite is down')
+    with self.assertRaises(OSError):
+      Backup(self.config, [verify_stage, ship]).run('20210301_020000')
+    self.assertEqual(os.listdir(self.tmp.name), ['backup_20210301_020000.tar'])
+
+  @patch('delphi.operations.backup.BackupRotator.new_instance')
+  def test_prune_runs_last(self, mock_rotator):
+    """Old backups are pruned after the new one is verified and shipped."""
+    self.assertEqual([stage.name for stage in STAGES][-3:], ['verify', 'ship', 'prune'])
+    PruneStage().run(BackupState(self.config, '20210301_020000'))
+    mock_rotator.return_value.prune.assert_called_once()
+    mock_rotator.return_value.check_free_space.return_value = (100, 10)
+    PrepareStage().run(BackupState(self.config, '20210301_020000'))
+    mock_rotator.return_value.prune.assert_called_once()
@@ -0,0 +1,141 @@
+"""Unit tests for backup_manifest.py."""
+
+# standard library
+import argparse
+import gzip
+import hashlib
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.backup_manifest'
+
+
+DUMP = (
+  b'-- MySQL dump\n'
+  b'USE `epidata`;\n'
+  b'INSERT INTO `fluview` VALUES (1,\'a\'),(2,\'b\'),(3,\'c\');\n'
+  b'INSERT INTO `fluview` VALUES (4,\'d\');\n'
+  b'USE `utils`;\n'
+  b'INSERT INTO `settings` VALUES (1,\'x\');\n'
+)
+
+
+class UnitTests(unittest.TestCase):
+  """Basic unit tests."""
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.dir = self.tmp.name
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def _make_backup(self):
+    """Write two members and a final archive, returning the manifest."""
+    records = [
+      stream_to_file(io.BytesIO(b'x' * 5000), os.path.join(self.dir, 'a.tgz')),
+      stream_to_file(
+          io.BytesIO(DUMP),
+          os.path.join(self.dir, 'b.sql.gz'),
+          compress=True,
+          row_counter=DumpRowCounter()),
+    ]
+    archive = os.path.join(self.dir, 'backup_20210301_020000.tar')
+    record = build_archive(archive, self.dir, ['a.tgz', 'b.sql.gz'])
+    manifest_path = get_manifest_path(archive)
+    write_manifest(manifest_path, '20210301_020000', record, records)
+    return archive, read_manifest(manifest_path)
+
+  def test_get_argument_parser(self):
+    """An ArgumentParser should be returned."""
+    self.assertIsInstance(get_argument_parser(), argparse.ArgumentParser)
+
+  def test_validate_args(self):
+    """Arguments should be validated."""
+
+    with self.subTest(name='no command'):
+      with self.assertRaises(InvalidArgsException):
+        validate_args(MagicMock(command=None))
+
+    with self.subTest(name='no workers'):
+      with self.assertRaises(InvalidArgsException):
+        validate_args(MagicMock(command='verify', workers=0))
+
+    with self.subTest(name='default manifest'):
+      args = MagicMock(command='verify', archive='/b/backup_x.tar', manifest=None, workers=2)
+      self.assertEqual(
+          validate_args(args)[:4],
+          ('verify', '/b/backup_x.tar', '/b/backup_x.manifest.json', 2))
+
+  def test_hashing_writer(self):
+    """Hash and count bytes as they pass through."""
+    sink = io.BytesIO()
+    writer = HashingWriter(sink)
+    writer.write(b'hello ')
+    writer.write(b'world')
+    self.assertEqual(writer.bytes, 11)
+    self.assertEqual(writer.tell(), 11)
+    self.assertEqual(writer.sha256.hexdigest(), hashlib.sha256(b'hello world').hexdigest())
+    self.assertEqual(sink.getvalue(), b'hello world')
+
+  def test_dump_row_counter(self):
+    """Count extended insert tuples per table."""
+    counter = DumpRowCounter()
+    for line in io.BytesIO(DUMP):
+      counter.feed(line)
+    self.assertEqual(counter.rows, {'epidata.fluview': 4, 'utils.settings': 1})
+
+  def test_stream_to_file(self):
+    """The record describes the file exactly as written."""
+    path = os.path.join(self.dir, 'b.sql.gz')
+    record = stream_to_file(
+        io.BytesIO(DUMP), path, compress=True, row_counter=DumpRowCounter())
+    with open(path, 'rb') as f:
+      data = f.read()
+    self.assertEqual(gzip.decompress(data), DUMP)
+    self.assertEqual(record['name'], 'b.sql.gz')
+    self.assertEqual(record['bytes'], len(data))
+    self.assertEqual(record['sha256'], hashlib.sha256(data).hexdigest())
+    self.assertEqual(record['rows']['epidata.fluview'], 4)
+
+  def test_stream_to_file_limiter(self):
+    """Every block read is counted against the limiter."""
+    limiter = MagicMock()
+    stream_to_file(
+        io.BytesIO(DUMP), os.path.join(self.dir, 'b.sql'),
+        row_counter=DumpRowCounter(), limiter=limiter)
+    self.assertEqual(sum(c[0][0] for c in limiter.consume.call_args_list), len(DUMP))
+
+  def test_stream_command_to_file(self):
+    """Fail when the command fails."""
+    path = os.path.join(self.dir, 'out')
+    record = stream_command_to_file('printf abc', path)
+    self.assertEqual(record['bytes'], 3)
+    with self.assertRaises(subprocess.CalledProcessError):
+      stream_command_to_file('exit 3', path)
+
+  def test_verify_archive(self):
+    """Detect missing and corrupt members."""
+    archive, manifest = self._make_backup()
+
+    with self.subTest(name='intact'):
+      self.assertEqual(verify_archive(archive, manifest), [])
+      self.assertEqual(manifest['sha256'], hashlib.sha256(open(archive, 'rb').read()).hexdigest())
+
+    with self.subTest(name='missing member'):
+      manifest['members'].append({'name': 'c.tgz', 'bytes': 1, 'sha256': ''})
+      self.assertEqual(verify_archive(archive, manifest), ['c.tgz: missing from archive'])
+      manifest['members'].pop()
+
+    with self.subTest(name='corrupt member'):
+      with tarfile.open(archive) as tar:
+        offset = tar.getmember('a.tgz').offset_data
+      with open(archive, 'r+b') as f:
+        f.seek(offset + 100)
+        f.write(b'y')
+      self.assertEqual(verify_archive(archive, manifest, workers=2), ['a.tgz: checksum mismatch'])
@@ -0,0 +1,38 @@
+"""Unit tests for backup_priority.py."""
+
+# standard library
+import unittest
+from unittest.mock import MagicMock
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.backup_priority'
+
+
+class UnitTests(unittest.TestCase):
+  """Basic unit tests."""
+
+  def setUp(self):
+    self.os = MagicMock()
+    self.os.nice.return_value = 5
+    self.os.getpid.return_value = 123
+    self.subprocess = MagicMock()
+
+  def test_lower_priority(self):
+    """Raise niceness and set the I/O class of this process."""
+    lower_priority(19, IONICE_BEST_EFFORT, 7, self.os, self.subprocess)
+    self.os.nice.assert_called_with(14)
+    self.subprocess.check_call.assert_called_once_with(
+        ['ionice', '-c', '2', '-n', '7', '-p', '123'])
+
+  def test_lower_priority_idle(self):
+    """The idle class has no levels."""
+    lower_priority(None, IONICE_IDLE, 7, self.os, self.subprocess)
+    self.os.nice.assert_not_called()
+    self.subprocess.check_call.assert_called_once_with(
+        ['ionice', '-c', '3', '-p', '123'])
+
+  def test_lower_priority_never_raises_priority(self):
+    """Niceness below the current value is ignored."""
+    lower_priority(0, None, None, self.os, self.subprocess)
+    self.os.nice.assert_called_once_with(0)
+    self.subprocess.check_call.assert_not_called()
@@ -0,0 +1,159 @@
+"""Unit tests for backup_retention.py."""
+
+# standard library
+import argparse
+import datetime
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.backup_retention'
+
+
+class UnitTests(unittest.TestCase):
+  """Basic unit tests."""
+
+  def setUp(self):
+    self.directory = MagicMock()
+    self.directory.list.return_value = [
+      'backup_20210101_020000.manifest.json',
+      'backup_20210101_020000.tar',
+      'backup_20210215_020000.tar',
+      'backup_20210228_020000.tar',
+      'backup_20210301_020000.tar',
+      'backup_20210302_020000.tar',
+      'backup_20210302_140000.tar',
+      'backup_20210302_140000_auto.tgz',
+      'notes.txt',
+    ]
+    self.directory.size.side_effect = lambda name: 100 + int(name[11:13])
+    self.directory.read_json.return_value = {'verified': '2021-03-02T15:00:00'}
+    self.rotator = BackupRotator(self.directory)
+
+  def test_get_argument_parser(self):
+    """An ArgumentParser should be returned."""
+    self.assertIsInstance(get_argument_parser(), argparse.ArgumentParser)
+
+  def test_validate_args(self):
+    """Arguments should be validated."""
+
+    with self.subTest(name='negative count'):
+      with self.assertRaises(InvalidArgsException):
+        validate_args(MagicMock(daily=-1, weekly=4, monthly=6))
+
+    with self.subTest(name='valid counts'):
+      dest, policy, dry_run = validate_args(
+          MagicMock(dest='x', daily=7, weekly=4, monthly=6, dry_run=True))
+      self.assertEqual((dest, dry_run), ('x', True))
+      self.assertEqual((policy.daily, policy.weekly, policy.monthly), (7, 4, 6))
+
+  def test_backup_rotator_new_instance(self):
+    """Acquire a production-ready instance."""
+    self.assertIsInstance(BackupRotator.new_instance(), BackupRotator)
+
+  def test_list_backups(self):
+    """Only finished backups are listed, oldest first."""
+    backups = self.rotator.list_backups()
+    self.assertEqual(len(backups), 6)
+    self.assertEqual(backups[0], (
+      datetime.datetime(2021, 1, 1, 2), 'backup_20210101_020000.tar'))
+    self.assertEqual(backups[-1][1], 'backup_20210302_140000.tar')
+
+  def test_policy_select(self):
+    """Keep the newest backup in each of the most recent periods."""
+    t = lambda *args: datetime.datetime(2021, *args)
+    timestamps = [t(1, 1), t(2, 15), t(2, 28), t(3, 1), t(3, 2), t(3, 2, 14)]
+
+    with self.subTest(name='daily only'):
+      keep = RetentionPolicy(2, 0, 0).select(timestamps)
+      self.assertEqual(keep, {t(3, 1), t(3, 2, 14)})
+
+    with self.subTest(name='monthly only'):
+      keep = RetentionPolicy(0, 0, 3).select(timestamps)
+      self.assertEqual(keep, {t(1, 1), t(2, 28), t(3, 2, 14)})
+
+    with self.subTest(name='weekly'):
+      # 2021-02-28 is a Sunday, so it ends the week before 2021-03-01
+      keep = RetentionPolicy(0, 2, 0).select(timestamps)
+      self.assertEqual(keep, {t(2, 28), t(3, 2, 14)})
+
+    with self.subTest(name='keep newest'):
+      self.assertEqual(RetentionPolicy(0, 0, 0).select(timestamps), {t(3, 2, 14)})
+
+    with self.subTest(name='empty'):
+      self.assertEqual(RetentionPolicy(1, 1, 1).select([]), set())
+
+  def test_prune(self):
+    """Delete backups not selected by the policy."""
+
+    with self.subTest(name='dry run'):
+      removed = self.rotator.prune(RetentionPolicy(1, 0, 0), dry_run=True)
+      self.assertEqual(len(removed), 6)
+      self.directory.remove.assert_not_called()
+
+    with self.subTest(name='prune'):
+      removed = self.rotator.prune(RetentionPolicy(2, 0, 0))
+      self.assertEqual(removed, [
+        'backup_20210101_020000.manifest.json',
+        'backup_20210101_020000.tar',
+        'backup_20210215_020000.tar',
+        'backup_20210228_020000.tar',
+        'backup_20210302_020000.tar',
+      ])
+      self.assertEqual(self.directory.remove.call_count, 5)
+
+  def test_prune_unverified(self):
+    """Unverified backups are neither counted nor deleted."""
+    unverified = {'backup_20210302_140000.manifest.json', 'backup_20210301_020000.manifest.json'}
+    self.directory.read_json.side_effect = lambda name: (
+        {'tag': name[7:22]} if name in unverified else {'verified': '2021-03-02T15:00:00'})
+    self.assertFalse(self.rotator.is_verified('backup_20210302_140000.tar'))
+    self.assertTrue(self.rotator.is_verified('backup_20210302_020000.tar'))
+
+    removed = self.rotator.prune(RetentionPolicy(1, 0, 0))
+    # the newest verified backup is kept, rather than the newest archive
+    self.assertEqual(removed, [
+      'backup_20210101_020000.manifest.json',
+      'backup_20210101_020000.tar',
+      'backup_20210215_020000.tar',
+      'backup_20210228_020000.tar',
+    ])
+
+  def test_backup_directory_read_json(self):
+    """Missing and malformed JSON files read as None."""
+    with tempfile.TemporaryDirectory() as path:
+      with open(os.path.join(path, 'good.json'), 'w') as f:
+        f.write('{"verified": "now"}')
+      with open(os.path.join(path, 'bad.json'), 'w') as f:
+        f.write('{"verif')
+      directory = BackupDirectory(path)
+      self.assertEqual(directory.read_json('good.json'), {'verified': 'now'})
+      self.assertIsNone(directory.read_json('bad.json'))
+      self.assertIsNone(directory.read_json('missing.json'))
+
+  def test_estimate_next_size(self):
+    """Project the next size from the largest recent backup."""
+    self.assertEqual(self.rotator.estimate_next_size(), 103)
+    self.assertEqual(self.rotator.estimate_next_size(history=1), 103)
+
+    self.directory.list.return_value = []
+    self.assertEqual(self.rotator.estimate_next_size(), 0)
+
+  def test_check_free_space(self):
+    """Raise when the projected backup won't fit."""
+
+    with self.subTest(name='enough space'):
+      self.directory.free_bytes.return_value = 1000
+      self.assertEqual(self.rotator.check_free_space(), (1000, 206))
+
+    with self.subTest(name='not enough space'):
+      self.directory.free_bytes.return_value = 200
+      with self.assertRaises(InsufficientSpaceException):
+        self.rotator.check_free_space()
+
+    with self.subTest(name='minimum free space'):
+      self.directory.free_bytes.return_value = 1000
+      with self.assertRaises(InsufficientSpaceException):
+        self.rotator.check_free_space(headroom=1, min_free_bytes=900)
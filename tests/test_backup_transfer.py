@@ -0,0 +1,159 @@
+"""Unit tests for backup_transfer.py."""
+
+# standard library
+import argparse
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+# py3tester coverage target
+__test_target__ = 'delphi.operations.backup_transfer'
+
+
+class UnitTests(unittest.TestCase):
+  """Basic unit tests."""
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.source = os.path.join(self.tmp.name, 'backup_20210301_020000.tar')
+    self.data = bytes(range(256)) * 40
+    with open(self.source, 'wb') as f:
+      f.write(self.data)
+    self.sha256 = hashlib.sha256(self.data).hexdigest()
+    self.dest = os.path.join(self.tmp.name, 'dest')
+    os.mkdir(self.dest)
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_get_argument_parser(self):
+    """An ArgumentParser should be returned."""
+    self.assertIsInstance(get_argument_parser(), argparse.ArgumentParser)
+
+  def test_validate_args(self):
+    """Arguments should be validated."""
+
+    with self.subTest(name='negative limit'):
+      with self.assertRaises(InvalidArgsException):
+        validate_args(MagicMock(limit=-1))
+
+    with self.subTest(name='small s3 parts'):
+      with self.assertRaises(InvalidArgsException):
+        validate_args(MagicMock(limit=0, part_size=1, destination='s3://b/'))
+
+    with self.subTest(name='valid'):
+      args = MagicMock(
+          archive='a', destination='/mnt', endpoint_url=None, limit=1.5,
+          part_size=8, workers=2)
+      self.assertEqual(
+          validate_args(args), ('a', '/mnt', None, 1572864, 8 << 20, 2))
+
+  def test_rate_limiter(self):
+    """Sleep long enough to keep the average rate under the cap."""
+    mock_time = MagicMock()
+    mock_time.time.return_value = 0
+    limiter = RateLimiter(100, time_impl=mock_time)
+
+    with self.subTest(name='burst allowance'):
+      limiter.consume(100)
+      mock_time.sleep.assert_not_called()
+
+    with self.subTest(name='over the cap'):
+      limiter.consume(50)
+      mock_time.sleep.assert_called_once_with(0.5)
+
+    with self.subTest(name='unlimited'):
+      RateLimiter(None, time_impl=mock_time).consume(10**9)
+      self.assertEqual(mock_time.sleep.call_count, 1)
+
+  def test_throttled_reader(self):
+    """Consume from the limiter for each read, as the part is sent."""
+    limiter = MagicMock()
+    body = ThrottledReader(b'x' * 10, limiter)
+    self.assertEqual(body.read(4), b'xxxx')
+    self.assertEqual(body.read(), b'x' * 6)
+    self.assertEqual(body.read(4), b'')
+    self.assertEqual([c[0][0] for c in limiter.consume.call_args_list], [4, 6, 0])
+
+  def test_send_local_throttles_chunks(self):
+    """Throttle each chunk of a part rather than the whole part up front."""
+    limiter = MagicMock()
+    transfer = Transfer(LocalDestination(self.dest), limiter, part_size=len(self.data))
+    with patch('delphi.operations.backup_transfer.CHUNK_SIZE', 1000):
+      transfer.send(self.source, self.sha256)
+    sizes = [c[0][0] for c in limiter.consume.call_args_list]
+    self.assertEqual(sum(sizes), len(self.data))
+    self.assertEqual(max(sizes), 1000)
+
+  def test_send_local(self):
+    """Copy an archive in parts and check the copy."""
+    transfer = Transfer(LocalDestination(self.dest), part_size=1000, workers=3)
+    transfer.send(self.source, self.sha256)
+    with open(os.path.join(self.dest, os.path.basename(self.source)), 'rb') as f:
+      self.assertEqual(f.read(), self.data)
+    self.assertEqual(os.listdir(self.dest), [os.path.basename(self.source)])
+    self.assertFalse(os.path.exists(get_state_path(self.source)))
+
+  def test_send_local_resumes(self):
+    """Only the parts which didn't finish are sent again."""
+    destination = LocalDestination(self.dest)
+    put_part = destination.put_part
+
+    def fail_on_last_part(handle, name, number, *args):
+      if number == 11:
+        raise IOError('interrupted')
+      return put_part(handle, name, number, *args)
+
+    with self.subTest(name='interrupted'):
+      destination.put_part = MagicMock(side_effect=fail_on_last_part)
+      with self.assertRaises(IOError):
+        Transfer(destination, part_size=1000, workers=1).send(self.source, self.sha256)
+      self.assertTrue(os.path.exists(get_state_path(self.source)))
+
+    with self.subTest(name='resumed'):
+      destination.put_part = MagicMock(side_effect=put_part)
+      Transfer(destination, part_size=1000, workers=2).send(self.source, self.sha256)
+      sent = sorted(call[0][2] for call in destination.put_part.call_args_list)
+      self.assertEqual(sent, [11])
+      with open(os.path.join(self.dest, os.path.basename(self.source)), 'rb') as f:
+        self.assertEqual(f.read(), self.data)
+
+  def test_send_local_detects_corruption(self):
+    """Fail when a part lands differently than it was sent."""
+    destination = LocalDestination(self.dest)
+    destination.put_part = MagicMock(return_value='0' * 32)
+    with self.assertRaises(TransferException):
+      Transfer(destination, part_size=1000).send(self.source, self.sha256)
+
+  def test_s3_check(self):
+    """Compare the multipart ETag, size, and checksum metadata."""
+    parts = {1: hashlib.md5(b'a').hexdigest(), 2: hashlib.md5(b'b').hexdigest()}
+    etag = hashlib.md5(
+        hashlib.md5(b'a').digest() + hashlib.md5(b'b').digest()).hexdigest()
+    client = MagicMock()
+    client.head_object.return_value = {
+      'ContentLength': 2,
+      'ETag': '"%s-2"' % etag,
+      'Metadata': {'sha256': 'abc'},
+    }
+    destination = S3Destination(client, 'bucket', 'backups/')
+
+    with self.subTest(name='match'):
+      self.assertEqual(destination.check('x.tar', 2, 'abc', parts), [])
+
+    with self.subTest(name='mismatch'):
+      self.assertEqual(len(destination.check('x.tar', 3, 'def', parts)), 2)
+
+  def test_s3_resume(self):
+    """Reuse an open multipart upload and the parts the server has."""
+    client = MagicMock()
+    client.list_multipart_uploads.return_value = {'Uploads': [{'UploadId': 'u1'}]}
+    client.get_paginator.return_value.paginate.return_value = [
+      {'Parts': [{'PartNumber': 1, 'ETag': '"aa"'}]},
+    ]
+    destination = S3Destination(client, 'bucket')
+    self.assertEqual(destination.begin('x.tar', 1, 'abc', 'u1'), 'u1')
+    self.assertEqual(destination.completed_parts('u1', 'x.tar', {}), {1: 'aa'})
+    client.create_multipart_upload.assert_not_called()